@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
 import os
 import json
-import openai
-from openai import OpenAI
+import logging
+from ...core import metrics, sessions
+from ...core.clients import get_async_openai_client
+from ...core.config import CHAT_SUMMARY_MODEL
+from ...core.jsonstream import ObjectStream
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -15,11 +21,17 @@ def get_api_key(x_api_key: Optional[str] = Header(default=None)):
 
 class ChatRequest(BaseModel):
     prompt: str
+    # Server-side history (needs x-user-id): continue ``session_id``, or set
+    # ``new_session`` to start one seeded with ``history``. Without either the
+    # request is stateless and uses ``history`` as sent.
+    session_id: Optional[str] = None
+    new_session: bool = False
     history: Optional[List[Dict[str, str]]] = None
 
 class ChatResponse(BaseModel):
     message: str
     action: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
 
 # System prompt with knowledge about the platform
 SYSTEM_PROMPT = """You are Karate AI, an expert assistant for a node-based AI creative platform.
@@ -30,8 +42,11 @@ PLATFORM CAPABILITIES:
 - Models: Stable Diffusion 3.5, Flux Pro, Imagen 4, DALL-E 3, Veo 2 (Video), Runway Gen-3.
 - Tools: Upscale (2x/4x), Inpaint, Remove Background.
 
+RESPONSE FORMAT:
+Always respond with one JSON object, "message" first: {"message": "<your reply to the user>", "workflow": <workflow object or null>}
+
 WORKFLOW FORMAT:
-If the user asks to build/create a workflow, you MUST return a JSON object in your response (inside a ```json block or just strict JSON) with the following structure:
+If the user asks to build/create a workflow, you MUST set "workflow" to a JSON object with the following structure:
 {
   "type": "create_workflow",
   "nodes": [
@@ -51,46 +66,145 @@ KNOWN PUBLIC WORKFLOWS (Examples):
 If the user asks a general question, just reply with helpful text.
 """
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat_agent(req: ChatRequest):
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
+CHAT_MODEL = "gpt-4o"
+FALLBACK_MESSAGE = "I'm having trouble connecting to my brain right now. But I can help you manually!"
+SUMMARY_PROMPT = """You maintain the running summary of a conversation between a user and Karate AI.
+Merge the new turns into the current summary. Keep the user's goals, preferences, chosen models and every
+detail of workflows that were built (nodes, settings, connections); drop pleasantries. Reply with the summary only."""
+
+def _messages(req: ChatRequest) -> List[Dict[str, str]]:
     messages = [{"role": "system", "content": SYSTEM_PROMPT}]
     if req.history:
         messages.extend(req.history)
     messages.append({"role": "user", "content": req.prompt})
+    return messages
+
+async def _prepare(req: ChatRequest, user_id: Optional[str]) -> Tuple[List[Dict[str, str]], Optional[sessions.Session]]:
+    """Prompt messages from the stored session; the client's history for stateless requests or without Redis."""
+    if not user_id or not (req.session_id or req.new_session):
+        return _messages(req), None
+    session = await sessions.open_session(user_id, req.session_id, seed=req.history)
+    if session is None:
+        return _messages(req), None
+    metrics.CHAT_TOKENS_SAVED.observe(session.tokens_saved)
+    return session.messages(SYSTEM_PROMPT, req.prompt), session
 
+def _reply(content: str, session: Optional[sessions.Session] = None) -> ChatResponse:
+    session_id = session.id if session else None
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4o", # Or gpt-4-turbo, or gpt-3.5-turbo if 4o not avail
-            messages=messages,
-            response_format={"type": "json_object"} # Force JSON to make parsing easier if we want strict actions, but we might want text too. 
-            # Actually, we want mixed text/action. Let's not force JSON object for the WHOLE response, 
-            # or we force it and have a field "message" and "workflow".
-        )
-        
-        # To support both text and structure robustly, we can ask for JSON always:
-        # { "message": "Sure, here is...", "workflow": { ... } }
-        # Let's update SYSTEM PROMPT to enforce this JSON structure.
-        
-        content = completion.choices[0].message.content
-        try:
-            data = json.loads(content)
-            return ChatResponse(
-                message=data.get("message", ""),
-                action=data.get("workflow")
-            )
-        except json.JSONDecodeError:
-            # Fallback if it didn't return JSON
-            return ChatResponse(message=content)
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        # Fallback if it didn't return JSON
+        return ChatResponse(message=content, session_id=session_id)
+    return ChatResponse(message=data.get("message", ""), action=data.get("workflow"), session_id=session_id)
+
+def _openai_client() -> Any:
+    # Shared async client (one connection pool per event loop): a slow
+    # completion no longer blocks the loop for every other request
+    return get_async_openai_client(os.getenv("OPENAI_API_KEY") or "")
+
+async def _create_completion(messages: List[Dict[str, str]], stream: bool = False) -> Any:
+    params: Dict[str, Any] = {"stream_options": {"include_usage": True}} if stream else {}
+    return await _openai_client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        response_format={"type": "json_object"},
+        stream=stream,
+        **params,
+    )
+
+def _record_usage(usage: Any) -> None:
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    metrics.CHAT_PROMPT_TOKENS.labels("hit").inc(cached)
+    metrics.CHAT_PROMPT_TOKENS.labels("miss").inc(max(0, usage.prompt_tokens - cached))
+
+async def _summarize(summary: str, turns: List[Dict[str, str]]) -> str:
+    transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+    completion = await _openai_client().chat.completions.create(
+        model=CHAT_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"},
+        ],
+    )
+    return completion.choices[0].message.content or summary
 
+async def _record_turn(session: Optional[sessions.Session], prompt: str, content: str) -> None:
+    if session is not None:
+        await sessions.record_turns(session, [{"role": "user", "content": prompt}, {"role": "assistant", "content": content}])
+
+async def _compact(session: Optional[sessions.Session]) -> None:
+    if session is not None:
+        await sessions.compact(session.user_id, session.id, _summarize)
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat_agent(req: ChatRequest, background_tasks: BackgroundTasks, x_user_id: Optional[str] = Header(default=None)):
+    try:
+        messages, session = await _prepare(req, x_user_id)
+        completion = await _create_completion(messages)
+        _record_usage(completion.usage)
+        content = completion.choices[0].message.content or ""
+        await _record_turn(session, req.prompt, content)
+        # Summarizing older turns is not on this reply's critical path
+        background_tasks.add_task(_compact, session)
+        return _reply(content, session)
     except Exception as e:
-        print(f"Agent Error: {e}")
+        logger.error(f"Agent Error: {e}")
         # Fallback mock response if OpenAI fails
-        return ChatResponse(
-            message="I'm having trouble connecting to my brain right now. But I can help you manually!", 
-            action=None
-        )
+        return ChatResponse(message=FALLBACK_MESSAGE, action=None, session_id=req.session_id)
+
+def _event(name: str, data: Any) -> str:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+async def _chat_events(req: ChatRequest, user_id: Optional[str]) -> AsyncIterator[str]:
+    """SSE for a streamed reply: "token" events with message text as it arrives,
+    "action" as soon as the workflow object is complete, then "done" with the full reply."""
+    content: List[str] = []
+    parser: Optional[ObjectStream] = ObjectStream()
+    session = None
+    try:
+        messages, session = await _prepare(req, user_id)
+        stream = await _create_completion(messages, stream=True)
+        async with stream:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    _record_usage(chunk.usage)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                content.append(delta)
+                if parser is None:
+                    continue
+                try:
+                    events = parser.feed(delta)
+                except ValueError:
+                    # Not the JSON we asked for; the whole text is sent with "done"
+                    parser = None
+                    continue
+                for kind, key, value in events:
+                    if kind == "text" and key == "message":
+                        yield _event("token", {"text": value})
+                    elif kind == "field" and key == "workflow" and value:
+                        yield _event("action", value)
+        await _record_turn(session, req.prompt, "".join(content))
+    except Exception as e:
+        logger.error(f"Agent stream error: {e}")
+        yield _event("error", {"message": FALLBACK_MESSAGE})
+        yield _event("done", ChatResponse(message=FALLBACK_MESSAGE, session_id=req.session_id).model_dump())
+        return
+    yield _event("done", _reply("".join(content), session).model_dump())
+    await _compact(session)
+
+@router.post("/chat/stream")
+async def chat_agent_stream(req: ChatRequest, x_user_id: Optional[str] = Header(default=None)):
+    return StreamingResponse(
+        _chat_events(req, x_user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @router.post("/support")
 async def support_agent(req: dict):
@@ -1,9 +1,27 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, Dict
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Optional, Dict, List, Tuple
+import json
+import logging
 import os
-from ...core.config import MODEL_COSTS
-from ...workers.tasks import run_ai_model_background, get_task_status
+import uuid
+from ...core import credits, metrics
+from ...core.blobs import BlobError, BlobTooLarge, blob_path, intern_data_uri, is_blob_handle, save_blob_stream, sniff_content_type
+from ...core.cache import cache_stats, get_cached_result, is_cacheable, make_cache_key
+from ...core.clients import pool_stats
+from ...core.limits import limiter_snapshot
+from ...core.status import TERMINAL_STATUSES, storage_report
+from ...core.config import BLOB_MAX_BYTES, MAX_BATCH_ITEMS, MAX_BULK_STATUS, SPECULATION_MAX_SLOTS
+from ...core.models import get_registry, publish_reload, resolve, split_params
+from ...core.events import subscribe_task_events
+from ...workers.client import (
+    run_ai_model_background, get_task_status, get_task_statuses, complete_from_cache,
+    enqueue_batch, save_batch, get_batch_status, cancel_task, speculate, withdraw_speculation,
+)
+
+logger = logging.getLogger(__name__)
 
 def get_api_key(x_api_key: Optional[str] = Header(default=None)):
     # In production, use security APIKeyHeader and secrets comparison
@@ -31,24 +49,32 @@ class InferRequest(BaseModel):
     output_format: Optional[str] = None
     safety_tolerance: Optional[int] = None
     seed: Optional[int] = None
+    cache: bool = Field(default=True, description="Reuse/store results for seeded jobs; set false to always run")
 
 @router.get("/models", response_model=Dict[str, int])
 async def get_models():
     """Return list of available models and their token costs."""
-    return MODEL_COSTS
+    return {model: spec.cost for model, spec in get_registry().items()}
 
-@router.post("/infer")
-async def infer(req: InferRequest, x_user_id: Optional[str] = Header(default=None), _: Optional[bool] = Depends(get_api_key)):
-    model = req.model
-    
-    # Allow known models OR valid Replicate slugs (owner/name)
-    if model not in MODEL_COSTS and "/" not in model:
-        raise HTTPException(status_code=400, detail="Unknown model")
-    
-    uid = x_user_id
-    if not uid:
-        raise HTTPException(status_code=401, detail="Missing user ID")
-    # New async path: return task_id immediately
+@router.post("/models/reload")
+async def reload_models(_: Optional[bool] = Depends(get_api_key)):
+    """Rebuild the model registry here and signal workers to do the same."""
+    registry = await run_in_threadpool(publish_reload)
+    return {"models": len(registry)}
+
+class BatchInferRequest(BaseModel):
+    items: List[InferRequest] = Field(..., min_length=1, max_length=MAX_BATCH_ITEMS)
+
+class SpeculateRequest(BaseModel):
+    slots: Dict[str, Optional[InferRequest]] = Field(
+        ..., description="Likely-next job per slot (e.g. a downstream node id); null withdraws the slot's job"
+    )
+
+def _spec_error(req: "InferRequest") -> Optional[str]:
+    """Why the request cannot run as given, or None. Known models and Replicate slugs (owner/name) pass."""
+    return "Unknown model" if resolve(req.model) is None else None
+
+def _extra_params(req: InferRequest) -> Dict[str, Any]:
     # Pass all extra arguments as kwargs
     extra_params = {
         "image": req.image,
@@ -61,13 +87,331 @@ async def infer(req: InferRequest, x_user_id: Optional[str] = Header(default=Non
     }
     # Filter out None values
     extra_params = {k: v for k, v in extra_params.items() if v is not None}
+    spec = resolve(req.model)
+    if spec is None:
+        return extra_params
+    # Params the model ignores stay out of the task and its cache key
+    extra_params, dropped = split_params(spec, extra_params)
+    if dropped:
+        logger.info(f"Dropping params {req.model} does not accept: {', '.join(dropped)}")
+    return extra_params
+
+BLOB_PARAMS = ("image", "mask")
+
+async def _intern_inputs(extra_params: Dict[str, Any]) -> Dict[str, Any]:
+    """Move large inline data URIs into the blob store and check that referenced blobs exist."""
+    for k in BLOB_PARAMS:
+        value = extra_params.get(k)
+        if not isinstance(value, str):
+            continue
+        try:
+            if is_blob_handle(value):
+                if not os.path.exists(blob_path(value)):
+                    raise HTTPException(status_code=400, detail=f"Unknown blob for {k}")
+            elif value.startswith("data:"):
+                extra_params[k] = await run_in_threadpool(intern_data_uri, value)
+        except BlobTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except BlobError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return extra_params
+
+async def _lookup_cache(req: InferRequest, extra_params: Dict[str, Any], uid: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Return (cache_key, completed response on hit)."""
+    if not is_cacheable(extra_params, req.cache):
+        return None, None
+    cache_key = make_cache_key(req.model, req.prompt, extra_params)
+    cached = await run_in_threadpool(get_cached_result, cache_key)
+    if cached:
+        try:
+            task_id = await run_in_threadpool(complete_from_cache, cached, uid)
+            return cache_key, {"task_id": task_id, "status": "completed", "output_url": cached.get("output_url"), "cached": True}
+        except Exception:
+            # Result backend unavailable; fall through and run the job normally
+            pass
+    return cache_key, None
+
+@router.post("/infer")
+async def infer(req: InferRequest, x_user_id: Optional[str] = Header(default=None), _: Optional[bool] = Depends(get_api_key)):
+    model = req.model
+    
+    error = _spec_error(req)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
     
-    task_id = await run_ai_model_background(model=model, prompt=req.prompt, user_id=uid, **extra_params)
+    uid = x_user_id
+    if not uid:
+        raise HTTPException(status_code=401, detail="Missing user ID")
+    # New async path: return task_id immediately
+    extra_params = await _intern_inputs(_extra_params(req))
+
+    cache_key, hit = await _lookup_cache(req, extra_params, uid)
+    if hit:
+        return hit
+
+    try:
+        with metrics.timed(metrics.ENQUEUE_SECONDS.labels("infer")):
+            task_id = await run_ai_model_background(model=model, prompt=req.prompt, user_id=uid, cache_key=cache_key, **extra_params)
+    except credits.InsufficientCredits as e:
+        raise HTTPException(status_code=402, detail=str(e))
     return {"task_id": task_id, "status": "processing"}
 
+@router.post("/infer/batch")
+async def infer_batch(req: BatchInferRequest, x_user_id: Optional[str] = Header(default=None), _: Optional[bool] = Depends(get_api_key)):
+    """Validate and enqueue many jobs at once; poll /status/batch/{batch_id} for grouped results."""
+    errors = {i: error for i, item in enumerate(req.items) if (error := _spec_error(item))}
+    if errors:
+        raise HTTPException(status_code=400, detail="; ".join(f"item {i}: {error}" for i, error in errors.items()))
+    uid = x_user_id
+    if not uid:
+        raise HTTPException(status_code=401, detail="Missing user ID")
+
+    jobs: List[Dict[str, Any]] = []
+    # Per item: ("task", task_id) for cache hits, ("job", index into jobs, slot)
+    placements: List[Tuple[str, Any, Optional[int]]] = []
+    coalesced: Dict[Tuple[str, str, str], int] = {}
+    for item in req.items:
+        extra_params = await _intern_inputs(_extra_params(item))
+        cache_key, hit = await _lookup_cache(item, extra_params, uid)
+        if hit:
+            placements.append(("task", hit["task_id"], None))
+            continue
+        spec = resolve(item.model)
+        max_n = spec.max_outputs if spec else 1
+        group_key = (item.model, item.prompt or "", json.dumps(extra_params, sort_keys=True))
+        j = coalesced.get(group_key)
+        if max_n > 1 and j is not None and jobs[j]["n"] < max_n:
+            placements.append(("job", j, jobs[j]["n"]))
+            jobs[j]["n"] += 1
+            continue
+        if max_n > 1:
+            coalesced[group_key] = len(jobs)
+        placements.append(("job", len(jobs), 0))
+        jobs.append({"model": item.model, "prompt": item.prompt, "user_id": uid, "params": extra_params, "n": 1, "cache_key": cache_key})
+
+    try:
+        with metrics.timed(metrics.ENQUEUE_SECONDS.labels("batch")):
+            task_ids = await run_in_threadpool(enqueue_batch, jobs) if jobs else []
+    except credits.InsufficientCredits as e:
+        raise HTTPException(status_code=402, detail=str(e))
+
+    entries = []
+    for kind, ref, slot in placements:
+        if kind == "task":
+            entries.append({"task_id": ref, "slot": None})
+        else:
+            entries.append({"task_id": task_ids[ref], "slot": slot if jobs[ref]["n"] > 1 else None})
+    batch_id = str(uuid.uuid4())
+    await run_in_threadpool(save_batch, batch_id, entries)
+    return {
+        "batch_id": batch_id,
+        "status": "processing",
+        "task_ids": [e["task_id"] for e in entries],
+        "upstream_calls": len(jobs),
+    }
+
+@router.post("/speculate")
+async def speculate_jobs(req: SpeculateRequest, x_user_id: Optional[str] = Header(default=None), _: Optional[bool] = Depends(get_api_key)):
+    """Pre-run jobs the user is likely to request next, at the lowest priority, into the result cache.
+
+    Registering new inputs for a slot cancels its previous job. A later /infer with the
+    same inputs (and seed) gets the cached result or joins the running job.
+    """
+    uid = x_user_id
+    if not uid:
+        raise HTTPException(status_code=401, detail="Missing user ID")
+    if len(req.slots) > SPECULATION_MAX_SLOTS:
+        raise HTTPException(status_code=400, detail=f"At most {SPECULATION_MAX_SLOTS} slots")
+    errors = {slot: error for slot, item in req.slots.items() if item is not None and (error := _spec_error(item))}
+    errors.update({slot: "speculative jobs need a seed (and cache enabled) so their result can be reused"
+                   for slot, item in req.slots.items()
+                   if item is not None and slot not in errors and not is_cacheable(_extra_params(item), item.cache)})
+    if errors:
+        raise HTTPException(status_code=400, detail="; ".join(f"slot {slot}: {error}" for slot, error in errors.items()))
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for slot, item in req.slots.items():
+        if item is None:
+            cancelled = await run_in_threadpool(withdraw_speculation, uid, slot)
+            results[slot] = {"status": "withdrawn" if cancelled else "idle", "task_id": None}
+            continue
+        extra_params = await _intern_inputs(_extra_params(item))
+        cache_key = make_cache_key(item.model, item.prompt, extra_params)
+        results[slot] = await run_in_threadpool(speculate, uid, slot, item.model, item.prompt, extra_params, cache_key)
+    return {"slots": results}
+
+@router.post("/blobs")
+async def upload_blob(request: Request, _: Optional[bool] = Depends(get_api_key)):
+    """Stream a raw request body into the blob store; pass the returned handle as image/mask."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > BLOB_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Blob exceeds {BLOB_MAX_BYTES} bytes")
+    try:
+        return await save_blob_stream(request.stream())
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except BlobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/blobs/{digest}")
+async def get_blob(digest: str):
+    # No API key: providers fetch inputs from here and the sha256 is the capability
+    try:
+        path = blob_path(digest)
+    except BlobError:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Blob not found")
+    with open(path, "rb") as f:
+        media_type = sniff_content_type(f.read(16))
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@router.get("/status/batch/{batch_id}")
+async def get_batch(batch_id: str, _: Optional[bool] = Depends(get_api_key)):
+    with metrics.timed(metrics.STATUS_LOOKUP_SECONDS.labels("batch")):
+        result = await run_in_threadpool(get_batch_status, batch_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return result
+
+@router.get("/cache/stats", response_model=Dict[str, int])
+async def get_cache_stats(_: Optional[bool] = Depends(get_api_key)):
+    """Result cache hit/miss counters and current size."""
+    return await run_in_threadpool(cache_stats)
+
+@router.get("/pools")
+async def get_pool_stats(_: Optional[bool] = Depends(get_api_key)):
+    """Connection pool usage of this API process."""
+    return pool_stats()
+
+@router.get("/limits")
+async def get_limits(_: Optional[bool] = Depends(get_api_key)):
+    """Adaptive concurrency limit and in-flight jobs per provider/model scope."""
+    return await run_in_threadpool(limiter_snapshot)
+
+@router.get("/storage")
+async def get_storage_report(_: Optional[bool] = Depends(get_api_key)):
+    """Estimated Redis memory per key family (sampled; see core/status.py)."""
+    return await run_in_threadpool(storage_report)
+
+class BulkStatusRequest(BaseModel):
+    task_ids: List[str] = Field(..., min_length=1, max_length=MAX_BULK_STATUS)
+
+class CreditBalance(BaseModel):
+    balance: int = Field(..., description="Balance held by the system of record, before charges it has not received yet")
+
+@router.put("/credits/{user_id}")
+async def put_credits(user_id: str, req: CreditBalance, _: Optional[bool] = Depends(get_api_key)):
+    """Set a user's credit balance from the system of record; returns the account as metered."""
+    try:
+        await run_in_threadpool(credits.set_balance, user_id, req.balance)
+        return await run_in_threadpool(credits.get_account, user_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.get("/credits/{user_id}")
+async def get_credits(user_id: str, _: Optional[bool] = Depends(get_api_key)):
+    try:
+        account = await run_in_threadpool(credits.get_account, user_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if account is None:
+        raise HTTPException(status_code=404, detail="No credit account")
+    return account
+
+@router.post("/status/bulk")
+async def get_statuses(req: BulkStatusRequest, _: Optional[bool] = Depends(get_api_key)):
+    """Statuses of many tasks (e.g. every node of a canvas) in one call; unknown ids map to null."""
+    with metrics.timed(metrics.STATUS_LOOKUP_SECONDS.labels("bulk")):
+        return {"statuses": await get_task_statuses(req.task_ids)}
+
 @router.get("/status/{task_id}")
-async def get_status(task_id: str, _: Optional[bool] = Depends(get_api_key)):
-    result = get_task_status(task_id)
+async def get_status(task_id: str, full: bool = Query(default=False, description="Include prompt/user_id from the full result"),
+                     _: Optional[bool] = Depends(get_api_key)):
+    with metrics.timed(metrics.STATUS_LOOKUP_SECONDS.labels("task")):
+        if full:
+            result = await run_in_threadpool(get_task_status, task_id, True)
+        else:
+            result = (await get_task_statuses([task_id]))[task_id]
     if not result:
         raise HTTPException(status_code=404, detail="Task not found")
     return result
+
+@router.delete("/tasks/{task_id}")
+async def delete_task(task_id: str, _: Optional[bool] = Depends(get_api_key)):
+    """Cancel a queued or running task; 409 if it already finished.
+
+    A task shared with identical requests is only detached ("detached") until its
+    last requester cancels it.
+    """
+    try:
+        status = await run_in_threadpool(cancel_task, task_id)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Could not reach workers: {e}")
+    if status not in ("cancelled", "detached"):
+        raise HTTPException(status_code=409, detail=f"Task already {status}")
+    return {"task_id": task_id, "status": status}
+
+@router.post("/webhooks/replicate")
+async def replicate_webhook(request: Request, task_id: str = Query(...)):
+    """Completion callback for handed-off Replicate predictions (REPLICATE_COMPLETION=webhook).
+
+    Called by Replicate, so it carries no API key; its signature is checked against
+    REPLICATE_WEBHOOK_SECRET instead (no secret, no deliveries accepted). Unknown or
+    repeated deliveries are acknowledged.
+    """
+    # Completing a prediction needs the worker-side task code; only webhook traffic pays for importing it
+    from ...workers.predictions import complete_prediction, verify_webhook
+    body = await request.body()
+    if not verify_webhook(request.headers, body):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        prediction = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    result = await run_in_threadpool(complete_prediction, task_id, prediction)
+    return {"task_id": task_id, "status": result["status"] if result else "ignored"}
+
+MAX_STREAM_TASKS = 100
+
+async def _current_state(task_id: str):
+    result = await run_in_threadpool(get_task_status, task_id)
+    if not result:
+        # Never enqueued or expired: nothing will ever be published for it
+        return {"task_id": task_id, "status": "not_found", "output_url": None, "error": "Task not found"}
+    return {"task_id": task_id, "status": result["status"], "output_url": result.get("output_url"), "error": result.get("error")}
+
+async def _sse(task_ids: List[str]):
+    pending = set(task_ids)
+    async for event in subscribe_task_events(task_ids, initial_state=_current_state):
+        if event is None:
+            yield ": keep-alive\n\n"
+            continue
+        yield f"event: {event['status']}\ndata: {json.dumps(event)}\n\n"
+        if event["status"] in TERMINAL_STATUSES or event["status"] == "not_found":
+            pending.discard(event.get("task_id"))
+            if not pending:
+                return
+
+def _stream_response(task_ids: List[str]) -> StreamingResponse:
+    return StreamingResponse(
+        _sse(task_ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/stream/{task_id}")
+async def stream_status(task_id: str, _: Optional[bool] = Depends(get_api_key)):
+    """Server-sent events for one task until it reaches a terminal state ("not_found" for unknown ids)."""
+    return _stream_response([task_id])
+
+@router.get("/stream")
+async def stream_statuses(task_ids: str = Query(..., description="Comma-separated task ids"), _: Optional[bool] = Depends(get_api_key)):
+    """Server-sent events for several tasks over a single connection."""
+    ids = list(dict.fromkeys(t.strip() for t in task_ids.split(",") if t.strip()))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No task ids")
+    if len(ids) > MAX_STREAM_TASKS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_STREAM_TASKS} task ids per stream")
+    return _stream_response(ids)
+
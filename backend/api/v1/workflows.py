@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException, Depends, Header
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+from typing import Optional, Dict, List, Any
+from .ai import get_api_key
+from ...workers.workflows import WorkflowError, start_workflow, get_workflow_status
+
+router = APIRouter()
+
+class WorkflowRunRequest(BaseModel):
+    # Same shape as the agent's create_workflow action
+    nodes: List[Dict[str, Any]] = Field(..., min_length=1)
+    edges: List[Dict[str, Any]] = Field(default_factory=list)
+    reuse_outputs: bool = Field(default=True, description="Treat nodes that already have an output as done")
+    rerun: List[str] = Field(default_factory=list, description="Node ids to run even if they have an output")
+
+@router.post("/run")
+async def run_workflow(req: WorkflowRunRequest, x_user_id: Optional[str] = Header(default=None), _: Optional[bool] = Depends(get_api_key)):
+    """Execute a node/edge graph on the workers; progress is streamed on /api/v1/ai/stream/{workflow_id}."""
+    if not x_user_id:
+        raise HTTPException(status_code=401, detail="Missing user ID")
+    try:
+        workflow_id = await run_in_threadpool(
+            start_workflow, req.nodes, req.edges, x_user_id, req.reuse_outputs, req.rerun
+        )
+    except WorkflowError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"workflow_id": workflow_id, "status": "processing"}
+
+@router.get("/{workflow_id}")
+async def workflow_status(workflow_id: str, _: Optional[bool] = Depends(get_api_key)):
+    result = await run_in_threadpool(get_workflow_status, workflow_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    return result
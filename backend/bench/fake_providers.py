@@ -0,0 +1,106 @@
+import asyncio
+import math
+import random
+import time
+import uuid
+from typing import Any, Dict, NamedTuple, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Local stand-ins for Replicate, OpenAI Images and a generic HTTP model endpoint.
+#
+# Each answers with the same JSON shape the real provider (and its SDK) expects,
+# after a latency drawn from a log-normal distribution, and fails a configurable
+# share of calls with 429 or 503. Workers reach them through the provider env
+# vars (REPLICATE_BASE_URL, OPENAI_BASE_URL, HTTP_MODEL_*_URL), so the code path
+# under test is the production one.
+
+
+class ProviderProfile(NamedTuple):
+    median: float = 0.5  # seconds
+    sigma: float = 0.5  # log-normal shape; 0 gives a fixed latency
+    error_rate: float = 0.0  # share of calls answered with 503
+    throttle_rate: float = 0.0  # share of calls answered with 429
+
+    def latency(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median), self.sigma) if self.sigma > 0 else self.median
+
+    def failure(self) -> Optional[int]:
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 503
+        return None
+
+
+def parse_profile(spec: str) -> ProviderProfile:
+    """``median[:sigma[:error_rate[:throttle_rate]]]``, e.g. ``0.8:0.6:0.02:0.01``."""
+    parts = [float(p) for p in spec.split(":") if p]
+    return ProviderProfile(*parts)
+
+
+def _output_url() -> str:
+    return f"https://fake-provider.local/out/{uuid.uuid4().hex}.png"
+
+
+def _prediction(version: str, model: str, inputs: Dict[str, Any]) -> Dict[str, Any]:
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    pid = uuid.uuid4().hex
+    return {
+        "id": pid, "model": model, "version": version, "status": "succeeded",
+        "input": inputs, "output": [_output_url()], "logs": "", "error": None, "metrics": {},
+        "created_at": now, "started_at": now, "completed_at": now,
+        "urls": {"get": f"/v1/predictions/{pid}", "cancel": f"/v1/predictions/{pid}/cancel"},
+    }
+
+
+def create_app(profiles: Dict[str, ProviderProfile]) -> FastAPI:
+    """``profiles`` is keyed by "replicate", "openai" and "http"; missing ones answer instantly."""
+    app = FastAPI(title="Fake providers")
+    counters: Dict[str, int] = {"replicate": 0, "openai": 0, "http": 0}
+    app.state.counters = counters
+
+    async def simulate(provider: str) -> Optional[JSONResponse]:
+        counters[provider] += 1
+        profile = profiles.get(provider, ProviderProfile(median=0))
+        await asyncio.sleep(profile.latency())
+        status = profile.failure()
+        if status:
+            return JSONResponse({"detail": "simulated failure", "status": status}, status_code=status)
+        return None
+
+    @app.post("/replicate/v1/predictions")
+    async def replicate_create(request: Request):
+        body = await request.json()
+        return await simulate("replicate") or _prediction(body.get("version", ""), "fake/model", body.get("input") or {})
+
+    @app.post("/replicate/v1/models/{owner}/{name}/predictions")
+    async def replicate_create_for_model(owner: str, name: str, request: Request):
+        body = await request.json()
+        return await simulate("replicate") or _prediction("", f"{owner}/{name}", body.get("input") or {})
+
+    @app.get("/replicate/v1/models/{owner}/{name}/versions/{version_id}")
+    async def replicate_version(owner: str, name: str, version_id: str):
+        return {"id": version_id, "created_at": "2024-01-01T00:00:00Z", "cog_version": "0.9.0", "openapi_schema": {}}
+
+    @app.post("/openai/v1/images/generations")
+    async def openai_images(request: Request):
+        body = await request.json()
+        return await simulate("openai") or {
+            "created": int(time.time()),
+            "data": [{"url": _output_url()} for _ in range(int(body.get("n") or 1))],
+        }
+
+    @app.post("/http/run")
+    async def http_run():
+        return await simulate("http") or {"output": [_output_url()]}
+
+    @app.get("/stats")
+    async def stats():
+        return counters
+
+    return app
@@ -0,0 +1,114 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+# Cold-start benchmark: how long the API and a worker take to import.
+#
+#   python -m backend.bench.imports --repeat 5 --top 10
+#
+# Each sample is a fresh interpreter running with -X importtime, so nothing
+# is cached in-process (bytecode caches are, as in a real pod). The report gives
+# the median wall time per target, its heaviest third-party packages, and which
+# of the lazily loaded modules (provider SDKs, the worker's task code) got
+# imported anyway. --budget-ms fails the run (exit 1) when a target is slower.
+
+TARGETS = {
+    "api": "import backend.main",
+    "worker": "from backend.celery_app import celery_app; celery_app.loader.import_default_modules()",
+}
+LAZY_MODULES = ("openai", "replicate", "httpx", "backend.workers.tasks")
+
+_PROBE = """
+import sys, time
+started = time.perf_counter()
+{statement}
+print(time.perf_counter() - started)
+print(",".join(m for m in {lazy!r} if m in sys.modules))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, float, float]]:
+    """(module, self ms, cumulative ms) for each line of -X importtime output, in import order."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name[1:].rstrip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return rows
+
+
+def package_costs(rows: List[Tuple[str, float, float]]) -> List[Tuple[str, float]]:
+    """Cumulative import time per third-party top-level package, heaviest first.
+
+    Packages nest (fastapi imports pydantic), so the figures overlap; the
+    outermost lines (interpreter startup and the probed modules themselves) are left out.
+    """
+    depth = min((len(name) - len(name.lstrip()) for name, _, _ in rows), default=0)
+    costs: Dict[str, float] = {}
+    for name, _, cumulative in rows:
+        root = name.strip().split(".")[0]
+        if len(name) - len(name.lstrip()) > depth and root != "backend":
+            costs[root] = max(costs.get(root, 0.0), cumulative)
+    return sorted(costs.items(), key=lambda row: row[1], reverse=True)
+
+
+def sample(statement: str) -> Dict[str, Any]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(statement=statement, lazy=LAZY_MODULES)],
+        capture_output=True, text=True, check=True,
+    )
+    wall, loaded = proc.stdout.split("\n")[-3:-1]
+    return {"wall_ms": float(wall) * 1000, "loaded": [m for m in loaded.split(",") if m],
+            "packages": package_costs(parse_importtime(proc.stderr))}
+
+
+def measure(statement: str, repeat: int, top: int) -> Dict[str, Any]:
+    runs = [sample(statement) for _ in range(repeat)]
+    walls = [run["wall_ms"] for run in runs]
+    heaviest: Dict[str, List[float]] = {}
+    for run in runs:
+        for name, ms in run["packages"]:
+            heaviest.setdefault(name, []).append(ms)
+    ranked = sorted(((name, statistics.median(ms)) for name, ms in heaviest.items()), key=lambda row: row[1], reverse=True)
+    return {
+        "median_ms": round(statistics.median(walls), 1),
+        "min_ms": round(min(walls), 1),
+        "max_ms": round(max(walls), 1),
+        "loaded": runs[-1]["loaded"],
+        "heaviest": [(name, round(ms, 1)) for name, ms in ranked[:top]],
+    }
+
+
+def print_report(results: Dict[str, Dict[str, Any]]) -> None:
+    for target, result in results.items():
+        print(f"{target}: median {result['median_ms']} ms (min {result['min_ms']}, max {result['max_ms']})")
+        print(f"  loaded at import: {', '.join(result['loaded']) or 'none of ' + ', '.join(LAZY_MODULES)}")
+        for name, ms in result["heaviest"]:
+            print(f"  {ms:>9.1f} ms  {name}")
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="Measure cold import time of the API and worker processes")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"comma-separated, from {', '.join(TARGETS)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="heaviest packages to list")
+    parser.add_argument("--budget-ms", type=float, help="exit 1 if any target's median exceeds this")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = {target: measure(TARGETS[target], args.repeat, args.top) for target in args.targets.split(",")}
+    print_report(results)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.budget_ms is not None and any(r["median_ms"] > args.budget_ms for r in results.values()):
+        sys.exit(1)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from backend.bench.fake_providers import ProviderProfile, create_app, parse_profile
+
+# Load test for the /infer -> worker -> /status pipeline against fake providers.
+#
+#   python -m backend.bench.run --rps 20 --duration 30 --models esrgan,dalle-3
+#
+# Live mode (default) starts the fake providers in this process, then the API
+# (uvicorn) and a Celery worker as subprocesses pointed at them; it needs a
+# Redis at REDIS_URL and nothing else. --eager runs everything in this process
+# with Celery in eager mode and an in-memory result backend, which needs no
+# Redis but serializes task execution: use it to catch per-task overhead
+# regressions, not to size workers.
+
+API_KEY = "bench-key"
+TERMINAL = ("completed", "failed", "cancelled")
+
+
+def provider_env(base_url: str) -> Dict[str, str]:
+    return {
+        "INTERNAL_API_KEY": API_KEY,
+        "REPLICATE_API_TOKEN": "bench",
+        "REPLICATE_BASE_URL": f"{base_url}/replicate",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{base_url}/openai/v1",
+        "HTTP_MODEL_ESRGAN_URL": f"{base_url}/http/run",
+        "RESULT_CACHE_ENABLED": "false",
+        "WORKER_METRICS_PORT": "0",
+    }
+
+
+def start_fake_providers(profiles: Dict[str, ProviderProfile], port: int) -> Any:
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(create_app(profiles), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="fake-providers", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def start_stack(env: Dict[str, str], api_port: int, concurrency: int) -> List[subprocess.Popen]:
+    full_env = dict(os.environ, **env)
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(api_port), "--log-level", "warning"],
+        env=full_env,
+    )
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "celery", "-A", "backend.celery_app", "worker", "--loglevel=warning",
+         "-Q", "fast,standard,heavy", "-c", str(concurrency)],
+        env=full_env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{api_port}/health", timeout=1).status_code == 200:
+                return [api, worker]
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    stop_stack([api, worker])
+    raise RuntimeError("API did not become healthy within 30s")
+
+
+def stop_stack(procs: List[subprocess.Popen]) -> None:
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        try:
+            p.wait(10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+def redis_commands() -> Optional[int]:
+    """Total commands processed by the Redis at REDIS_URL, or None when unreachable."""
+    try:
+        import redis
+
+        client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), socket_connect_timeout=1)
+        return int(client.info("stats")["total_commands_processed"])
+    except Exception:
+        return None
+
+
+async def _one_job(client: httpx.AsyncClient, model: str, i: int, samples: Dict[str, Any],
+                   poll_interval: float, timeout: float) -> None:
+    headers = {"x-api-key": API_KEY, "x-user-id": f"bench-{i % 50}"}
+    start = time.perf_counter()
+    try:
+        r = await client.post("/api/v1/ai/infer", json={"model": model, "prompt": f"bench {i}"}, headers=headers)
+        samples["submit"].append(time.perf_counter() - start)
+        r.raise_for_status()
+        body = r.json()
+        task_id, status = body.get("task_id"), body.get("status")
+        while status not in TERMINAL:
+            if time.perf_counter() - start > timeout:
+                samples["outcomes"]["timeout"] += 1
+                return
+            await asyncio.sleep(poll_interval)
+            t = time.perf_counter()
+            r = await client.get(f"/api/v1/ai/status/{task_id}", headers=headers)
+            samples["status"].append(time.perf_counter() - t)
+            status = r.json().get("status") if r.status_code == 200 else None
+        samples["outcomes"][status] += 1
+        if status == "completed":
+            samples["end_to_end"].append(time.perf_counter() - start)
+    except httpx.HTTPError:
+        samples["outcomes"]["http_error"] += 1
+
+
+async def drive(client: httpx.AsyncClient, models: List[str], rps: float, duration: float,
+                poll_interval: float = 0.25, timeout: float = 120.0) -> Dict[str, Any]:
+    """Open-loop load: job i starts at i / rps whatever the latency of earlier jobs."""
+    samples: Dict[str, Any] = {
+        "submit": [], "status": [], "end_to_end": [],
+        "outcomes": {"completed": 0, "failed": 0, "cancelled": 0, "timeout": 0, "http_error": 0},
+    }
+    total = max(1, int(rps * duration))
+    started = time.perf_counter()
+    jobs = []
+    for i in range(total):
+        delay = started + i / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        jobs.append(asyncio.create_task(_one_job(client, models[i % len(models)], i, samples, poll_interval, timeout)))
+    await asyncio.gather(*jobs)
+    samples["elapsed"] = time.perf_counter() - started
+    samples["submitted"] = total
+    return samples
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": round(ordered[-1] * 1000, 1)}
+
+
+def summarize(samples: Dict[str, Any], redis_ops: Optional[int]) -> Dict[str, Any]:
+    completed = samples["outcomes"]["completed"]
+    return {
+        "submitted": samples["submitted"],
+        "outcomes": samples["outcomes"],
+        "elapsed_s": round(samples["elapsed"], 2),
+        "throughput_per_s": round(completed / samples["elapsed"], 2) if samples["elapsed"] else 0.0,
+        "latency_ms": {
+            "submit": percentiles(samples["submit"]),
+            "status": percentiles(samples["status"]),
+            "end_to_end": percentiles(samples["end_to_end"]),
+        },
+        "status_polls": len(samples["status"]),
+        # Includes the harness's own INFO calls and polling-driven reads
+        "redis_ops_per_task": round(redis_ops / samples["submitted"], 1) if redis_ops is not None else None,
+    }
+
+
+def print_report(summary: Dict[str, Any]) -> None:
+    print(f"submitted {summary['submitted']} in {summary['elapsed_s']}s; outcomes {summary['outcomes']}")
+    print(f"throughput {summary['throughput_per_s']} completed/s; {summary['status_polls']} status polls")
+    print(f"{'stage':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for stage, p in summary["latency_ms"].items():
+        print(f"{stage:<12}" + "".join(f"{'-' if p[k] is None else p[k]:>10}" for k in ("p50", "p95", "p99", "max")))
+    if summary["redis_ops_per_task"] is not None:
+        print(f"redis ops/task {summary['redis_ops_per_task']}")
+
+
+async def _run_eager(args: argparse.Namespace) -> Dict[str, Any]:
+    from backend.celery_app import celery_app
+
+    celery_app.conf.update(task_always_eager=True, task_store_eager_result=True, result_backend="cache+memory://")
+    from backend.main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        return await drive(client, args.models, args.rps, args.duration, args.poll_interval, args.timeout)
+
+
+async def _run_live(args: argparse.Namespace) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=200, max_keepalive_connections=200)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.api_port}", limits=limits, timeout=30) as client:
+        return await drive(client, args.models, args.rps, args.duration, args.poll_interval, args.timeout)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark the inference pipeline against fake providers")
+    parser.add_argument("--rps", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--models", type=lambda s: s.split(","), default=["esrgan", "dalle-3", "stable-diffusion-3.5"])
+    parser.add_argument("--replicate", type=parse_profile, default=ProviderProfile(1.0, 0.5), help="median[:sigma[:errors[:429s]]]")
+    parser.add_argument("--openai", type=parse_profile, default=ProviderProfile(0.8, 0.4))
+    parser.add_argument("--http", type=parse_profile, default=ProviderProfile(0.3, 0.3))
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-job deadline in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="worker concurrency (live mode)")
+    parser.add_argument("--provider-port", type=int, default=8790)
+    parser.add_argument("--api-port", type=int, default=8791)
+    parser.add_argument("--eager", action="store_true", help="single process, no worker or Redis")
+    parser.add_argument("--json", dest="json_path", help="also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    server = start_fake_providers({"replicate": args.replicate, "openai": args.openai, "http": args.http}, args.provider_port)
+    env = provider_env(f"http://127.0.0.1:{args.provider_port}")
+    procs: List[subprocess.Popen] = []
+    try:
+        if args.eager:
+            os.environ.update(env)
+        else:
+            procs = start_stack(env, args.api_port, args.concurrency)
+        before = redis_commands()
+        samples = asyncio.run(_run_eager(args) if args.eager else _run_live(args))
+        after = redis_commands()
+    finally:
+        stop_stack(procs)
+        server.should_exit = True
+
+    summary = summarize(samples, after - before if before is not None and after is not None else None)
+    print_report(summary)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
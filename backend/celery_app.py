@@ -1,9 +1,17 @@
 import os
+import time
+from datetime import datetime
 from celery import Celery
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_init, worker_process_shutdown
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from backend.core.config import WORKER_EXECUTION_MODE, ASYNC_WORKER_CONCURRENCY, WORKER_METRICS_PORT, RESULT_TTL, RESULT_SERIALIZER
+from backend.core.fairshare import PRIORITY_STEPS
+from backend.core.limits import queue_for_model
+from backend.core import metrics
+
 # Redis URL from env or default
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
@@ -11,9 +19,24 @@ celery_app = Celery(
     "karate_worker",
     broker=REDIS_URL,
     backend=REDIS_URL,
-    include=["backend.workers.tasks"]
+    include=["backend.workers.tasks", "backend.workers.workflows", "backend.workers.materialize",
+             "backend.workers.predictions", "backend.workers.ledger"]
 )
 
+MODEL_TASKS = ("backend.workers.tasks.process_ai_task", "backend.workers.tasks.process_ai_multi_task")
+# Long downloads (videos) must not hold up the fast tier
+IO_TASKS = ("backend.workers.materialize.materialize_outputs",)
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    # Model jobs go to fast/standard/heavy by cost tier so quick models are never
+    # stuck behind video jobs; bookkeeping tasks (workflow callbacks) are cheap.
+    if name in MODEL_TASKS:
+        model = args[0] if args else kwargs.get("model", "")
+        return {"queue": queue_for_model(model)}
+    if name in IO_TASKS:
+        return {"queue": "standard"}
+    return {"queue": "fast"}
+
 celery_app.conf.update(
     task_serializer="json",
     accept_content=["json"],
@@ -21,5 +44,66 @@ celery_app.conf.update(
     timezone="UTC",
     enable_utc=True,
     task_track_started=True,
+    task_default_queue="standard",
+    task_routes=(route_task,),
+    # Full result payloads; failed ones are expired sooner (see workers/tasks.py)
+    result_expires=RESULT_TTL,
+    # Each tier queue gets a sub-queue per fair-share priority step (see core/fairshare.py).
+    # Without prefetching, a worker picks its next job only when it has a free slot,
+    # so a newly queued higher-priority job is not stuck behind prefetched ones.
+    broker_transport_options={"priority_steps": list(PRIORITY_STEPS)},
+    worker_prefetch_multiplier=1,
 )
 
+if RESULT_SERIALIZER == "msgpack":
+    try:
+        import msgpack  # noqa: F401
+        celery_app.conf.update(result_serializer="msgpack", result_accept_content=["json", "msgpack"])
+    except ImportError:
+        pass
+
+if WORKER_EXECUTION_MODE == "async":
+    # Tasks only park a thread while their provider call runs on the shared loop
+    celery_app.conf.update(
+        worker_pool="threads",
+        worker_concurrency=ASYNC_WORKER_CONCURRENCY,
+        worker_prefetch_multiplier=1,
+    )
+
+# Pipeline timing: stamp every published message so the worker can measure queue wait
+ENQUEUED_AT_HEADER = "karate_enqueued_at"
+_task_started = {}
+
+@before_task_publish.connect
+def _stamp_enqueue_time(headers=None, **_):
+    if headers is not None:
+        headers[ENQUEUED_AT_HEADER] = time.time()
+
+@task_prerun.connect
+def _observe_queue_wait(task_id=None, task=None, **_):
+    _task_started[task_id] = time.perf_counter()
+    request = task.request
+    enqueued_at = getattr(request, ENQUEUED_AT_HEADER, None)
+    if not enqueued_at:
+        return
+    eta = request.eta
+    if eta:
+        # Retries and countdowns are not queue wait until their ETA passes
+        eta = eta if isinstance(eta, datetime) else datetime.fromisoformat(eta)
+        enqueued_at = max(enqueued_at, eta.timestamp())
+    queue = (request.delivery_info or {}).get("routing_key") or "unknown"
+    metrics.QUEUE_WAIT_SECONDS.labels(queue).observe(max(0.0, time.time() - enqueued_at))
+
+@task_postrun.connect
+def _observe_task_runtime(task_id=None, task=None, **_):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        metrics.TASK_RUNTIME_SECONDS.labels(task.name).observe(time.perf_counter() - started)
+
+@worker_init.connect
+def _start_metrics_exporter(**_):
+    metrics.start_exporter(WORKER_METRICS_PORT)
+
+@worker_process_shutdown.connect
+def _retire_process_metrics(pid=None, **_):
+    metrics.mark_process_dead(pid or os.getpid())
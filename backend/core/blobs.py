@@ -0,0 +1,190 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, Optional
+
+from .config import BLOB_DIR, BLOB_INLINE_THRESHOLD, BLOB_MAX_BYTES, BLOB_PUBLIC_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed store for large job inputs (images, masks).
+#
+# Clients upload once and pass the returned "blob://<sha256>" handle as
+# image/mask; only the handle travels through /infer, the broker message and
+# the result backend. The worker resolves handles just before the provider
+# call, either to a public URL (BLOB_PUBLIC_BASE_URL) or to a data URI encoded
+# straight from an mmap of the file. Identical content is stored once.
+
+BLOB_SCHEME = "blob://"
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_WRITE_BATCH = 1024 * 1024
+
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+    (b"\x1aE\xdf\xa3", "video/webm"),
+)
+
+
+class BlobError(ValueError):
+    pass
+
+
+class BlobTooLarge(BlobError):
+    pass
+
+
+def is_blob_handle(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_SCHEME)
+
+
+def _digest_of(handle_or_digest: str) -> str:
+    digest = handle_or_digest[len(BLOB_SCHEME):] if is_blob_handle(handle_or_digest) else handle_or_digest
+    if not _DIGEST_RE.match(digest):
+        raise BlobError(f"Invalid blob reference: {handle_or_digest[:80]!r}")
+    return digest
+
+
+def blob_path(handle_or_digest: str) -> str:
+    digest = _digest_of(handle_or_digest)
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def _commit(tmp_path: str, digest: str, size: int) -> Dict[str, Any]:
+    final = blob_path(digest)
+    if os.path.exists(final):
+        # Already stored: keep the existing copy
+        os.unlink(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(tmp_path, final)
+    return {"handle": BLOB_SCHEME + digest, "sha256": digest, "size": size}
+
+
+def _tempfile() -> Any:
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=BLOB_DIR, prefix=".upload-", delete=False)
+
+
+async def save_blob_stream(chunks: AsyncIterator[bytes], max_bytes: int = BLOB_MAX_BYTES) -> Dict[str, Any]:
+    """Hash and spill an upload to disk as it arrives; memory use is bounded by the write batch."""
+    sha = hashlib.sha256()
+    size = 0
+    pending = bytearray()
+    tmp = _tempfile()
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise BlobTooLarge(f"Blob exceeds {max_bytes} bytes")
+            sha.update(chunk)
+            pending += chunk
+            if len(pending) >= _WRITE_BATCH:
+                await asyncio.to_thread(tmp.write, bytes(pending))
+                pending.clear()
+        if not size:
+            raise BlobError("Empty upload")
+        await asyncio.to_thread(tmp.write, bytes(pending))
+        tmp.close()
+        return await asyncio.to_thread(_commit, tmp.name, sha.hexdigest(), size)
+    except BaseException:
+        tmp.close()
+        if os.path.exists(tmp.name):
+            os.unlink(tmp.name)
+        raise
+
+
+def save_blob_chunks(chunks: Iterable[bytes], max_bytes: int = BLOB_MAX_BYTES) -> Dict[str, Any]:
+    """Blocking counterpart of save_blob_stream for workers (e.g. downloaded provider outputs)."""
+    sha = hashlib.sha256()
+    size = 0
+    tmp = _tempfile()
+    try:
+        with tmp:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise BlobTooLarge(f"Blob exceeds {max_bytes} bytes")
+                sha.update(chunk)
+                tmp.write(chunk)
+        if not size:
+            raise BlobError("Empty blob")
+        return _commit(tmp.name, sha.hexdigest(), size)
+    except BaseException:
+        if os.path.exists(tmp.name):
+            os.unlink(tmp.name)
+        raise
+
+
+def save_blob(data: bytes) -> Dict[str, Any]:
+    if not data:
+        raise BlobError("Empty blob")
+    if len(data) > BLOB_MAX_BYTES:
+        raise BlobTooLarge(f"Blob exceeds {BLOB_MAX_BYTES} bytes")
+    digest = hashlib.sha256(data).hexdigest()
+    if os.path.exists(blob_path(digest)):
+        return {"handle": BLOB_SCHEME + digest, "sha256": digest, "size": len(data)}
+    with _tempfile() as tmp:
+        tmp.write(data)
+    return _commit(tmp.name, digest, len(data))
+
+
+@contextmanager
+def open_blob(handle: str) -> Iterator[mmap.mmap]:
+    """Read-only mmap of a stored blob; raises BlobError if it is missing on this host."""
+    path = blob_path(handle)
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        raise BlobError(f"Input blob {handle} not found; is BLOB_DIR shared with the API?") from None
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        yield m
+
+
+def sniff_content_type(head: bytes) -> str:
+    for magic, content_type in _MAGIC:
+        if head.startswith(magic):
+            return content_type
+    if head[4:8] == b"ftyp":
+        return "video/mp4"
+    return "application/octet-stream"
+
+
+def blob_data_uri(handle: str) -> str:
+    with open_blob(handle) as m:
+        return f"data:{sniff_content_type(m[:16])};base64," + base64.b64encode(m).decode("ascii")
+
+
+def resolve_blob(handle: str) -> str:
+    """What a provider receives for a handle: a fetchable URL when published, else a data URI."""
+    if BLOB_PUBLIC_BASE_URL:
+        if not os.path.exists(blob_path(handle)):
+            raise BlobError(f"Input blob {handle} not found")
+        return f"{BLOB_PUBLIC_BASE_URL}/{_digest_of(handle)}"
+    return blob_data_uri(handle)
+
+
+def resolve_blob_inputs(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: resolve_blob(v) if is_blob_handle(v) else v for k, v in params.items()}
+
+
+def intern_data_uri(value: Optional[str]) -> Optional[str]:
+    """Swap a large inline base64 data URI for a blob handle; anything else passes through."""
+    if not value or not value.startswith("data:") or len(value) <= BLOB_INLINE_THRESHOLD:
+        return value
+    header, sep, payload = value.partition(",")
+    if not sep or not header.endswith(";base64"):
+        return value
+    try:
+        data = base64.b64decode(payload, validate=True)
+    except ValueError:
+        return value
+    return save_blob(data)["handle"]
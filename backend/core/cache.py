@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from .config import (
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_PROVIDER_URL_TTL,
+    RESULT_CACHE_TTL,
+    SINGLE_FLIGHT_TTL,
+)
+from .redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed result cache for process_ai_task.
+#
+# Entries live under ENTRY_PREFIX + sha256(model, prompt, params) with a TTL.
+# A sorted set (score = last access time) gives LRU order, and a hash of
+# per-entry sizes lets the put script keep the cache inside its byte budget.
+# While a cacheable job runs, INFLIGHT_PREFIX + digest names its task so
+# identical requests arriving before the result is cached attach to it.
+ENTRY_PREFIX = "karate:cache:entry:"
+LRU_KEY = "karate:cache:lru"
+SIZES_KEY = "karate:cache:sizes"
+STATS_KEY = "karate:cache:stats"
+INFLIGHT_PREFIX = "karate:cache:inflight:"
+
+# KEYS: entry, lru, sizes, stats | ARGV: digest, now
+_GET_SCRIPT = """
+local v = redis.call('GET', KEYS[1])
+if v then
+  redis.call('ZADD', KEYS[2], 'XX', ARGV[2], ARGV[1])
+  redis.call('HINCRBY', KEYS[4], 'hits', 1)
+  return v
+end
+local size = redis.call('HGET', KEYS[3], ARGV[1])
+if size then
+  redis.call('HDEL', KEYS[3], ARGV[1])
+  redis.call('ZREM', KEYS[2], ARGV[1])
+  redis.call('HINCRBY', KEYS[4], 'bytes', -tonumber(size))
+end
+redis.call('HINCRBY', KEYS[4], 'misses', 1)
+return false
+"""
+
+# KEYS: entry, lru, sizes, stats | ARGV: digest, value, ttl, now, max_entries, max_bytes, prefix
+_PUT_SCRIPT = """
+local size = string.len(ARGV[2])
+local old = tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0')
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], size)
+local total = redis.call('HINCRBY', KEYS[4], 'bytes', size - old)
+local evicted = 0
+while redis.call('ZCARD', KEYS[2]) > tonumber(ARGV[5]) or total > tonumber(ARGV[6]) do
+  local victim = redis.call('ZPOPMIN', KEYS[2])
+  if #victim == 0 then break end
+  local vsize = tonumber(redis.call('HGET', KEYS[3], victim[1]) or '0')
+  redis.call('HDEL', KEYS[3], victim[1])
+  redis.call('DEL', ARGV[7] .. victim[1])
+  total = redis.call('HINCRBY', KEYS[4], 'bytes', -vsize)
+  evicted = evicted + 1
+end
+if evicted > 0 then
+  redis.call('HINCRBY', KEYS[4], 'evictions', evicted)
+end
+return evicted
+"""
+
+# KEYS: inflight | ARGV: task_id, ttl
+_CLAIM_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner then
+  return owner
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return false
+"""
+
+# KEYS: inflight | ARGV: task_id
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def make_cache_key(model: str, prompt: Optional[str], params: Dict[str, Any]) -> str:
+    """Canonical sha256 of a request. Key order and None-valued params do not matter."""
+    canonical = json.dumps(
+        {
+            "model": model,
+            "prompt": prompt or "",
+            "params": {k: v for k, v in params.items() if v is not None},
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(params: Dict[str, Any], opt_in: bool = True) -> bool:
+    """Only seeded jobs are deterministic enough to share results."""
+    return RESULT_CACHE_ENABLED and opt_in and params.get("seed") is not None
+
+
+def _keys(digest: str):
+    return [ENTRY_PREFIX + digest, LRU_KEY, SIZES_KEY, STATS_KEY]
+
+
+def get_cached_result(digest: str) -> Optional[Dict[str, Any]]:
+    r = get_redis_client()
+    if r is None:
+        return None
+    try:
+        raw = r.eval(_GET_SCRIPT, 4, *_keys(digest), digest, time.time())
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.warning(f"Result cache lookup failed: {e}")
+        return None
+
+
+def cache_ttl(result: Dict[str, Any]) -> int:
+    """Full RESULT_CACHE_TTL, unless an output is still a provider URL that expires sooner.
+
+    Materialized outputs (workers/materialize.py) keep the provider URL under
+    ``provider_url``; an http ``output_url`` without one is the provider's own.
+    """
+    items = result.get("results") if isinstance(result.get("results"), list) else [result]
+    expiring = any(
+        isinstance(item, dict) and str(item.get("output_url") or "").startswith("http") and "provider_url" not in item
+        for item in items
+    )
+    return min(RESULT_CACHE_TTL, RESULT_CACHE_PROVIDER_URL_TTL) if expiring else RESULT_CACHE_TTL
+
+
+def store_cached_result(digest: str, result: Dict[str, Any]) -> bool:
+    value = json.dumps(result, separators=(",", ":"))
+    if len(value) > RESULT_CACHE_MAX_BYTES:
+        return False
+    r = get_redis_client()
+    if r is None:
+        return False
+    try:
+        evicted = r.eval(
+            _PUT_SCRIPT, 4, *_keys(digest),
+            digest, value, cache_ttl(result), time.time(),
+            RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, ENTRY_PREFIX,
+        )
+        if evicted:
+            logger.info(f"Result cache evicted {evicted} entries")
+        return True
+    except Exception as e:
+        logger.warning(f"Result cache store failed: {e}")
+        return False
+
+
+def claim_inflight(digest: str, task_id: str, ttl: int = SINGLE_FLIGHT_TTL) -> Optional[str]:
+    """Register ``task_id`` as the job computing ``digest``.
+
+    Returns the id of the task already in flight for it, or None when the caller
+    now owns the digest (or Redis is unavailable, in which case it just runs).
+    """
+    r = get_redis_client()
+    if r is None:
+        return None
+    try:
+        return r.eval(_CLAIM_SCRIPT, 1, INFLIGHT_PREFIX + digest, task_id, ttl) or None
+    except Exception as e:
+        logger.warning(f"Single-flight claim failed: {e}")
+        return None
+
+
+def release_inflight(digest: str, task_id: str) -> None:
+    """Drop the in-flight marker if ``task_id`` still owns it."""
+    r = get_redis_client()
+    if r is None:
+        return
+    try:
+        r.eval(_RELEASE_SCRIPT, 1, INFLIGHT_PREFIX + digest, task_id)
+    except Exception as e:
+        logger.warning(f"Single-flight release failed: {e}")
+
+
+def cache_stats() -> Dict[str, int]:
+    stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0, "entries": 0}
+    r = get_redis_client()
+    if r is None:
+        return stats
+    try:
+        pipe = r.pipeline()
+        pipe.hgetall(STATS_KEY)
+        pipe.zcard(LRU_KEY)
+        raw, entries = pipe.execute()
+        for k, v in (raw or {}).items():
+            stats[k] = int(v)
+        stats["entries"] = int(entries or 0)
+    except Exception as e:
+        logger.warning(f"Result cache stats failed: {e}")
+    return stats
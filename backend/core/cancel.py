@@ -0,0 +1,88 @@
+import logging
+
+from .config import CANCEL_TTL
+from .redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Cooperative task cancellation.
+#
+# DELETE /api/v1/ai/tasks/{id} revokes the Celery task (queued copies are
+# dropped; a prefork worker running it gets SIGUSR1, which raises
+# SoftTimeLimitExceeded inside the provider call) and raises a Redis flag.
+# The flag covers what the broadcast cannot: workers that were offline when it
+# was sent check it before starting, and event-loop provider calls, which run
+# outside the signalled thread, poll it and cancel themselves. Replicate
+# predictions interrupted either way are cancelled upstream so they stop billing.
+#
+# A task joined by identical requests (single flight, adopted speculation) is
+# shared: SHARED_PREFIX + id counts the joiners, and a cancel only detaches
+# one requester until the last one cancels.
+
+CANCEL_PREFIX = "karate:cancel:"
+SHARED_PREFIX = "karate:cancel:shared:"
+
+# KEYS: shared
+_DETACH_SCRIPT = """
+local n = tonumber(redis.call('GET', KEYS[1]) or '0')
+if n <= 0 then return 0 end
+if n == 1 then redis.call('DEL', KEYS[1]) else redis.call('DECR', KEYS[1]) end
+return 1
+"""
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskTimedOut(Exception):
+    """The model ran past its time limit; not retried, unlike transient timeouts."""
+
+
+def request_cancel(task_id: str) -> bool:
+    r = get_redis_client()
+    if r is None:
+        return False
+    try:
+        r.set(CANCEL_PREFIX + task_id, "1", ex=CANCEL_TTL)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not flag task {task_id} as cancelled: {e}")
+        return False
+
+
+def is_cancelled(task_id: str) -> bool:
+    r = get_redis_client()
+    if r is None or not task_id:
+        return False
+    try:
+        return bool(r.exists(CANCEL_PREFIX + task_id))
+    except Exception as e:
+        logger.debug(f"Cancel flag check failed for {task_id}: {e}")
+        return False
+
+
+def add_holder(task_id: str) -> None:
+    """Record one more request sharing ``task_id`` besides the one that enqueued it."""
+    r = get_redis_client()
+    if r is None:
+        return
+    try:
+        pipe = r.pipeline()
+        pipe.incr(SHARED_PREFIX + task_id)
+        pipe.expire(SHARED_PREFIX + task_id, CANCEL_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record a joiner of task {task_id}: {e}")
+
+
+def detach(task_id: str) -> bool:
+    """Drop one requester of a shared task; True if others still hold it (so it must keep running)."""
+    r = get_redis_client()
+    if r is None:
+        return False
+    try:
+        return bool(r.eval(_DETACH_SCRIPT, 1, SHARED_PREFIX + task_id))
+    except Exception as e:
+        logger.warning(f"Shared-task check failed for {task_id}: {e}")
+        return False
@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import importlib
+import importlib.util
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .config import HTTP_POOL_KEEPALIVE_EXPIRY, HTTP_POOL_MAX_CONNECTIONS, HTTP_POOL_MAX_KEEPALIVE
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Per-process registry of long-lived HTTP and SDK clients.
+#
+# Clients are keyed by origin (scheme://host:port) or by credential so keep-alive
+# connections are reused across tasks. Async clients are also keyed by event
+# loop since an httpx.AsyncClient must not be shared between loops. Everything
+# is dropped after fork so prefork children never inherit the parent's sockets.
+
+_lock = threading.Lock()
+_pid = os.getpid()
+_clients: Dict[Tuple, Any] = {}
+_requests: Dict[Tuple, int] = {}
+
+# httpx and the provider SDKs take most of a cold import, and the API process
+# only needs them for agent chat. They are imported on first use, per SDK, so
+# API pods and workers start without them (see bench/imports.py).
+_sdks: Dict[str, Any] = {}
+
+
+def sdk(name: str) -> Optional[Any]:
+    """The ``openai`` or ``replicate`` module, imported on first use; None if it is not installed."""
+    if name not in _sdks:
+        try:
+            _sdks[name] = importlib.import_module(name)
+        except Exception as e:
+            logger.debug(f"{name} library unavailable: {e}")
+            _sdks[name] = None
+    return _sdks[name]
+
+
+def _timeout() -> "httpx.Timeout":
+    import httpx
+    return httpx.Timeout(60.0, connect=10.0)
+
+
+def _limits() -> "httpx.Limits":
+    import httpx
+    return httpx.Limits(
+        max_connections=HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    if not parts.scheme:
+        return url
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _fingerprint(secret: Optional[str]) -> str:
+    if not secret:
+        return "-"
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:8]
+
+
+def _loop_id() -> int:
+    return id(asyncio.get_running_loop())
+
+
+def _get_or_create(key: Tuple, factory):
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            _clients.clear()
+            _requests.clear()
+            _pid = os.getpid()
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+            _requests.setdefault(key, 0)
+        return client
+
+
+def _count_hook(key: Tuple):
+    def hook(request: "httpx.Request") -> None:
+        _requests[key] = _requests.get(key, 0) + 1
+    return hook
+
+
+def _async_count_hook(key: Tuple):
+    async def hook(request: "httpx.Request") -> None:
+        _requests[key] = _requests.get(key, 0) + 1
+    return hook
+
+
+def get_http_client(url: str) -> "httpx.Client":
+    """Pooled sync client for the origin of ``url``."""
+    import httpx
+    key = ("http", _origin(url))
+    return _get_or_create(key, lambda: httpx.Client(
+        timeout=_timeout(), limits=_limits(), http2=HTTP2_AVAILABLE,
+        event_hooks={"request": [_count_hook(key)]},
+    ))
+
+
+def get_async_http_client(url: str) -> "httpx.AsyncClient":
+    """Pooled async client for the origin of ``url``, bound to the running loop."""
+    import httpx
+    key = ("async_http", _origin(url), _loop_id())
+    return _get_or_create(key, lambda: httpx.AsyncClient(
+        timeout=_timeout(), limits=_limits(), http2=HTTP2_AVAILABLE,
+        event_hooks={"request": [_async_count_hook(key)]},
+    ))
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> Any:
+    openai = sdk("openai")
+    if openai is None:
+        raise RuntimeError("openai library not installed")
+    import httpx
+    key = ("openai", base_url or "default", _fingerprint(api_key))
+    return _get_or_create(key, lambda: openai.OpenAI(  # type: ignore
+        api_key=api_key, base_url=base_url,
+        http_client=httpx.Client(
+            timeout=_timeout(), limits=_limits(), http2=HTTP2_AVAILABLE,
+            event_hooks={"request": [_count_hook(key)]},
+        ),
+    ))
+
+
+def get_async_openai_client(api_key: str, base_url: Optional[str] = None) -> Any:
+    openai = sdk("openai")
+    if openai is None:
+        raise RuntimeError("openai library not installed")
+    import httpx
+    key = ("async_openai", base_url or "default", _fingerprint(api_key), _loop_id())
+    return _get_or_create(key, lambda: openai.AsyncOpenAI(  # type: ignore
+        api_key=api_key, base_url=base_url,
+        http_client=httpx.AsyncClient(
+            timeout=_timeout(), limits=_limits(), http2=HTTP2_AVAILABLE,
+            event_hooks={"request": [_async_count_hook(key)]},
+        ),
+    ))
+
+
+def get_replicate_client(api_token: str, for_async: bool = False) -> Any:
+    """Replicate client whose underlying httpx pool uses our limits.
+
+    Replicate keeps separate sync/async httpx clients internally; async use gets
+    its own instance per loop.
+    """
+    replicate = sdk("replicate")
+    if replicate is None:
+        raise RuntimeError("replicate library not installed")
+    loop_key = _loop_id() if for_async else None
+    key = ("replicate", _fingerprint(api_token), loop_key)
+    return _get_or_create(key, lambda: replicate.Client(  # type: ignore
+        api_token=api_token, limits=_limits(), http2=HTTP2_AVAILABLE,
+    ))
+
+
+def _http_of(client: Any) -> Optional[Any]:
+    """The httpx client behind an SDK client, without forcing lazy creation."""
+    import httpx
+    if isinstance(client, (httpx.Client, httpx.AsyncClient)):
+        return client
+    replicate = _sdks.get("replicate")
+    if replicate is not None and isinstance(client, replicate.Client):
+        return getattr(client, "_Client__client", None) or getattr(client, "_Client__async_client", None)
+    http = getattr(client, "_client", None)
+    return http if isinstance(http, (httpx.Client, httpx.AsyncClient)) else None
+
+
+def _pool_of(client: Any) -> Optional[Any]:
+    http = _http_of(client)
+    if http is None:
+        return None
+    return getattr(getattr(http, "_transport", None), "_pool", None)
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Connection counts per pooled client in this process, for sizing HTTP_POOL_* limits."""
+    stats: Dict[str, Dict[str, Any]] = {}
+    with _lock:
+        items = list(_clients.items()) if _pid == os.getpid() else []
+    for key, client in items:
+        label = ":".join(str(k) for k in key)
+        entry: Dict[str, Any] = {"requests": _requests.get(key, 0)}
+        pool = _pool_of(client)
+        if pool is not None:
+            connections = list(getattr(pool, "connections", []))
+            entry["connections"] = len(connections)
+            entry["idle"] = sum(1 for c in connections if c.is_idle())
+            entry["http2"] = sum(1 for c in connections if getattr(c, "_connection", None) is not None
+                                 and type(c._connection).__name__.startswith("HTTP2"))
+        stats[label] = entry
+    stats["_limits"] = {
+        "max_connections": HTTP_POOL_MAX_CONNECTIONS,
+        "max_keepalive": HTTP_POOL_MAX_KEEPALIVE,
+        "http2_available": HTTP2_AVAILABLE,
+    }
+    return stats
+
+
+def close_all() -> None:
+    """Close sync clients in this process (worker_process_shutdown / app shutdown)."""
+    with _lock:
+        keys = [k for k in _clients if k[0] in ("http", "openai") or (k[0] == "replicate" and k[-1] is None)]
+        clients = [(k, _clients.pop(k)) for k in keys]
+    if not clients:
+        return
+    import httpx
+    for key, client in clients:
+        try:
+            http = _http_of(client)
+            if isinstance(http, httpx.Client):
+                http.close()
+        except Exception as e:
+            logger.warning(f"Error closing client {key[0]}: {e}")
+
+
+async def aclose_all() -> None:
+    """Close async clients bound to the running loop."""
+    loop_key = _loop_id()
+    with _lock:
+        keys = [k for k in _clients if k[-1] == loop_key and (k[0].startswith("async") or k[0] == "replicate")]
+        clients = [(k, _clients.pop(k)) for k in keys]
+    if not clients:
+        return
+    import httpx
+    for key, client in clients:
+        try:
+            if isinstance(client, httpx.AsyncClient):
+                await client.aclose()
+            elif key[0] == "async_openai":
+                await client.close()
+            else:
+                async_http = _http_of(client)
+                if isinstance(async_http, httpx.AsyncClient):
+                    await async_http.aclose()
+        except Exception as e:
+            logger.warning(f"Error closing client {key[0]}: {e}")
@@ -1,4 +1,10 @@
 # Centralized configuration for models and costs
+import json
+import os
+import tempfile
+from dotenv import load_dotenv
+
+load_dotenv()
 
 MODEL_COSTS = {
     "stable-diffusion-3.5": 1,
@@ -82,3 +88,170 @@ MODEL_COSTS = {
     "wan-2-1-lora": 3,
 }
 
+
+# Result cache (content-addressed, Redis-backed)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(24 * 3600)))
+# Entries that still point at provider URLs (not materialized, see MATERIALIZE_OUTPUTS)
+# are capped at this, below the provider's URL lifetime (about 1h for Replicate)
+RESULT_CACHE_PROVIDER_URL_TTL = int(os.getenv("RESULT_CACHE_PROVIDER_URL_TTL", str(45 * 60)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "50000"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Identical cacheable jobs submitted while one is in flight attach to it instead of
+# running again; the in-flight marker expires after this many seconds at most
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+SINGLE_FLIGHT_TTL = int(os.getenv("SINGLE_FLIGHT_TTL", "3600"))
+
+# Worker execution mode: "sync" runs provider calls inline in each prefork
+# process; "async" runs a thread pool whose tasks share one event loop per process.
+WORKER_EXECUTION_MODE = os.getenv("WORKER_EXECUTION_MODE", "sync").lower()
+ASYNC_WORKER_CONCURRENCY = int(os.getenv("ASYNC_WORKER_CONCURRENCY", "200"))
+
+# Shared HTTP connection pools (per process, per origin)
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "30"))
+
+# Batch inference
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "50"))
+BATCH_TTL = int(os.getenv("BATCH_TTL", str(24 * 3600)))
+# Models whose provider returns several outputs per call -> max outputs per call.
+# Identical batch items for these are coalesced into one upstream request.
+MULTI_OUTPUT_MODELS = {
+    "gpt-image-1": 10,
+}
+
+# Server-side workflow (DAG) execution state
+WORKFLOW_TTL = int(os.getenv("WORKFLOW_TTL", str(24 * 3600)))
+
+# Per-provider / per-model admission control (see core/limits.py).
+# max/min bound the adaptive concurrency ceiling; rate/burst feed a token bucket (req/s).
+LIMITS_ENABLED = os.getenv("LIMITS_ENABLED", "true").lower() in ("1", "true", "yes")
+LIMIT_LEASE_TTL = int(os.getenv("LIMIT_LEASE_TTL", "900"))
+LIMIT_MAX_DEFERRALS = int(os.getenv("LIMIT_MAX_DEFERRALS", "20"))
+PROVIDER_LIMITS = {
+    "replicate": {"max_concurrency": 50, "min_concurrency": 2, "rate": 10.0, "burst": 20},
+    "openai": {"max_concurrency": 20, "min_concurrency": 1, "rate": 5.0, "burst": 10},
+    "http": {"max_concurrency": 20, "min_concurrency": 1, "rate": 10.0, "burst": 20},
+}
+MODEL_LIMITS = {
+    "veo-3": {"max_concurrency": 5, "min_concurrency": 1, "rate": 1.0, "burst": 5},
+    "veo-3.1": {"max_concurrency": 5, "min_concurrency": 1, "rate": 1.0, "burst": 5},
+    "sora-2": {"max_concurrency": 3, "min_concurrency": 1, "rate": 0.5, "burst": 3},
+}
+PROVIDER_LIMITS.update(json.loads(os.getenv("PROVIDER_LIMITS_JSON", "{}")))
+MODEL_LIMITS.update(json.loads(os.getenv("MODEL_LIMITS_JSON", "{}")))
+# Seconds after which a successful call counts as congestion, per queue tier
+QUEUE_LATENCY_TARGETS = {"fast": 30, "standard": 90, "heavy": 600}
+
+# Per-user fair share (see core/fairshare.py): a user's jobs beyond FAIR_SHARE_QUOTA
+# outstanding (times their weight) are queued at lower priority
+FAIR_SHARE_ENABLED = os.getenv("FAIR_SHARE_ENABLED", "true").lower() in ("1", "true", "yes")
+FAIR_SHARE_QUOTA = int(os.getenv("FAIR_SHARE_QUOTA", "4"))
+FAIR_SHARE_WEIGHTS = json.loads(os.getenv("FAIR_SHARE_WEIGHTS_JSON", "{}"))
+# A job stops counting as outstanding after this long even if no worker reported its end
+FAIR_SHARE_TTL = int(os.getenv("FAIR_SHARE_TTL", str(6 * 3600)))
+
+# Provider call retries (see core/retry.py): attempts after the first, full-jitter backoff bounds in seconds
+RETRY_POLICIES = {
+    "replicate": {"max_retries": 3, "base_delay": 2.0, "max_delay": 60.0},
+    "openai": {"max_retries": 3, "base_delay": 1.0, "max_delay": 30.0},
+    "http": {"max_retries": 2, "base_delay": 1.0, "max_delay": 30.0},
+}
+RETRY_POLICIES.update(json.loads(os.getenv("RETRY_POLICIES_JSON", "{}")))
+# Latency-sensitive models that get a backup request once the first attempt
+# outlives the model's recent p95 (or HEDGE_DEFAULT_DELAY until enough samples exist)
+HEDGED_MODELS = {m.strip() for m in os.getenv("HEDGED_MODELS", "").split(",") if m.strip()}
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "10"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# Prometheus exporter port for Celery workers (0 disables); the API serves /metrics itself
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9540"))
+
+# Content-addressed input blob store (see core/blobs.py). API and workers must see the same BLOB_DIR.
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join(tempfile.gettempdir(), "karate-blobs"))
+BLOB_MAX_BYTES = int(os.getenv("BLOB_MAX_BYTES", str(50 * 1024 * 1024)))
+# Inline data URIs in /infer larger than this are moved into the blob store before enqueueing
+BLOB_INLINE_THRESHOLD = int(os.getenv("BLOB_INLINE_THRESHOLD", str(64 * 1024)))
+# Public base URL of GET /api/v1/ai/blobs; when set, providers fetch inputs themselves
+# instead of receiving them inline as data URIs
+BLOB_PUBLIC_BASE_URL = os.getenv("BLOB_PUBLIC_BASE_URL", "").rstrip("/")
+
+# Output materialization (see workers/materialize.py): copy provider outputs, whose
+# URLs expire, into our own store after the task completes
+MATERIALIZE_OUTPUTS = os.getenv("MATERIALIZE_OUTPUTS", "false").lower() in ("1", "true", "yes")
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# S3-compatible bucket for outputs (needs boto3); without it outputs go to the local blob store
+OUTPUT_S3_BUCKET = os.getenv("OUTPUT_S3_BUCKET", "")
+OUTPUT_S3_ENDPOINT = os.getenv("OUTPUT_S3_ENDPOINT", "")
+OUTPUT_S3_PREFIX = os.getenv("OUTPUT_S3_PREFIX", "outputs/")
+# Base of the stable URLs returned to clients (bucket/CDN URL, or the public /api/v1/ai/blobs URL)
+OUTPUT_PUBLIC_BASE_URL = os.getenv("OUTPUT_PUBLIC_BASE_URL", "").rstrip("/")
+
+# Task status storage. Celery results (full payload) expire after RESULT_TTL;
+# the compact status hash (see core/status.py) gets a TTL per state.
+RESULT_TTL = int(os.getenv("RESULT_TTL", str(7 * 24 * 3600)))
+STATUS_TTLS = {
+    "processing": int(os.getenv("STATUS_TTL_PROCESSING", str(6 * 3600))),
+    "completed": int(os.getenv("STATUS_TTL_COMPLETED", str(7 * 24 * 3600))),
+    "failed": int(os.getenv("STATUS_TTL_FAILED", str(24 * 3600))),
+    "cancelled": int(os.getenv("STATUS_TTL_CANCELLED", str(24 * 3600))),
+}
+# "msgpack" stores Celery results as msgpack when the package is installed
+RESULT_SERIALIZER = os.getenv("RESULT_SERIALIZER", "json")
+# In-process cache of finished task statuses served by the status endpoints
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "300"))
+STATUS_CACHE_SIZE = int(os.getenv("STATUS_CACHE_SIZE", "10000"))
+MAX_BULK_STATUS = int(os.getenv("MAX_BULK_STATUS", "500"))
+
+# Model registry (see core/models.py). Optional JSON file of per-model overrides/additions:
+# {"model-id": {"provider", "kind", "target", "cost", "queue", "timeout", "params", "max_outputs"}}
+MODEL_REGISTRY_PATH = os.getenv("MODEL_REGISTRY_PATH", "")
+# How often a process checks the file and the shared registry version for a hot reload
+MODEL_REGISTRY_CHECK_INTERVAL = float(os.getenv("MODEL_REGISTRY_CHECK_INTERVAL", "5"))
+# Provider call timeout per queue tier, seconds. A model's timeout (registry "timeout")
+# is its task's soft time limit; the hard limit adds TASK_HARD_TIME_LIMIT_GRACE.
+MODEL_TIMEOUTS = {"fast": 120, "standard": 300, "heavy": 1800}
+TASK_HARD_TIME_LIMIT_GRACE = int(os.getenv("TASK_HARD_TIME_LIMIT_GRACE", "60"))
+
+# Task cancellation (DELETE /api/v1/ai/tasks/{id}): how long the cancel flag lives
+# and how often event-loop provider calls check it, seconds
+CANCEL_TTL = int(os.getenv("CANCEL_TTL", str(24 * 3600)))
+CANCEL_POLL_INTERVAL = float(os.getenv("CANCEL_POLL_INTERVAL", "2"))
+
+# How Replicate predictions are awaited (see workers/predictions.py): "wait" holds the
+# worker until the prediction finishes; "webhook" and "poll" release it once the
+# prediction is created and complete the task from a webhook or a shared poller
+REPLICATE_COMPLETION = os.getenv("REPLICATE_COMPLETION", "wait").lower()
+# Public base URL of this API, where Replicate posts /api/v1/ai/webhooks/replicate
+REPLICATE_WEBHOOK_BASE_URL = os.getenv("REPLICATE_WEBHOOK_BASE_URL", "").rstrip("/")
+# Signing secret ("whsec_...") used to verify webhook deliveries; webhook mode polls without it
+REPLICATE_WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET", "")
+PREDICTION_POLL_INTERVAL = float(os.getenv("PREDICTION_POLL_INTERVAL", "5"))
+# In webhook mode the poller only checks predictions whose webhook is this late
+PREDICTION_WEBHOOK_GRACE = float(os.getenv("PREDICTION_WEBHOOK_GRACE", "120"))
+
+# Agent chat sessions (see core/sessions.py): server-side history per session_id.
+# Once the stored turns exceed the token budget, the oldest are folded into a
+# running summary, down to half the budget, so the prompt prefix changes rarely
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", str(7 * 24 * 3600)))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "3000"))
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+
+# Credit ledger (see core/credits.py). Balances are pushed by the system of
+# record (PUT /api/v1/ai/credits/{user_id}); committed charges are written back
+# in batches to CREDIT_SYNC_URL
+CREDITS_ENABLED = os.getenv("CREDITS_ENABLED", "false").lower() in ("1", "true", "yes")
+# A job that never settles (worker lost) stops holding its credits after this long
+CREDIT_HOLD_TTL = int(os.getenv("CREDIT_HOLD_TTL", str(2 * 24 * 3600)))
+CREDIT_SYNC_URL = os.getenv("CREDIT_SYNC_URL", "")
+CREDIT_SYNC_TOKEN = os.getenv("CREDIT_SYNC_TOKEN", "")
+CREDIT_SYNC_INTERVAL = float(os.getenv("CREDIT_SYNC_INTERVAL", "10"))
+CREDIT_SYNC_BATCH = int(os.getenv("CREDIT_SYNC_BATCH", "500"))
+
+# Speculative jobs (POST /api/v1/ai/speculate): likely-next runs queued at the
+# lowest priority into the result cache, only while the model's queue is idle
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "true").lower() in ("1", "true", "yes")
+SPECULATION_MAX_SLOTS = int(os.getenv("SPECULATION_MAX_SLOTS", "8"))
+SPECULATION_MAX_QUEUE_DEPTH = int(os.getenv("SPECULATION_MAX_QUEUE_DEPTH", "0"))
+SPECULATION_TTL = int(os.getenv("SPECULATION_TTL", "3600"))
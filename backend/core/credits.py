@@ -0,0 +1,194 @@
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import CREDIT_HOLD_TTL, CREDITS_ENABLED
+from .redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Redis-side credit ledger for model jobs.
+#
+# Each user's account is a hash: balance (as last pushed by the system of
+# record, minus charges since), held (reserved by queued or running jobs) and
+# unsynced (charges not yet written back). A job reserves its cost when it is
+# enqueued, and settles when it ends: the charge moves from held to spent and
+# is appended to an outbox; whatever was not charged (failure, cancellation,
+# unfilled multi-output slots) is released. Every step is one Lua script, so a
+# quota check is a single sub-millisecond round trip instead of a call to the
+# system of record. The outbox is written back in batches by
+# workers/ledger.py; entries carry the task id so the receiver can dedupe.
+#
+# Holds live per user, task id -> amount, with an expiry per hold. ``held`` is
+# recomputed from the live holds by every script that touches the account, so
+# a job that never settles (worker lost, hard-killed) stops holding credits
+# after CREDIT_HOLD_TTL instead of leaking them for good.
+#
+# With Redis unavailable jobs are admitted unmetered, like the limiter.
+
+ACCOUNT_PREFIX = "karate:credits:account:"
+HOLDS_PREFIX = "karate:credits:holds:"  # hash: task_id -> amount
+HOLD_EXPIRY_PREFIX = "karate:credits:hold-expiry:"  # zset: task_id -> expiry
+OUTBOX_KEY = "karate:credits:outbox"
+
+# Shared by the scripts below: drops expired holds and returns the sum of the rest
+_LIVE_HELD = """
+local function live_held(holds, expiries, now)
+  local expired = redis.call('ZRANGEBYSCORE', expiries, '-inf', now)
+  if #expired > 0 then
+    redis.call('HDEL', holds, unpack(expired))
+    redis.call('ZREMRANGEBYSCORE', expiries, '-inf', now)
+  end
+  local held = 0
+  for _, amount in ipairs(redis.call('HVALS', holds)) do
+    held = held + tonumber(amount)
+  end
+  return held
+end
+"""
+
+# KEYS: account, holds, expiries | ARGV: amount, task_id, now, hold_ttl.
+# Returns {1|0|-1 (no account), available}
+_RESERVE_SCRIPT = _LIVE_HELD + """
+local balance = redis.call('HGET', KEYS[1], 'balance')
+if not balance then
+  return {-1, 0}
+end
+local held = live_held(KEYS[2], KEYS[3], ARGV[3])
+local available = tonumber(balance) - held
+local amount = tonumber(ARGV[1])
+if available < amount then
+  redis.call('HSET', KEYS[1], 'held', held)
+  return {0, available}
+end
+redis.call('HSET', KEYS[2], ARGV[2], amount)
+redis.call('ZADD', KEYS[3], tonumber(ARGV[3]) + tonumber(ARGV[4]), ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+redis.call('HSET', KEYS[1], 'held', held + amount)
+return {1, available - amount}
+"""
+
+# KEYS: account, holds, expiries, outbox | ARGV: charge ('all' or max units), user_id, task_id, now.
+# Returns the units charged, -1 if the job holds nothing (already settled, expired or never metered)
+_SETTLE_SCRIPT = _LIVE_HELD + """
+local amount = tonumber(redis.call('HGET', KEYS[2], ARGV[3]) or '-1')
+if amount < 0 or redis.call('EXISTS', KEYS[1]) == 0 then
+  return -1
+end
+redis.call('HDEL', KEYS[2], ARGV[3])
+redis.call('ZREM', KEYS[3], ARGV[3])
+local charge = amount
+if ARGV[1] ~= 'all' then
+  charge = math.min(amount, tonumber(ARGV[1]))
+end
+redis.call('HSET', KEYS[1], 'held', live_held(KEYS[2], KEYS[3], ARGV[4]))
+if charge > 0 then
+  redis.call('HINCRBY', KEYS[1], 'balance', -charge)
+  redis.call('HINCRBY', KEYS[1], 'unsynced', charge)
+  redis.call('RPUSH', KEYS[4], cjson.encode({user_id = ARGV[2], task_id = ARGV[3], amount = charge, at = tonumber(ARGV[4])}))
+end
+return charge
+"""
+
+# KEYS: outbox | ARGV: count, account prefix. Drops written-back entries from the outbox
+_ACK_SCRIPT = """
+local entries = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+for _, raw in ipairs(entries) do
+  local entry = cjson.decode(raw)
+  redis.call('HINCRBY', ARGV[2] .. entry.user_id, 'unsynced', -entry.amount)
+end
+redis.call('LTRIM', KEYS[1], #entries, -1)
+return #entries
+"""
+
+# KEYS: account, holds, expiries | ARGV: balance, now. Charges still in the outbox are not in that balance yet
+_SET_BALANCE_SCRIPT = _LIVE_HELD + """
+local unsynced = tonumber(redis.call('HGET', KEYS[1], 'unsynced') or '0')
+redis.call('HSET', KEYS[1], 'balance', tonumber(ARGV[1]) - unsynced, 'held', live_held(KEYS[2], KEYS[3], ARGV[2]))
+return tonumber(ARGV[1]) - unsynced
+"""
+
+
+class InsufficientCredits(Exception):
+    def __init__(self, user_id: str, needed: int, available: int):
+        super().__init__(f"Insufficient credits: this run requires {needed}, {max(0, available)} available")
+        self.user_id = user_id
+        self.needed = needed
+        self.available = available
+
+
+def _keys(user_id: str) -> Tuple[str, str, str]:
+    return ACCOUNT_PREFIX + user_id, HOLDS_PREFIX + user_id, HOLD_EXPIRY_PREFIX + user_id
+
+
+def reserve(user_id: Optional[str], task_id: str, amount: int) -> Optional[int]:
+    """Hold ``amount`` credits for a job; returns what is left, or None when unmetered.
+
+    Raises InsufficientCredits if the user cannot cover it (or has no account yet).
+    """
+    if not CREDITS_ENABLED or not user_id or amount <= 0:
+        return None
+    r = get_redis_client()
+    if r is None:
+        return None
+    try:
+        ok, available = r.eval(_RESERVE_SCRIPT, 3, *_keys(user_id), amount, task_id, time.time(), CREDIT_HOLD_TTL)
+    except Exception as e:
+        logger.warning(f"Credit ledger unavailable, admitting {task_id} unmetered: {e}")
+        return None
+    if int(ok) != 1:
+        raise InsufficientCredits(user_id, amount, int(available))
+    return int(available)
+
+
+def settle(user_id: Optional[str], task_id: str, charge: Optional[int] = None) -> int:
+    """Charge up to ``charge`` units of the job's hold (all of it if None) and release the rest.
+
+    Returns the units charged; settling twice, or a job that was never metered, charges nothing.
+    """
+    if not CREDITS_ENABLED or not user_id:
+        return 0
+    r = get_redis_client()
+    if r is None:
+        return 0
+    try:
+        charged = r.eval(_SETTLE_SCRIPT, 4, *_keys(user_id), OUTBOX_KEY,
+                         "all" if charge is None else max(0, charge), user_id, task_id, int(time.time()))
+    except Exception as e:
+        logger.warning(f"Could not settle credits of {task_id}: {e}")
+        return 0
+    return max(0, int(charged))
+
+
+def refund(user_id: Optional[str], task_id: str) -> None:
+    settle(user_id, task_id, 0)
+
+
+def set_balance(user_id: str, balance: int) -> int:
+    """Authoritative balance from the system of record; charges it has not received yet are kept."""
+    r = get_redis_client()
+    if r is None:
+        raise RuntimeError("Redis unavailable")
+    return int(r.eval(_SET_BALANCE_SCRIPT, 3, *_keys(user_id), balance, time.time()))
+
+
+def get_account(user_id: str) -> Optional[Dict[str, int]]:
+    r = get_redis_client()
+    if r is None:
+        raise RuntimeError("Redis unavailable")
+    raw = r.hgetall(ACCOUNT_PREFIX + user_id)
+    if not raw:
+        return None
+    account = {k: int(raw.get(k, 0)) for k in ("balance", "held", "unsynced")}
+    account["available"] = account["balance"] - account["held"]
+    return account
+
+
+def outbox_batch(r: Any, limit: int) -> List[Dict[str, Any]]:
+    return [json.loads(raw) for raw in r.lrange(OUTBOX_KEY, 0, limit - 1)]
+
+
+def ack_outbox(r: Any, count: int) -> int:
+    return int(r.eval(_ACK_SCRIPT, 1, OUTBOX_KEY, count, ACCOUNT_PREFIX))
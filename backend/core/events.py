@@ -0,0 +1,97 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+
+from .redis import get_async_redis_client, get_redis_client
+from .status import TASK_STATUSES, write_status
+
+logger = logging.getLogger(__name__)
+
+# Task state transitions published by process_ai_task.
+#
+# Each event goes to a per-task pub/sub channel and is also kept as the task's
+# "last event" so a subscriber that connects after a transition still starts
+# from the current state. Task transitions also refresh the compact status
+# record (core/status.py) in the same round trip.
+CHANNEL_PREFIX = "karate:task-events:"
+LAST_EVENT_PREFIX = "karate:task-last:"
+LAST_EVENT_TTL = 3600
+
+
+def publish_task_event(task_id: str, status: str, **fields: Any) -> None:
+    """Best effort: a failed publish must never fail the task itself."""
+    r = get_redis_client()
+    if r is None or not task_id:
+        return
+    event = {"task_id": task_id, "status": status}
+    event.update({k: v for k, v in fields.items() if v is not None})
+    payload = json.dumps(event, separators=(",", ":"))
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.set(LAST_EVENT_PREFIX + task_id, payload, ex=LAST_EVENT_TTL)
+        pipe.publish(CHANNEL_PREFIX + task_id, payload)
+        if status in TASK_STATUSES:
+            write_status(pipe, task_id, status, fields)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to publish event for task {task_id}: {e}")
+
+
+async def last_task_events(task_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    r = get_async_redis_client()
+    ids = list(task_ids)
+    if r is None or not ids:
+        return {}
+    raw = await r.mget([LAST_EVENT_PREFIX + t for t in ids])
+    return {t: json.loads(v) for t, v in zip(ids, raw) if v}
+
+
+async def subscribe_task_events(
+    task_ids: Iterable[str],
+    initial_state: Optional[Callable[[str], Awaitable[Optional[Dict[str, Any]]]]] = None,
+    heartbeat: float = 15.0,
+) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """Yield the current state of each task, then events as they are published.
+
+    Yields None after every ``heartbeat`` seconds of silence so the caller can
+    keep the connection alive; the caller decides when to stop. Tasks that have
+    not published anything yet are resolved through ``initial_state``.
+    """
+    ids = list(task_ids)
+    r = get_async_redis_client()
+    if r is None:
+        return
+    pubsub = r.pubsub()
+    await pubsub.subscribe(*[CHANNEL_PREFIX + t for t in ids])
+    try:
+        # Snapshot only after subscribing so no transition falls in between
+        snapshot = await last_task_events(ids)
+        for t in ids:
+            event = snapshot.get(t)
+            if event is None and initial_state is not None:
+                event = await initial_state(t)
+            if event is not None:
+                yield event
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        while True:
+            msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=heartbeat)
+            now = loop.time()
+            if msg is None:
+                # None also comes back for swallowed subscribe confirmations
+                if now - last >= heartbeat:
+                    last = now
+                    yield None
+                continue
+            last = now
+            try:
+                yield json.loads(msg["data"])
+            except (TypeError, ValueError):
+                continue
+    finally:
+        try:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+        except Exception:
+            pass
@@ -0,0 +1,116 @@
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .config import (
+    FAIR_SHARE_ENABLED,
+    FAIR_SHARE_QUOTA,
+    FAIR_SHARE_TTL,
+    FAIR_SHARE_WEIGHTS,
+    QUEUE_LATENCY_TARGETS,
+)
+from .redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Per-user fair share on top of broker priorities.
+#
+# kombu's Redis transport splits every tier queue into priority sub-queues
+# (PRIORITY_STEPS, 0 consumed first). A job's priority is its class
+# (interactive /infer and workflow nodes ahead of /infer/batch items) plus a
+# penalty that grows with how many of the same user's jobs are already
+# outstanding, relative to that user's weighted quota. One user queueing 200
+# video jobs keeps only the first few at full priority; anybody else's job
+# overtakes the rest. Queued jobs are never reordered, and nothing is held back
+# when the workers are idle.
+#
+# Outstanding jobs are a sorted set per user, task id -> deadline. The worker
+# removes a job when it ends; one that never reports back (hard-killed, lost
+# message) drops out at its deadline instead of demoting its user for good.
+
+PRIORITY_STEPS = (0, 3, 6, 9)
+# Speculative jobs always take the last step and are not counted against the user
+PRIORITY_CLASSES = {"interactive": 0, "batch": 3, "speculative": PRIORITY_STEPS[-1]}
+OUTSTANDING_PREFIX = "karate:fair:outstanding:"
+# kombu's separator between a queue name and its priority suffix
+PRIORITY_SEPARATOR = "\x06\x16"
+
+# KEYS: outstanding | ARGV: now, deadline, ttl, task_id...
+_RESERVE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local before = redis.call('ZCARD', KEYS[1])
+for i = 4, #ARGV do
+  redis.call('ZADD', KEYS[1], ARGV[2], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return before
+"""
+
+
+def user_weight(user_id: str) -> float:
+    return float(FAIR_SHARE_WEIGHTS.get(user_id, 1.0))
+
+
+def priority_for(job_class: str, outstanding: int, weight: float = 1.0) -> int:
+    """Priority step for a job whose user already has ``outstanding`` jobs queued or running."""
+    base = PRIORITY_CLASSES.get(job_class, PRIORITY_CLASSES["batch"])
+    quota = max(1.0, FAIR_SHARE_QUOTA * weight)
+    if outstanding < quota:
+        demotion = 0
+    elif outstanding < 4 * quota:
+        demotion = 1
+    else:
+        demotion = 2
+    steps = [s for s in PRIORITY_STEPS if s >= base]
+    return steps[min(demotion, len(steps) - 1)]
+
+
+def reserve(user_id: Optional[str], job_class: str, task_ids: List[str]) -> List[int]:
+    """Count the jobs ``task_ids`` against the user and return each one's priority.
+
+    Every reserved job must be released by the worker once it has finished.
+    """
+    base = PRIORITY_CLASSES.get(job_class, PRIORITY_CLASSES["batch"])
+    if not FAIR_SHARE_ENABLED or not user_id or job_class == "speculative":
+        return [base] * len(task_ids)
+    r = get_redis_client()
+    if r is None:
+        return [base] * len(task_ids)
+    now = time.time()
+    try:
+        before = int(r.eval(_RESERVE_SCRIPT, 1, OUTSTANDING_PREFIX + user_id,
+                            now, now + FAIR_SHARE_TTL, FAIR_SHARE_TTL, *task_ids))
+    except Exception as e:
+        logger.warning(f"Fair-share reservation failed for {user_id}: {e}")
+        return [base] * len(task_ids)
+    weight = user_weight(user_id)
+    return [priority_for(job_class, before + i, weight) for i in range(len(task_ids))]
+
+
+def release(user_id: Optional[str], task_id: str) -> None:
+    """Stop counting ``task_id``; releasing a job twice (or one never counted) is harmless."""
+    if not FAIR_SHARE_ENABLED or not user_id:
+        return
+    r = get_redis_client()
+    if r is None:
+        return
+    try:
+        r.zrem(OUTSTANDING_PREFIX + user_id, task_id)
+    except Exception as e:
+        logger.warning(f"Fair-share release failed for {user_id}: {e}")
+
+
+def queue_depths() -> Dict[Tuple[str, int], int]:
+    """Messages waiting per (tier queue, priority step), read straight from the broker lists."""
+    r = get_redis_client()
+    if r is None:
+        return {}
+    keys = [(queue, step) for queue in QUEUE_LATENCY_TARGETS for step in PRIORITY_STEPS]
+    try:
+        pipe = r.pipeline(transaction=False)
+        for queue, step in keys:
+            pipe.llen(f"{queue}{PRIORITY_SEPARATOR}{step}" if step else queue)
+        return dict(zip(keys, (int(n) for n in pipe.execute())))
+    except Exception as e:
+        logger.warning(f"Queue depth read failed: {e}")
+        return {}
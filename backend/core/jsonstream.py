@@ -0,0 +1,124 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# Incremental parser for a JSON object that arrives in pieces (streamed LLM output).
+#
+# Only the top level is tracked: string fields are decoded as their characters
+# arrive and reported as ("text", key, delta) so a client can render them
+# token by token, and every field is reported once as ("field", key, value)
+# when its value is complete. Nested values are scanned for their closing
+# bracket and parsed in one go. Malformed input raises ValueError, like
+# json.loads.
+
+Event = Tuple[str, str, Any]
+
+_HIGH_SURROGATES = ("\ud800", "\udbff")
+
+
+class ObjectStream:
+    def __init__(self) -> None:
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._buf = ""
+        self._pos = 0
+        self._state = "start"
+        self._key: Optional[str] = None
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._emitted = 0
+
+    def feed(self, chunk: str) -> List[Event]:
+        self._buf += chunk
+        events: List[Event] = []
+        buf = self._buf
+        while self._pos < len(buf) and not self.done:
+            c = buf[self._pos]
+            state = self._state
+            if state == "start":
+                if c == "{":
+                    self._state = "key"
+                elif not c.isspace():
+                    raise ValueError(f"Expected a JSON object, got {c!r}")
+            elif state == "key":
+                if c == '"':
+                    self._state, self._start = "key_string", self._pos
+                elif c == "}":
+                    self.done = True
+                elif not c.isspace() and c != ",":
+                    raise ValueError(f"Expected a key at offset {self._pos}, got {c!r}")
+            elif state in ("key_string", "string"):
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    value = json.loads(buf[self._start:self._pos + 1])
+                    if state == "key_string":
+                        self._key, self._state = value, "colon"
+                    else:
+                        if len(value) > self._emitted:
+                            events.append(("text", self._key, value[self._emitted:]))
+                        self._complete(events, value)
+            elif state == "colon":
+                if c == ":":
+                    self._state = "value"
+                elif not c.isspace():
+                    raise ValueError(f"Expected ':' at offset {self._pos}, got {c!r}")
+            elif state == "value":
+                if c == '"':
+                    self._state, self._start, self._emitted = "string", self._pos, 0
+                elif c in "{[":
+                    self._state, self._start, self._depth = "nested", self._pos, 1
+                elif not c.isspace():
+                    self._state, self._start = "scalar", self._pos
+            elif state == "nested":
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif c == "\\":
+                        self._escape = True
+                    elif c == '"':
+                        self._in_string = False
+                elif c == '"':
+                    self._in_string = True
+                elif c in "{[":
+                    self._depth += 1
+                elif c in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._complete(events, json.loads(buf[self._start:self._pos + 1]))
+            elif state == "scalar":
+                if c in ",}" or c.isspace():
+                    self._complete(events, json.loads(buf[self._start:self._pos]))
+                    continue  # the terminator is handled as "after"
+            elif state == "after":
+                if c == ",":
+                    self._state = "key"
+                elif c == "}":
+                    self.done = True
+                elif not c.isspace():
+                    raise ValueError(f"Expected ',' or '}}' at offset {self._pos}, got {c!r}")
+            self._pos += 1
+        if self._state == "string":
+            self._partial_text(events)
+        return events
+
+    def _complete(self, events: List[Event], value: Any) -> None:
+        self.fields[self._key] = value
+        events.append(("field", self._key, value))
+        self._state = "after"
+
+    def _partial_text(self, events: List[Event]) -> None:
+        raw = self._buf[self._start:self._pos]
+        try:
+            text = json.loads(raw + '"')
+        except ValueError:
+            # An escape sequence is still arriving; hold it back
+            text = json.loads(raw[:raw.rfind("\\")] + '"')
+        if text and _HIGH_SURROGATES[0] <= text[-1] <= _HIGH_SURROGATES[1]:
+            text = text[:-1]  # first half of a surrogate pair
+        if len(text) > self._emitted:
+            events.append(("text", self._key, text[self._emitted:]))
+            self._emitted = len(text)
@@ -0,0 +1,203 @@
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .config import (
+    LIMITS_ENABLED,
+    LIMIT_LEASE_TTL,
+    MODEL_LIMITS,
+    PROVIDER_LIMITS,
+    QUEUE_LATENCY_TARGETS,
+)
+from .models import resolve
+from .redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Adaptive per-provider / per-model admission control held in Redis.
+#
+# Every scope ("provider:replicate", "model:veo-3", ...) has a token bucket for
+# request rate and a set of leases for concurrency. The concurrency ceiling
+# adapts AIMD-style: each healthy completion adds 1/limit, a 429 halves it and
+# a completion slower than its queue's latency target shrinks it by 20%.
+# Leases expire on their own so a killed worker cannot leak capacity.
+
+PREFIX = "karate:limits:"
+
+# KEYS: per scope (holders zset, bucket hash, limit key)
+# ARGV: now, token, lease_ttl, then per scope (max_concurrency, rate, burst)
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local n = #KEYS / 3
+local wait = 0
+local tokens = {}
+for i = 0, n - 1 do
+  local holders, bucket, limitk = KEYS[i*3+1], KEYS[i*3+2], KEYS[i*3+3]
+  local maxc, rate, burst = tonumber(ARGV[4+i*3]), tonumber(ARGV[5+i*3]), tonumber(ARGV[6+i*3])
+  redis.call('ZREMRANGEBYSCORE', holders, '-inf', now)
+  local limit = tonumber(redis.call('GET', limitk) or maxc)
+  if redis.call('ZCARD', holders) >= math.max(1, math.floor(limit)) then
+    wait = math.max(wait, 1)
+  end
+  if rate > 0 then
+    local b = redis.call('HMGET', bucket, 'tokens', 'ts')
+    local t = tonumber(b[1] or burst)
+    local ts = tonumber(b[2] or now)
+    t = math.min(burst, t + math.max(0, now - ts) * rate)
+    tokens[i] = t
+    if t < 1 then wait = math.max(wait, (1 - t) / rate) end
+  end
+end
+if wait > 0 then return tostring(wait) end
+for i = 0, n - 1 do
+  local holders, bucket = KEYS[i*3+1], KEYS[i*3+2]
+  redis.call('ZADD', holders, now + tonumber(ARGV[3]), ARGV[2])
+  redis.call('EXPIRE', holders, tonumber(ARGV[3]))
+  if tokens[i] ~= nil then
+    redis.call('HSET', bucket, 'tokens', tostring(tokens[i] - 1), 'ts', tostring(now))
+    redis.call('EXPIRE', bucket, 3600)
+  end
+end
+return 'ok'
+"""
+
+# KEYS: per scope (holders zset, bucket hash, limit key)
+# ARGV: token, outcome, now, then per scope (max_concurrency, min_concurrency)
+_RELEASE_SCRIPT = """
+local n = #KEYS / 3
+for i = 0, n - 1 do
+  local holders, bucket, limitk = KEYS[i*3+1], KEYS[i*3+2], KEYS[i*3+3]
+  local maxc, minc = tonumber(ARGV[4+i*2]), tonumber(ARGV[5+i*2])
+  redis.call('ZREM', holders, ARGV[1])
+  local limit = tonumber(redis.call('GET', limitk) or maxc)
+  if ARGV[2] == 'ok' then
+    limit = math.min(maxc, limit + 1 / math.max(1, limit))
+  elseif ARGV[2] == 'throttled' then
+    limit = math.max(minc, limit / 2)
+    redis.call('HSET', bucket, 'tokens', '0', 'ts', ARGV[3])
+  elseif ARGV[2] == 'congested' then
+    limit = math.max(minc, limit * 0.8)
+  end
+  redis.call('SET', limitk, tostring(limit), 'EX', 3600)
+end
+return 1
+"""
+
+
+class Throttled(Exception):
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"{scope} is at capacity; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class Lease(NamedTuple):
+    provider: str
+    model: str
+    token: str
+    started: float
+
+
+def queue_for_model(model: str) -> str:
+    """Celery queue derived from the model's cost tier; unknown slugs go to the standard tier."""
+    spec = resolve(model)
+    return spec.queue if spec else "standard"
+
+
+def _scopes(provider: str, model: str) -> List[Tuple[str, Dict[str, Any]]]:
+    scopes = [(f"provider:{provider}", PROVIDER_LIMITS.get(provider, PROVIDER_LIMITS["http"]))]
+    if model in MODEL_LIMITS:
+        scopes.append((f"model:{model}", MODEL_LIMITS[model]))
+    return scopes
+
+
+def _scope_keys(scopes: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+    keys: List[str] = []
+    for name, _ in scopes:
+        keys += [f"{PREFIX}{name}:holders", f"{PREFIX}{name}:bucket", f"{PREFIX}{name}:limit"]
+    return keys
+
+
+def is_rate_limited(e: BaseException) -> bool:
+    """True for provider 429s across httpx, OpenAI and Replicate exceptions."""
+    for candidate in (e, getattr(e, "response", None)):
+        for attr in ("status_code", "status"):
+            if getattr(candidate, attr, None) == 429:
+                return True
+    return type(e).__name__ == "RateLimitError"
+
+
+def acquire_slot(provider: str, model: str) -> Optional[Lease]:
+    """Take a concurrency lease and a rate token for every scope, or raise Throttled.
+
+    Returns None (admit without a lease) when limits are disabled or Redis is unreachable.
+    """
+    if not LIMITS_ENABLED:
+        return None
+    r = get_redis_client()
+    if r is None:
+        return None
+    scopes = _scopes(provider, model)
+    token = uuid.uuid4().hex
+    args: List[Any] = [time.time(), token, LIMIT_LEASE_TTL]
+    for _, cfg in scopes:
+        args += [cfg["max_concurrency"], cfg.get("rate", 0), cfg.get("burst", 1)]
+    try:
+        res = r.eval(_ACQUIRE_SCRIPT, len(scopes) * 3, *_scope_keys(scopes), *args)
+    except Exception as e:
+        logger.warning(f"Limiter unavailable, admitting {model}: {e}")
+        return None
+    if res != "ok":
+        raise Throttled("/".join(name for name, _ in scopes), float(res))
+    return Lease(provider, model, token, time.monotonic())
+
+
+def release_slot(lease: Optional[Lease], outcome: str = "ok") -> None:
+    """Return the lease and feed the outcome ('ok', 'throttled', 'error') into AIMD.
+
+    A successful call slower than its queue's latency target counts as congestion.
+    """
+    if lease is None:
+        return
+    elapsed = time.monotonic() - lease.started
+    if outcome == "ok" and elapsed > QUEUE_LATENCY_TARGETS.get(queue_for_model(lease.model), 120):
+        outcome = "congested"
+    r = get_redis_client()
+    if r is None:
+        return
+    scopes = _scopes(lease.provider, lease.model)
+    args: List[Any] = [lease.token, outcome, time.time()]
+    for _, cfg in scopes:
+        args += [cfg["max_concurrency"], cfg.get("min_concurrency", 1)]
+    try:
+        r.eval(_RELEASE_SCRIPT, len(scopes) * 3, *_scope_keys(scopes), *args)
+    except Exception as e:
+        logger.warning(f"Failed to release limiter lease for {lease.model}: {e}")
+
+
+def limiter_snapshot() -> Dict[str, Dict[str, Any]]:
+    """Current adaptive limit and in-flight count per configured scope."""
+    r = get_redis_client()
+    out: Dict[str, Dict[str, Any]] = {}
+    if r is None:
+        return out
+    names = [f"provider:{p}" for p in PROVIDER_LIMITS] + [f"model:{m}" for m in MODEL_LIMITS]
+    cfgs = list(PROVIDER_LIMITS.values()) + list(MODEL_LIMITS.values())
+    try:
+        pipe = r.pipeline(transaction=False)
+        now = time.time()
+        for name in names:
+            pipe.get(f"{PREFIX}{name}:limit")
+            pipe.zcount(f"{PREFIX}{name}:holders", now, "+inf")
+        raw = pipe.execute()
+    except Exception as e:
+        logger.warning(f"Limiter snapshot failed: {e}")
+        return out
+    for i, (name, cfg) in enumerate(zip(names, cfgs)):
+        limit, in_flight = raw[i * 2], raw[i * 2 + 1]
+        out[name] = {
+            "limit": round(float(limit), 2) if limit else float(cfg["max_concurrency"]),
+            "max_concurrency": cfg["max_concurrency"],
+            "in_flight": int(in_flight or 0),
+        }
+    return out
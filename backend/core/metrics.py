@@ -0,0 +1,137 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional, Tuple
+
+from .models import get_registry
+from .retry import status_of
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client  # type: ignore
+    from prometheus_client import Counter, Gauge, Histogram, multiprocess  # type: ignore
+except Exception:
+    prometheus_client = None  # type: ignore
+
+# Prometheus metrics for the inference pipeline, shared by the API and workers.
+#
+# A request passes through: enqueue (API -> broker), queue wait (broker ->
+# worker pickup), provider call, then result write. The first three have their
+# own histograms; task runtime minus provider latency is the worker's own
+# overhead, result write included. With several processes per host (uvicorn
+# workers, prefork children) set PROMETHEUS_MULTIPROC_DIR so every exporter
+# aggregates all of them.
+#
+# Without prometheus-client installed every metric is a no-op.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (0, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+SIZE_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 16384, 65536, 262144, 1048576)
+
+
+class _NoopMetric:
+    def labels(self, *args: Any, **kwargs: Any) -> "_NoopMetric":
+        return self
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+
+def _histogram(name: str, doc: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Any:
+    if prometheus_client is None:
+        return _NoopMetric()
+    return Histogram(name, doc, labels, buckets=buckets)
+
+
+def _counter(name: str, doc: str, labels: Tuple[str, ...] = ()) -> Any:
+    if prometheus_client is None:
+        return _NoopMetric()
+    return Counter(name, doc, labels)
+
+
+def _gauge(name: str, doc: str, labels: Tuple[str, ...] = ()) -> Any:
+    if prometheus_client is None:
+        return _NoopMetric()
+    # Only the API sets gauges; across processes the latest value wins
+    return Gauge(name, doc, labels, multiprocess_mode="mostrecent")
+
+
+ENQUEUE_SECONDS = _histogram("karate_enqueue_seconds", "Time to publish a job to the broker", ("endpoint",))
+QUEUE_WAIT_SECONDS = _histogram("karate_queue_wait_seconds", "Time from publish (or ETA) to worker pickup", ("queue",))
+TASK_RUNTIME_SECONDS = _histogram("karate_task_runtime_seconds", "Worker time per task, result write included", ("task",))
+PROVIDER_LATENCY_SECONDS = _histogram(
+    "karate_provider_latency_seconds", "Provider call latency", ("provider", "model", "outcome")
+)
+RESULT_SIZE_BYTES = _histogram("karate_result_size_bytes", "Serialized task result size", ("model",), SIZE_BUCKETS)
+STATUS_LOOKUP_SECONDS = _histogram("karate_status_lookup_seconds", "Status endpoint lookup latency", ("endpoint",))
+PROVIDER_FAILURES = _counter("karate_provider_failures_total", "Failed provider calls", ("provider", "error_class"))
+TASK_RETRIES = _counter("karate_task_retries_total", "Task re-queues", ("provider", "reason"))
+ENQUEUED_JOBS = _counter("karate_enqueued_jobs_total", "Model jobs published, by class and fair-share priority", ("job_class", "priority"))
+QUEUE_DEPTH = _gauge("karate_queue_depth", "Messages waiting in the broker per tier queue and priority", ("queue", "priority"))
+COALESCED_REQUESTS = _counter("karate_coalesced_requests_total", "Requests joined to an identical in-flight task", ("model",))
+CHAT_TOKENS_SAVED = _histogram(
+    "karate_chat_history_tokens_saved", "History tokens per agent chat request replaced by the session summary", buckets=TOKEN_BUCKETS
+)
+CHAT_PROMPT_TOKENS = _counter("karate_chat_prompt_tokens_total", "Agent chat prompt tokens, by provider prompt-cache hit", ("cache",))
+CHAT_COMPACTIONS = _counter("karate_chat_compactions_total", "Agent chat sessions whose oldest turns were summarized")
+SPECULATIVE_JOBS = _counter(
+    "karate_speculative_jobs_total", "Speculative job registrations, by what became of them", ("model", "outcome")
+)
+
+
+def model_label(model: str) -> str:
+    """Known model ids only; arbitrary Replicate slugs would explode label cardinality."""
+    return model if model in get_registry() else "other"
+
+
+def error_class(e: BaseException) -> str:
+    status = status_of(e)
+    return f"{type(e).__name__}:{status}" if status else type(e).__name__
+
+
+@contextmanager
+def timed(metric: Any) -> Iterator[None]:
+    """Observe the duration of the block on an already-labelled histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - start)
+
+
+def _registry() -> Any:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
+
+
+def metrics_payload() -> Optional[Tuple[bytes, str]]:
+    """Text exposition of all metrics and its content type, or None without prometheus-client."""
+    if prometheus_client is None:
+        return None
+    return prometheus_client.generate_latest(_registry()), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int) -> None:
+    if prometheus_client is None or not port:
+        return
+    try:
+        prometheus_client.start_http_server(port, registry=_registry())
+        logger.info(f"Metrics exporter listening on :{port}")
+    except OSError as e:
+        logger.warning(f"Could not start metrics exporter on :{port}: {e}")
+
+
+def mark_process_dead(pid: int) -> None:
+    if prometheus_client is not None and os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from .config import (
+    MODEL_COSTS,
+    MODEL_REGISTRY_CHECK_INTERVAL,
+    MODEL_REGISTRY_PATH,
+    MODEL_TIMEOUTS,
+    MULTI_OUTPUT_MODELS,
+)
+from .redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Typed model registry.
+#
+# Everything a task needs to dispatch a model (provider, runner kind, provider
+# target, HTTP endpoint, queue tier, timeout, accepted params) is resolved once
+# when the registry is built, instead of string-matching and reading the
+# environment on every task. Specs are immutable; a reload swaps the whole
+# table. Each process re-checks MODEL_REGISTRY_PATH's mtime and a shared
+# version counter (bumped by POST /api/v1/ai/models/reload) at most every
+# MODEL_REGISTRY_CHECK_INTERVAL seconds, so workers pick up changes without a
+# restart.
+
+VERSION_KEY = "karate:models:version"
+
+SDXL_VERSION = "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c71dcde277882d13b833d5c75deae501615"
+SDXL_PARAMS = frozenset({"aspect_ratio", "guidance_scale", "seed", "safety_tolerance"})
+
+# Provider family per runner kind, used for admission control and metrics
+PROVIDER_OF_KIND = {
+    "replicate_sdxl": "replicate",
+    "replicate": "replicate",
+    "openai_image": "openai",
+    "http": "http",
+}
+
+
+class ModelSpec(NamedTuple):
+    id: str
+    provider: str
+    kind: str
+    target: str  # Replicate ref, OpenAI model name or HTTP endpoint URL
+    cost: int
+    queue: str
+    timeout: float
+    # Params the runner forwards; None passes everything through (Replicate schemas vary per model)
+    params: Optional[FrozenSet[str]]
+    max_outputs: int = 1
+    auth: Optional[str] = None  # Authorization header for HTTP endpoints
+
+
+def queue_for_cost(cost: int) -> str:
+    if cost <= 1:
+        return "fast"
+    if cost == 2:
+        return "standard"
+    return "heavy"
+
+
+def _env_key(model: str) -> str:
+    return model.upper().replace("-", "_").replace("/", "_")
+
+
+def default_spec(model: str, cost: int) -> ModelSpec:
+    """Spec for a model id, following the historical routing rules and env overrides."""
+    queue = queue_for_cost(cost)
+    common = {"id": model, "cost": cost, "queue": queue, "timeout": float(MODEL_TIMEOUTS[queue]),
+              "max_outputs": MULTI_OUTPUT_MODELS.get(model, 1)}
+    if model == "stable-diffusion-3.5":
+        return ModelSpec(provider="replicate", kind="replicate_sdxl", target=SDXL_VERSION, params=SDXL_PARAMS, **common)
+    if model in ("dalle-3", "gpt-image-1"):
+        target = "dall-e-3" if model == "dalle-3" else model
+        return ModelSpec(provider="openai", kind="openai_image", target=target, params=frozenset(), **common)
+    slug = os.getenv(f"REPLICATE_{_env_key(model)}", model)
+    if "/" in slug:
+        return ModelSpec(provider="replicate", kind="replicate", target=slug, params=None, **common)
+    key = _env_key(model)
+    return ModelSpec(provider="http", kind="http", target=os.getenv(f"HTTP_MODEL_{key}_URL", ""),
+                     params=None, auth=os.getenv(f"HTTP_MODEL_{key}_AUTH") or None, **common)
+
+
+def _apply_override(model: str, base: Optional[ModelSpec], entry: Dict[str, Any]) -> ModelSpec:
+    cost = int(entry.get("cost", base.cost if base else 2))
+    spec = base or default_spec(model, cost)
+    fields: Dict[str, Any] = {k: entry[k] for k in ("provider", "kind", "target", "queue", "auth") if k in entry}
+    if "cost" in entry:
+        fields["cost"] = cost
+        if "queue" not in entry:
+            fields["queue"] = queue_for_cost(cost)
+    if "timeout" in entry:
+        fields["timeout"] = float(entry["timeout"])
+    if "max_outputs" in entry:
+        fields["max_outputs"] = int(entry["max_outputs"])
+    if "params" in entry:
+        fields["params"] = None if entry["params"] is None else frozenset(entry["params"])
+    if "kind" in entry and "provider" not in entry:
+        fields["provider"] = PROVIDER_OF_KIND.get(entry["kind"], spec.provider)
+    spec = spec._replace(**fields)
+    if spec.kind not in PROVIDER_OF_KIND:
+        raise ValueError(f"Unknown model kind {spec.kind!r} for {model}")
+    return spec
+
+
+def _load_overrides(path: str) -> Dict[str, Dict[str, Any]]:
+    if not path:
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must contain a JSON object keyed by model id")
+    return data
+
+
+def build_registry(path: Optional[str] = None) -> Dict[str, ModelSpec]:
+    registry = {model: default_spec(model, cost) for model, cost in MODEL_COSTS.items()}
+    for model, entry in _load_overrides(MODEL_REGISTRY_PATH if path is None else path).items():
+        registry[model] = _apply_override(model, registry.get(model), entry)
+    return registry
+
+
+class _State:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.registry: Dict[str, ModelSpec] = {}
+        self.mtime: Optional[float] = None
+        self.version: Optional[str] = None
+        self.checked = 0.0
+
+
+_state = _State()
+
+
+def _file_mtime() -> Optional[float]:
+    try:
+        return os.path.getmtime(MODEL_REGISTRY_PATH) if MODEL_REGISTRY_PATH else None
+    except OSError:
+        return None
+
+
+def _shared_version() -> Optional[str]:
+    r = get_redis_client()
+    if r is None:
+        return None
+    try:
+        return r.get(VERSION_KEY)
+    except Exception as e:
+        logger.debug(f"Model registry version check failed: {e}")
+        return _state.version
+
+
+def reload() -> Dict[str, ModelSpec]:
+    """Rebuild this process's registry; a broken file keeps the previous table."""
+    with _state.lock:
+        try:
+            registry = build_registry()
+        except Exception as e:
+            logger.error(f"Model registry reload failed, keeping {len(_state.registry)} models: {e}")
+            if _state.registry:
+                return _state.registry
+            registry = build_registry(path="")
+        _state.registry = registry
+        _state.mtime = _file_mtime()
+        _state.checked = time.monotonic()
+        logger.info(f"Loaded model registry ({len(registry)} models)")
+        return registry
+
+
+def get_registry() -> Dict[str, ModelSpec]:
+    now = time.monotonic()
+    if _state.registry and now - _state.checked < MODEL_REGISTRY_CHECK_INTERVAL:
+        return _state.registry
+    _state.checked = now
+    version = _shared_version()
+    if not _state.registry or _file_mtime() != _state.mtime or version != _state.version:
+        _state.version = version
+        return reload()
+    return _state.registry
+
+
+def publish_reload() -> Dict[str, ModelSpec]:
+    """Reload here and bump the shared version so every other process reloads on its next check."""
+    r = get_redis_client()
+    if r is not None:
+        try:
+            _state.version = str(r.incr(VERSION_KEY))
+        except Exception as e:
+            logger.warning(f"Could not publish model registry reload: {e}")
+    return reload()
+
+
+def resolve(model: str) -> Optional[ModelSpec]:
+    """Spec for a registered model or an ad-hoc Replicate slug (owner/name); None if unknown."""
+    spec = get_registry().get(model)
+    if spec is None and "/" in model:
+        queue = queue_for_cost(2)
+        spec = ModelSpec(id=model, provider="replicate", kind="replicate", target=model, cost=2, queue=queue,
+                         timeout=float(MODEL_TIMEOUTS[queue]), params=None)
+    return spec
+
+
+def split_params(spec: ModelSpec, params: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """(params the model's runner takes, names of the rest).
+
+    The editor sends its default params (aspect_ratio, output_format, seed, ...)
+    for every model, so params a model does not accept are dropped, not errors.
+    """
+    if spec.params is None:
+        return dict(params), []
+    kept = {k: v for k, v in params.items() if k in spec.params}
+    return kept, sorted(set(params) - set(kept))
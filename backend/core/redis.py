@@ -1,14 +1,45 @@
+import asyncio
 import os
 import redis
+import redis.asyncio as aioredis
 import logging
+from typing import Dict
 
 logger = logging.getLogger(__name__)
 
+_async_clients: Dict[int, "aioredis.Redis"] = {}
+_sync_clients: Dict[int, "redis.Redis"] = {}
+
 def get_redis_client():
+    # One client (and connection pool) per process; rebuilt after fork
+    client = _sync_clients.get(os.getpid())
+    if client is not None:
+        return client
     redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     try:
-        return redis.from_url(redis_url, decode_responses=True)
+        client = redis.from_url(redis_url, decode_responses=True)
     except Exception as e:
         logger.error(f"Failed to connect to Redis: {e}")
         return None
+    _sync_clients.clear()
+    _sync_clients[os.getpid()] = client
+    return client
+
+def get_async_redis_client():
+    """Shared asyncio Redis client for the running event loop."""
+    loop_id = id(asyncio.get_running_loop())
+    client = _async_clients.get(loop_id)
+    if client is None:
+        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        try:
+            client = aioredis.from_url(redis_url, decode_responses=True)
+        except Exception as e:
+            logger.error(f"Failed to connect to Redis: {e}")
+            return None
+        _async_clients[loop_id] = client
+    return client
 
+async def close_async_redis_client():
+    client = _async_clients.pop(id(asyncio.get_running_loop()), None)
+    if client is not None:
+        await client.aclose()
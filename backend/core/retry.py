@@ -0,0 +1,115 @@
+import logging
+import random
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .config import HEDGE_DEFAULT_DELAY, HEDGE_MIN_SAMPLES, HEDGED_MODELS, RETRY_POLICIES
+from .limits import is_rate_limited
+from .redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Retry classification and hedging thresholds for provider calls.
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+# Exception class names that mean "try again" regardless of provider SDK
+RETRYABLE_ERRORS = {
+    "TimeoutException", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout",
+    "ConnectError", "ReadError", "RemoteProtocolError", "NetworkError",
+    "APITimeoutError", "APIConnectionError", "InternalServerError", "RateLimitError",
+    "TimeoutError", "ConnectionError", "ConnectionResetError",
+}
+
+LATENCY_PREFIX = "karate:latency:"
+LATENCY_SAMPLES = 200
+_quantile_cache: Dict[str, Tuple[float, Optional[float]]] = {}
+QUANTILE_CACHE_TTL = 60.0
+
+
+class RetryPolicy(NamedTuple):
+    max_retries: int
+    base_delay: float
+    max_delay: float
+
+    def delay(self, attempt: int) -> float:
+        return backoff_delay(attempt, self.base_delay, self.max_delay)
+
+
+def backoff_delay(attempt: int, base: float = 2.0, cap: float = 60.0) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def policy_for(provider: str) -> RetryPolicy:
+    cfg = RETRY_POLICIES.get(provider, RETRY_POLICIES["http"])
+    return RetryPolicy(int(cfg["max_retries"]), float(cfg["base_delay"]), float(cfg["max_delay"]))
+
+
+def status_of(e: BaseException) -> Optional[int]:
+    for candidate in (e, getattr(e, "response", None)):
+        for attr in ("status_code", "status"):
+            status = getattr(candidate, attr, None)
+            if isinstance(status, int):
+                return status
+    return None
+
+
+def is_retryable(provider: str, e: BaseException) -> bool:
+    """Transient failures worth another attempt: timeouts, connection drops, 429 and 5xx.
+
+    Replicate prediction failures (ModelError) are the model rejecting the input
+    and are never retried.
+    """
+    if is_rate_limited(e):
+        return True
+    name = type(e).__name__
+    if provider == "replicate" and name == "ModelError":
+        return False
+    if name in RETRYABLE_ERRORS:
+        return True
+    status = status_of(e)
+    return status in RETRYABLE_STATUS
+
+
+def record_latency(model: str, seconds: float) -> None:
+    r = get_redis_client()
+    if r is None:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.lpush(LATENCY_PREFIX + model, round(seconds, 3))
+        pipe.ltrim(LATENCY_PREFIX + model, 0, LATENCY_SAMPLES - 1)
+        pipe.execute()
+    except Exception as e:
+        logger.debug(f"Failed to record latency for {model}: {e}")
+
+
+def _quantile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_quantile(model: str, q: float = 0.95) -> Optional[float]:
+    """Recent provider latency quantile for ``model``, cached in-process for a minute."""
+    cached = _quantile_cache.get(model)
+    now = time.monotonic()
+    if cached and now - cached[0] < QUANTILE_CACHE_TTL:
+        return cached[1]
+    value = None
+    r = get_redis_client()
+    if r is not None:
+        try:
+            samples = [float(s) for s in r.lrange(LATENCY_PREFIX + model, 0, -1)]
+            if len(samples) >= HEDGE_MIN_SAMPLES:
+                value = _quantile(samples, q)
+        except Exception as e:
+            logger.debug(f"Failed to read latency samples for {model}: {e}")
+    _quantile_cache[model] = (now, value)
+    return value
+
+
+def hedge_delay(model: str) -> Optional[float]:
+    """Seconds to wait before firing a backup attempt, or None if ``model`` is not hedged."""
+    if model not in HEDGED_MODELS:
+        return None
+    return latency_quantile(model) or HEDGE_DEFAULT_DELAY
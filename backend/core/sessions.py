@@ -0,0 +1,191 @@
+import json
+import logging
+import uuid
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from . import metrics
+from .config import CHAT_HISTORY_TOKEN_BUDGET, CHAT_SESSION_TTL
+from .redis import get_async_redis_client
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken  # type: ignore
+except Exception:
+    tiktoken = None  # type: ignore
+
+# Server-side agent chat sessions.
+#
+# Opt-in: a client that sends a session_id (or asks for a new session) gets
+# one and sends that id instead of resending the whole history; clients that
+# keep sending their history (the editor's agent panel) stay stateless. Ids
+# are scoped to the x-user-id caller, so another user's id resolves to nothing.
+# Each session keeps its turns (with their token counts) in a Redis list and a
+# running summary of everything older in a hash. Prompts are laid out
+# most-stable first: the fixed system prompt, the summary, the stored turns,
+# then the new message, so consecutive requests share a long identical prefix
+# that the provider's prompt cache can reuse. Compaction runs after a reply,
+# only once the turns exceed CHAT_HISTORY_TOKEN_BUDGET, and folds the oldest
+# turns into the summary until half the budget is left. The prefix therefore
+# changes once every few turns rather than sliding on every request.
+#
+# Without Redis, chat falls back to the history sent by the client.
+
+SESSION_PREFIX = "karate:chat:session:"
+TURNS_PREFIX = "karate:chat:turns:"
+COMPACT_LOCK_PREFIX = "karate:chat:compact:"
+COMPACT_LOCK_TTL = 120
+MESSAGE_OVERHEAD = 4  # tokens per chat message beyond its content
+MIN_KEPT_TURNS = 2
+
+Turn = Dict[str, object]
+Summarizer = Callable[[str, List[Dict[str, str]]], Awaitable[str]]
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when installed, else the usual 4-characters-per-token estimate."""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text)) + MESSAGE_OVERHEAD
+    return len(text) // 4 + 1 + MESSAGE_OVERHEAD
+
+
+class Session(NamedTuple):
+    id: str
+    user_id: str
+    summary: str
+    summary_tokens: int
+    # Original size of the turns folded into the summary
+    archived_tokens: int
+    turns: List[Turn]
+
+    def messages(self, system_prompt: str, prompt: str) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        messages.extend({"role": t["role"], "content": t["content"]} for t in self.turns)
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.archived_tokens - self.summary_tokens)
+
+
+def _keys(user_id: str, session_id: str) -> Tuple[str, str]:
+    scoped = f"{user_id}:{session_id}"
+    return SESSION_PREFIX + scoped, TURNS_PREFIX + scoped
+
+
+def _turn(message: Dict[str, str]) -> Turn:
+    return {"role": message["role"], "content": message["content"], "tokens": count_tokens(message["content"])}
+
+
+async def open_session(user_id: str, session_id: Optional[str],
+                       seed: Optional[List[Dict[str, str]]] = None) -> Optional[Session]:
+    """Load one of ``user_id``'s sessions, or start one (seeded with client-sent history) if it is new or expired.
+
+    Returns None when Redis is unavailable.
+    """
+    r = get_async_redis_client()
+    if r is None:
+        return None
+    session_id = session_id or uuid.uuid4().hex
+    meta_key, turns_key = _keys(user_id, session_id)
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.hgetall(meta_key)
+        pipe.lrange(turns_key, 0, -1)
+        meta, raw_turns = await pipe.execute()
+        if not meta and not raw_turns and seed:
+            raw_turns = [json.dumps(_turn(m)) for m in seed]
+            seed_pipe = r.pipeline(transaction=False)
+            seed_pipe.rpush(turns_key, *raw_turns)
+            seed_pipe.expire(turns_key, CHAT_SESSION_TTL)
+            await seed_pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not load chat session {session_id}: {e}")
+        return None
+    return Session(
+        id=session_id,
+        user_id=user_id,
+        summary=meta.get("summary", ""),
+        summary_tokens=int(meta.get("summary_tokens", 0)),
+        archived_tokens=int(meta.get("archived_tokens", 0)),
+        turns=[json.loads(t) for t in raw_turns],
+    )
+
+
+async def record_turns(session: Session, messages: List[Dict[str, str]]) -> None:
+    r = get_async_redis_client()
+    if r is None:
+        return
+    meta_key, turns_key = _keys(session.user_id, session.id)
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.rpush(turns_key, *[json.dumps(_turn(m)) for m in messages])
+        pipe.expire(turns_key, CHAT_SESSION_TTL)
+        pipe.expire(meta_key, CHAT_SESSION_TTL)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not store turns of chat session {session.id}: {e}")
+
+
+def _overflow(turns: List[Turn], budget: int) -> int:
+    """How many of the oldest turns to fold so the rest fits in half the budget; 0 while under budget."""
+    sizes = [int(t["tokens"]) for t in turns]
+    total = sum(sizes)
+    if total <= budget:
+        return 0
+    fold = 0
+    while fold < len(turns) - MIN_KEPT_TURNS and total > budget // 2:
+        total -= sizes[fold]
+        fold += 1
+    return fold
+
+
+async def compact(user_id: str, session_id: str, summarize: Summarizer,
+                  budget: int = CHAT_HISTORY_TOKEN_BUDGET) -> bool:
+    """Fold the oldest turns into the summary if the session is over budget; True if it did."""
+    r = get_async_redis_client()
+    if r is None:
+        return False
+    meta_key, turns_key = _keys(user_id, session_id)
+    lock = COMPACT_LOCK_PREFIX + f"{user_id}:{session_id}"
+    try:
+        if not await r.set(lock, "1", nx=True, ex=COMPACT_LOCK_TTL):
+            return False  # another request is already compacting
+    except Exception as e:
+        logger.warning(f"Could not compact chat session {session_id}: {e}")
+        return False
+    try:
+        session = await open_session(user_id, session_id)
+        fold = _overflow(session.turns, budget) if session else 0
+        if not fold:
+            return False
+        folded = session.turns[:fold]
+        summary = await summarize(session.summary, [{"role": t["role"], "content": t["content"]} for t in folded])
+        archived = session.archived_tokens + sum(int(t["tokens"]) for t in folded)
+        pipe = r.pipeline(transaction=True)
+        # Turns appended meanwhile are at the tail, so trimming the head is safe
+        pipe.ltrim(turns_key, fold, -1)
+        pipe.hset(meta_key, mapping={
+            "summary": summary, "summary_tokens": count_tokens(summary), "archived_tokens": archived,
+        })
+        pipe.expire(meta_key, CHAT_SESSION_TTL)
+        await pipe.execute()
+        metrics.CHAT_COMPACTIONS.inc()
+        logger.info(f"Compacted chat session {session_id}: {fold} turns into the summary")
+        return True
+    except Exception as e:
+        logger.warning(f"Could not compact chat session {session_id}: {e}")
+        return False
+    finally:
+        try:
+            await r.delete(lock)
+        except Exception:
+            pass
@@ -0,0 +1,77 @@
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from .config import SPECULATION_TTL
+from .redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Bookkeeping for speculative jobs (see workers/client.py:speculate).
+#
+# A client registers likely-next jobs per slot, e.g. the upscale below a
+# generation node. Each slot holds at most one speculative task, recorded in
+# a per-user hash as {task_id, cache_key, model}. Registering different inputs
+# for the slot cancels the previous task. Every speculative task also has a
+# marker key while nobody has asked for its result. A real request that joins
+# the task through the single-flight claim removes the marker ("adopts" it),
+# so a later change to the slot no longer cancels work someone is waiting for.
+# The speculating user's credits are held for the job like for any other, so
+# a result taken from the cache or joined later was paid for.
+
+SLOTS_PREFIX = "karate:speculation:slots:"
+MARKER_PREFIX = "karate:speculation:task:"
+
+
+def get_slot(user_id: str, slot: str) -> Optional[Dict[str, Any]]:
+    r = get_redis_client()
+    if r is None:
+        return None
+    raw = r.hget(SLOTS_PREFIX + user_id, slot)
+    return json.loads(raw) if raw else None
+
+
+def slot_count(user_id: str) -> int:
+    r = get_redis_client()
+    return int(r.hlen(SLOTS_PREFIX + user_id)) if r is not None else 0
+
+
+def set_slot(user_id: str, slot: str, task_id: str, cache_key: str, model: str) -> None:
+    r = get_redis_client()
+    if r is None:
+        return
+    pipe = r.pipeline()
+    pipe.hset(SLOTS_PREFIX + user_id, slot, json.dumps({"task_id": task_id, "cache_key": cache_key, "model": model}))
+    pipe.expire(SLOTS_PREFIX + user_id, SPECULATION_TTL)
+    pipe.set(MARKER_PREFIX + task_id, user_id, ex=SPECULATION_TTL)
+    pipe.execute()
+
+
+def clear_slot(user_id: str, slot: str) -> None:
+    r = get_redis_client()
+    if r is not None:
+        r.hdel(SLOTS_PREFIX + user_id, slot)
+
+
+def is_speculative(task_id: str) -> bool:
+    """True while the task runs only on speculation (nobody has asked for its result yet)."""
+    r = get_redis_client()
+    if r is None:
+        return False
+    try:
+        return bool(r.exists(MARKER_PREFIX + task_id))
+    except Exception as e:
+        logger.warning(f"Speculation marker read failed for {task_id}: {e}")
+        return False
+
+
+def adopt(task_id: str) -> bool:
+    """Claim a speculative task for a real request; True if it was speculative until now."""
+    r = get_redis_client()
+    if r is None:
+        return False
+    try:
+        return bool(r.delete(MARKER_PREFIX + task_id))
+    except Exception as e:
+        logger.warning(f"Speculation marker delete failed for {task_id}: {e}")
+        return False
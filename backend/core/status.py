@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import STATUS_CACHE_SIZE, STATUS_CACHE_TTL, STATUS_TTLS
+from .redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Compact per-task status records.
+#
+# Polling only needs status, output URL and error, so every task transition also
+# writes a small hash next to the Celery result (which keeps the full payload:
+# prompt, user_id, per-item results). Enqueueing files a "processing" record
+# too, which tells a queued task apart from an id that was never enqueued.
+# Each state gets its own TTL: a finished failure is worth far less Redis
+# memory than a completed output users revisit.
+#
+# Finished statuses no longer change (apart from materialization swapping in a
+# stable URL), so each API process also keeps them in a small LRU for
+# STATUS_CACHE_TTL seconds; canvases polling many finished nodes stop hitting
+# Redis for them.
+
+STATUS_PREFIX = "karate:status:"
+TASK_STATUSES = ("processing", "completed", "failed", "cancelled")
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+ERROR_MAX_CHARS = 500
+
+# Short field names: this hash exists once per task
+_FIELDS = {"status": "s", "model": "m", "output_url": "u", "error": "e", "outputs": "n"}
+
+
+def status_ttl(status: str) -> int:
+    return STATUS_TTLS.get(status, STATUS_TTLS["processing"])
+
+
+def write_status(pipe: Any, task_id: str, status: str, fields: Dict[str, Any]) -> None:
+    """Queue the status hash update on ``pipe`` (the caller executes it)."""
+    record = {"s": status}
+    for name, short in _FIELDS.items():
+        value = fields.get(name)
+        if value is not None and name != "status":
+            record[short] = str(value)[:ERROR_MAX_CHARS] if name == "error" else value
+    pipe.hset(STATUS_PREFIX + task_id, mapping=record)
+    pipe.expire(STATUS_PREFIX + task_id, status_ttl(status))
+
+
+def record_queued(jobs: Iterable[Tuple[str, str]]) -> None:
+    """File "processing" records for (task_id, model) jobs about to be enqueued."""
+    r = get_redis_client()
+    if r is None:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for task_id, model in jobs:
+            write_status(pipe, task_id, "processing", {"model": model})
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not file status records for queued tasks: {e}")
+
+
+def read_status(task_id: str, r: Any = None) -> Optional[Dict[str, Any]]:
+    """Compact record as a RunResult-shaped dict, or None if this task has none.
+
+    Multi-output tasks return None: their per-item results only live in the full payload.
+    """
+    r = r or get_redis_client()
+    if r is None:
+        return None
+    try:
+        raw = r.hgetall(STATUS_PREFIX + task_id)
+    except Exception as e:
+        logger.warning(f"Status read failed for {task_id}: {e}")
+        return None
+    return decode_status(raw)
+
+
+def decode_status(raw: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    if not raw or "n" in raw:
+        return None
+    return {
+        "model": raw.get("m", "unknown"),
+        "prompt": "",
+        "user_id": "",
+        "output_url": raw.get("u"),
+        "status": raw["s"],
+        "error": raw.get("e"),
+    }
+
+
+_finished: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_finished_lock = threading.Lock()
+
+
+def cached_status(task_id: str) -> Optional[Dict[str, Any]]:
+    with _finished_lock:
+        entry = _finished.get(task_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _finished[task_id]
+            return None
+        _finished.move_to_end(task_id)
+        return entry[1]
+
+
+def remember_status(task_id: str, result: Optional[Dict[str, Any]]) -> None:
+    """Keep a finished status in the process-local cache; anything else is ignored."""
+    if not result or result.get("status") not in TERMINAL_STATUSES or STATUS_CACHE_SIZE <= 0:
+        return
+    with _finished_lock:
+        _finished[task_id] = (time.monotonic() + STATUS_CACHE_TTL, result)
+        _finished.move_to_end(task_id)
+        while len(_finished) > STATUS_CACHE_SIZE:
+            _finished.popitem(last=False)
+
+
+# Key families reported by storage_report, matched by prefix
+KEY_FAMILIES = (
+    ("celery_results", "celery-task-meta-"),
+    ("status", STATUS_PREFIX),
+    ("last_events", "karate:task-last:"),
+    ("result_cache", "karate:cache:"),
+    ("batches", "karate:batch:"),
+    ("workflows", "karate:workflow:"),
+    ("latency_samples", "karate:latency:"),
+    ("limits", "karate:limits:"),
+)
+
+
+def storage_report(max_keys: int = 100000, samples_per_family: int = 50) -> Dict[str, Any]:
+    """Estimate Redis memory per key family from a bounded SCAN plus sampled MEMORY USAGE.
+
+    ``complete`` is False when the keyspace has more than ``max_keys`` keys; counts
+    then cover the scanned part only.
+    """
+    r = get_redis_client()
+    if r is None:
+        return {}
+    counts: Dict[str, int] = {name: 0 for name, _ in KEY_FAMILIES}
+    counts["other"] = 0
+    sampled: Dict[str, List[str]] = {name: [] for name in counts}
+    scanned = 0
+    try:
+        for key in r.scan_iter(count=1000):
+            family = next((name for name, prefix in KEY_FAMILIES if key.startswith(prefix)), "other")
+            counts[family] += 1
+            if len(sampled[family]) < samples_per_family:
+                sampled[family].append(key)
+            scanned += 1
+            if scanned >= max_keys:
+                break
+        pipe = r.pipeline(transaction=False)
+        order = [(family, key) for family, keys in sampled.items() for key in keys]
+        for _, key in order:
+            pipe.memory_usage(key)
+        # Some managed Redis offerings disable MEMORY; report counts anyway
+        sizes = pipe.execute(raise_on_error=False)
+        info = r.info("memory")
+        total_keys = r.dbsize()
+    except Exception as e:
+        logger.warning(f"Storage report failed: {e}")
+        return {}
+
+    per_family: Dict[str, Dict[str, Any]] = {}
+    for family, count in counts.items():
+        family_sizes = [s if isinstance(s, int) else 0 for (f, _), s in zip(order, sizes) if f == family]
+        avg = sum(family_sizes) / len(family_sizes) if family_sizes else 0
+        per_family[family] = {"keys": count, "avg_bytes": int(avg), "est_bytes": int(avg * count)}
+    return {
+        "used_memory": info.get("used_memory"),
+        "maxmemory": info.get("maxmemory"),
+        "keys": total_keys,
+        "scanned": scanned,
+        "complete": scanned >= total_keys,
+        "families": per_family,
+    }
@@ -1,9 +1,14 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 import logging
-from .api.v1 import ai, agents
+from .api.v1 import ai, agents, workflows
+from .core.clients import aclose_all, close_all
+from .core.fairshare import queue_depths
+from .core.metrics import QUEUE_DEPTH, metrics_payload
+from .core.redis import close_async_redis_client
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,7 +30,15 @@ if missing_vars:
 else:
     logger.info("✅ All critical environment variables found.")
 
-app = FastAPI(title="Karate Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release pooled provider connections held by this process
+    close_all()
+    await aclose_all()
+    await close_async_redis_client()
+
+app = FastAPI(title="Karate Backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,11 +50,22 @@ app.add_middleware(
 
 app.include_router(ai.router, prefix="/api/v1/ai", tags=["ai"]) 
 app.include_router(agents.router, prefix="/api/v1/agents", tags=["agents"]) 
+app.include_router(workflows.router, prefix="/api/v1/workflows", tags=["workflows"])
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    for (queue, priority), depth in queue_depths().items():
+        QUEUE_DEPTH.labels(queue, str(priority)).set(depth)
+    payload = metrics_payload()
+    if payload is None:
+        raise HTTPException(status_code=503, detail="prometheus-client not installed")
+    body, content_type = payload
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, reload=True)
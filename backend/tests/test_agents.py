@@ -0,0 +1,82 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from backend.api.v1 import agents
+from backend.core.jsonstream import ObjectStream
+from backend.main import app
+
+REPLY = json.dumps({
+    "message": "Here is a \"Cyberpunk City\" workflow:\nenjoy ✓",
+    "workflow": {"type": "create_workflow", "nodes": [{"id": "1", "data": {"label": "a}b"}}], "edges": []},
+})
+
+
+class FakeStream:
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed = True
+
+    async def __aiter__(self):
+        for piece in self.pieces:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=1200, prompt_tokens_details=SimpleNamespace(cached_tokens=1024)))
+
+
+def _fake_client(stream):
+    async def create(**params):
+        assert params["stream"] and params["response_format"] == {"type": "json_object"}
+        return stream
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+@pytest.fixture(autouse=True)
+def no_sessions(monkeypatch):
+    async def open_session(user_id, session_id, seed=None):
+        return None
+    monkeypatch.setattr(agents.sessions, "open_session", open_session)
+
+
+def _events(body):
+    for block in body.strip().split("\n\n"):
+        name, data = block.split("\n")
+        yield name[len("event: "):], json.loads(data[len("data: "):])
+
+
+def test_object_stream_decodes_split_escapes():
+    parser, text = ObjectStream(), ""
+    for i in range(0, len(REPLY), 3):
+        for kind, key, value in parser.feed(REPLY[i:i + 3]):
+            if kind == "text":
+                text += value
+    assert text == json.loads(REPLY)["message"]
+    assert parser.done and parser.fields == json.loads(REPLY)
+
+
+def test_chat_stream_yields_tokens_then_action(monkeypatch):
+    stream = FakeStream([REPLY[i:i + 7] for i in range(0, len(REPLY), 7)])
+    monkeypatch.setattr(agents, "get_async_openai_client", lambda api_key: _fake_client(stream))
+    with TestClient(app) as c:
+        r = c.post("/api/v1/agents/chat/stream", json={"prompt": "build a cyberpunk workflow"})
+        assert r.headers["content-type"].startswith("text/event-stream")
+        events = list(_events(r.text))
+    names = [name for name, _ in events]
+    assert names.count("token") > 3 and names[-2:] == ["action", "done"]
+    assert "".join(data["text"] for name, data in events if name == "token") == json.loads(REPLY)["message"]
+    assert events[-1][1]["action"]["type"] == "create_workflow"
+    assert stream.closed
+
+
+def test_chat_stream_falls_back_to_plain_text(monkeypatch):
+    stream = FakeStream(["Sure, ", "no JSON today."])
+    monkeypatch.setattr(agents, "get_async_openai_client", lambda api_key: _fake_client(stream))
+    with TestClient(app) as c:
+        events = list(_events(c.post("/api/v1/agents/chat/stream", json={"prompt": "hi"}).text))
+    assert events == [("done", {"message": "Sure, no JSON today.", "action": None, "session_id": None})]
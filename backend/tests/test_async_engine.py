@@ -0,0 +1,29 @@
+import httpx
+from backend.workers import async_engine
+from backend.core import models
+from backend.workers import tasks
+
+
+def test_run_coroutine_uses_shared_loop():
+    async def which_loop():
+        import asyncio
+        return asyncio.get_running_loop()
+
+    assert async_engine.run_coroutine(which_loop()) is async_engine.get_loop()
+    assert async_engine.run_coroutine(which_loop()) is async_engine.get_loop()
+
+
+def test_async_http_runner_matches_sync_contract(monkeypatch):
+    monkeypatch.setenv("HTTP_MODEL_ESRGAN_URL", "http://provider.local/run")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"output": ["https://cdn.local/out.png"]})
+
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(async_engine.clients, "get_async_http_client", lambda url: mock_client)
+    models.reload()
+    spec = models.resolve("esrgan")
+    assert spec.kind == "http" and spec.target == "http://provider.local/run"
+    url = async_engine.run_coroutine(tasks._run_model_async(spec, "x", {}))
+    assert url == "https://cdn.local/out.png"
+    async_engine.shutdown()
@@ -0,0 +1,54 @@
+import json
+from fastapi.testclient import TestClient
+from backend.main import app
+from backend.api.v1 import ai
+from backend.workers import client
+
+HEADERS = {"x-api-key": "dev-secret", "x-user-id": "user_123"}
+
+
+def test_batch_coalesces_multi_output_items(monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    enqueued, saved = [], {}
+    monkeypatch.setattr(ai, "enqueue_batch", lambda jobs: enqueued.extend(jobs) or [f"task-{i}" for i in range(len(jobs))])
+    monkeypatch.setattr(ai, "save_batch", lambda batch_id, entries: saved.update(entries=entries))
+
+    items = [{"model": "gpt-image-1", "prompt": "fox"}] * 3 + [{"model": "flux-pro-1.1", "prompt": "fox", "aspect_ratio": "16:9"}]
+    with TestClient(app) as c:
+        r = c.post("/api/v1/ai/infer/batch", headers=HEADERS, json={"items": items})
+        assert r.status_code == 200
+        data = r.json()
+
+    assert data["upstream_calls"] == 2
+    assert [j["n"] for j in enqueued] == [3, 1]
+    assert data["task_ids"] == ["task-0", "task-0", "task-0", "task-1"]
+    assert [e["slot"] for e in saved["entries"]] == [0, 1, 2, None]
+
+
+def test_batch_rejects_unknown_models_before_enqueue(monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    monkeypatch.setattr(ai, "enqueue_batch", lambda jobs: (_ for _ in ()).throw(AssertionError("enqueued")))
+    with TestClient(app) as c:
+        r = c.post("/api/v1/ai/infer/batch", headers=HEADERS, json={"items": [{"model": "esrgan"}, {"model": "nope"}]})
+        assert r.status_code == 400
+
+
+def test_batch_status_aggregates_items(monkeypatch):
+    class FakeRedis:
+        def get(self, key):
+            return json.dumps([{"task_id": "m", "slot": 0}, {"task_id": "m", "slot": 1}, {"task_id": "s", "slot": None}])
+
+    statuses = {
+        "m": {"status": "completed", "results": [
+            {"status": "completed", "output_url": "https://cdn.local/0.png"},
+            {"status": "failed", "output_url": None, "error": "nsfw"},
+        ]},
+        "s": {"status": "completed", "output_url": "https://cdn.local/s.png"},
+    }
+    monkeypatch.setattr(client, "get_redis_client", lambda: FakeRedis())
+    monkeypatch.setattr(client, "get_task_status", lambda tid: statuses[tid])
+
+    result = client.get_batch_status("b1")
+    assert result["status"] == "partial"
+    assert (result["completed"], result["failed"], result["total"]) == (2, 1, 3)
+    assert result["items"][1]["error"] == "nsfw"
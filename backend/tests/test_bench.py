@@ -0,0 +1,37 @@
+from fastapi.testclient import TestClient
+from backend.bench.fake_providers import ProviderProfile, create_app, parse_profile
+from backend.bench.imports import TARGETS, package_costs, parse_importtime, sample
+from backend.bench.run import percentiles
+
+
+def test_fake_providers_answer_in_sdk_shapes():
+    app = create_app({"openai": ProviderProfile(median=0), "http": ProviderProfile(median=0, error_rate=1.0)})
+    with TestClient(app) as c:
+        images = c.post("/openai/v1/images/generations", json={"prompt": "x", "n": 2}).json()
+        assert len(images["data"]) == 2 and images["data"][0]["url"].startswith("https://")
+        assert c.post("/http/run").status_code == 503
+        prediction = c.post("/replicate/v1/predictions", json={"version": "v1", "input": {"prompt": "x"}}).json()
+        assert prediction["status"] == "succeeded" and prediction["output"]
+
+
+def test_profile_parsing_and_percentiles():
+    assert parse_profile("0.8:0.6:0.02") == ProviderProfile(0.8, 0.6, 0.02, 0.0)
+    stats = percentiles([i / 1000 for i in range(1, 101)])
+    assert stats["p50"] == 51.0 and stats["p99"] == 100.0
+    assert percentiles([])["p95"] is None
+
+
+def test_importtime_parsing_attributes_time_to_packages():
+    stderr = """import time: self [us] | cumulative | imported package
+import time:       900 |        900 |   pydantic.main
+import time:       100 |       1000 | pydantic
+import time:       500 |       1500 |   fastapi
+import time:       200 |       2000 |     backend.core
+import time:       300 |       3500 | backend.main"""
+    rows = parse_importtime(stderr)
+    assert rows[0] == ("  pydantic.main", 0.9, 0.9) and len(rows) == 5
+    assert package_costs(rows) == [("fastapi", 1.5), ("pydantic", 0.9)]
+
+
+def test_api_starts_without_provider_sdks():
+    assert sample(TARGETS["api"])["loaded"] == []
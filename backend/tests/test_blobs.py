@@ -0,0 +1,44 @@
+import base64
+import os
+from fastapi.testclient import TestClient
+from backend.main import app
+from backend.api.v1 import ai
+from backend.core import blobs
+
+HEADERS = {"x-api-key": "dev-secret", "x-user-id": "user_123"}
+PNG = b"\x89PNG\r\n\x1a\n" + os.urandom(200 * 1024)
+
+
+def test_upload_dedupes_and_serves_content(monkeypatch, tmp_path):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    monkeypatch.setattr(blobs, "BLOB_DIR", str(tmp_path))
+    with TestClient(app) as c:
+        first = c.post("/api/v1/ai/blobs", headers=HEADERS, content=PNG).json()
+        second = c.post("/api/v1/ai/blobs", headers=HEADERS, content=PNG).json()
+        assert first["handle"] == second["handle"] and first["size"] == len(PNG)
+        r = c.get(f"/api/v1/ai/blobs/{first['sha256']}")
+        assert r.content == PNG and r.headers["content-type"] == "image/png"
+        assert c.get("/api/v1/ai/blobs/" + "0" * 64).status_code == 404
+    stored = [f for _, _, files in os.walk(tmp_path) for f in files]
+    assert stored == [first["sha256"]]
+
+    uri = blobs.resolve_blob_inputs({"image": first["handle"], "seed": 1})["image"]
+    assert uri.startswith("data:image/png;base64,") and base64.b64decode(uri.split(",", 1)[1]) == PNG
+
+
+def test_infer_moves_inline_data_uris_out_of_the_message(monkeypatch, tmp_path):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    monkeypatch.setattr(blobs, "BLOB_DIR", str(tmp_path))
+    sent = {}
+
+    async def fake_enqueue(**kwargs):
+        sent.update(kwargs)
+        return "task-1"
+
+    monkeypatch.setattr(ai, "run_ai_model_background", fake_enqueue)
+    data_uri = "data:image/png;base64," + base64.b64encode(PNG).decode()
+    with TestClient(app) as c:
+        r = c.post("/api/v1/ai/infer", headers=HEADERS, json={"model": "esrgan", "image": data_uri, "cache": False})
+        assert r.status_code == 200
+        assert c.post("/api/v1/ai/infer", headers=HEADERS, json={"model": "esrgan", "image": "blob://" + "f" * 64}).status_code == 400
+    assert sent["image"].startswith("blob://") and len(sent["image"]) == 71
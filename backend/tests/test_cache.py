@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from backend.main import app
+from backend.api.v1 import ai
+from backend.core.cache import cache_ttl, make_cache_key, is_cacheable
+from backend.core.config import RESULT_CACHE_PROVIDER_URL_TTL, RESULT_CACHE_TTL
+
+
+def test_cache_key_is_canonical():
+    a = make_cache_key("flux-pro-1.1", "cat", {"seed": 1, "aspect_ratio": "1:1"})
+    b = make_cache_key("flux-pro-1.1", "cat", {"aspect_ratio": "1:1", "seed": 1, "image": None})
+    assert a == b
+    assert a != make_cache_key("flux-pro-1.1", "cat", {"seed": 2, "aspect_ratio": "1:1"})
+    assert make_cache_key("esrgan", None, {}) == make_cache_key("esrgan", "", {})
+
+
+def test_only_seeded_jobs_are_cacheable():
+    assert is_cacheable({"seed": 0})
+    assert not is_cacheable({})
+    assert not is_cacheable({"seed": 7}, opt_in=False)
+
+
+def test_provider_urls_are_not_cached_past_their_expiry():
+    provider = {"output_url": "https://replicate.delivery/x.png"}
+    materialized = {"output_url": "https://cdn.example.com/abc", "provider_url": provider["output_url"]}
+    assert cache_ttl(provider) == min(RESULT_CACHE_TTL, RESULT_CACHE_PROVIDER_URL_TTL)
+    assert cache_ttl(materialized) == RESULT_CACHE_TTL
+    assert cache_ttl({"results": [materialized, provider]}) < RESULT_CACHE_TTL
+
+
+def test_infer_returns_completed_task_on_cache_hit(monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    cached = {
+        "model": "flux-pro-1.1", "prompt": "cat", "user_id": "someone_else",
+        "output_url": "https://example.com/cat.png", "status": "completed", "error": None,
+    }
+    monkeypatch.setattr(ai, "get_cached_result", lambda key: cached)
+    monkeypatch.setattr(ai, "complete_from_cache", lambda result, uid: "cached-task")
+
+    with TestClient(app) as c:
+        r = c.post(
+            "/api/v1/ai/infer",
+            headers={"x-api-key": "dev-secret", "x-user-id": "user_123"},
+            json={"model": "flux-pro-1.1", "prompt": "cat", "seed": 42},
+        )
+        assert r.status_code == 200
+        data = r.json()
+        assert data["task_id"] == "cached-task"
+        assert data["status"] == "completed"
+        assert data["output_url"] == "https://example.com/cat.png"
+
+
+def test_identical_inflight_jobs_share_one_task(monkeypatch):
+    from backend.workers import client
+
+    inflight = {}
+    enqueued = []
+
+    def claim(key, task_id):
+        owner = inflight.setdefault(key, task_id)
+        return owner if owner != task_id else None
+
+    monkeypatch.setattr(client, "claim_inflight", claim)
+    monkeypatch.setattr(client, "read_status", lambda task_id: {"status": "processing"})
+    monkeypatch.setattr(client, "send_model_task", lambda name, args, kwargs, task_id, **options: enqueued.append(task_id) or type("R", (), {"id": task_id})())
+
+    first = asyncio.run(client.run_ai_model_background("flux-pro-1.1", "cat", "u1", cache_key="k", seed=1))
+    second = asyncio.run(client.run_ai_model_background("flux-pro-1.1", "cat", "u2", cache_key="k", seed=1))
+    assert first == second and enqueued == [first]
+    # Unseeded jobs are never coalesced
+    asyncio.run(client.run_ai_model_background("flux-pro-1.1", "cat", "u3"))
+    assert len(enqueued) == 2
+
+
+def test_dead_or_unsent_owner_is_not_joined(monkeypatch):
+    from backend.workers import client
+
+    inflight, enqueued = {}, []
+
+    def claim(key, task_id):
+        owner = inflight.setdefault(key, task_id)
+        return owner if owner != task_id else None
+
+    def release(key, task_id):
+        if inflight.get(key) == task_id:
+            del inflight[key]
+
+    def send(name, args, kwargs, task_id, **options):
+        if not enqueued:
+            enqueued.append(None)
+            raise ConnectionError("broker down")
+        enqueued.append(task_id)
+        return type("R", (), {"id": task_id})()
+
+    monkeypatch.setattr(client, "claim_inflight", claim)
+    monkeypatch.setattr(client, "release_inflight", release)
+    monkeypatch.setattr(client, "send_model_task", send)
+    # The owner's record still says processing, but its worker hit the hard time limit
+    monkeypatch.setattr(client, "read_status", lambda task_id: {"status": "processing"})
+    monkeypatch.setattr(client, "AsyncResult", lambda *a, **k: type("A", (), {"state": "FAILURE", "result": RuntimeError("killed")})())
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(client.run_ai_model_background("flux-pro-1.1", "cat", "u1", cache_key="k", seed=1))
+    assert inflight == {}
+    inflight["k"] = "dead-task"
+    task_id = asyncio.run(client.run_ai_model_background("flux-pro-1.1", "cat", "u2", cache_key="k", seed=1))
+    assert task_id != "dead-task" and enqueued[-1] == task_id and inflight == {"k": task_id}
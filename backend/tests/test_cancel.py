@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+from celery.exceptions import SoftTimeLimitExceeded
+from fastapi.testclient import TestClient
+from backend.api.v1 import ai
+from backend.core.cancel import TaskCancelled
+from backend.main import app
+from backend.workers import async_engine, tasks
+
+
+def test_cancel_flag_stops_event_loop_calls():
+    cleaned_up = []
+
+    async def slow_call():
+        try:
+            await asyncio.sleep(30)
+        finally:
+            cleaned_up.append(True)
+
+    flags = iter([False, True])
+    with pytest.raises(TaskCancelled):
+        asyncio.run(async_engine.cancellable(slow_call(), lambda: next(flags), 0.01))
+    assert cleaned_up == [True]
+
+
+def test_interrupted_replicate_prediction_is_cancelled_upstream():
+    class Prediction:
+        id, status, cancelled = "p1", "processing", False
+
+        def reload(self):
+            raise SoftTimeLimitExceeded()
+
+        def cancel(self):
+            self.cancelled = True
+
+    prediction = Prediction()
+    client = type("Client", (), {"poll_interval": 0})()
+    client.models = type("Models", (), {})()
+    client.models.predictions = type("Predictions", (), {"create": lambda self, model, input: prediction})()
+    with pytest.raises(SoftTimeLimitExceeded):
+        tasks._replicate_predict(client, "owner/model", {"prompt": "x"})
+    assert prediction.cancelled
+
+
+def test_task_cancelled_while_queued_does_not_run(monkeypatch):
+    monkeypatch.setattr(tasks, "is_cancelled", lambda task_id: True)
+    monkeypatch.setattr(tasks, "acquire_slot", lambda *a: pytest.fail("cancelled task took a provider slot"))
+    monkeypatch.setattr(tasks, "publish_task_event", lambda *a, **k: None)
+    result = tasks.process_ai_task.apply(args=("esrgan", "x", "u1")).get()
+    assert result["status"] == "cancelled"
+
+
+def test_delete_task_endpoint(monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    monkeypatch.setattr(ai, "cancel_task", lambda task_id: "completed" if task_id == "done" else "cancelled")
+    with TestClient(app) as c:
+        r = c.delete("/api/v1/ai/tasks/t1", headers={"x-api-key": "dev-secret"})
+        assert r.status_code == 200 and r.json()["status"] == "cancelled"
+        assert c.delete("/api/v1/ai/tasks/done", headers={"x-api-key": "dev-secret"}).status_code == 409
+
+
+class FakeSharedRedis:
+    def __init__(self):
+        self.values = {}
+
+    def pipeline(self):
+        r, ops = self, []
+
+        class Pipe:
+            def incr(self, key):
+                ops.append(key)
+
+            def expire(self, key, ttl):
+                pass
+
+            def execute(self):
+                for key in ops:
+                    r.values[key] = r.values.get(key, 0) + 1
+        return Pipe()
+
+    def eval(self, script, numkeys, key):
+        n = self.values.get(key, 0)
+        if n <= 0:
+            return 0
+        self.values[key] = n - 1
+        return 1
+
+
+def test_shared_task_keeps_running_until_its_last_requester_cancels(monkeypatch):
+    from backend.core import cancel
+    from backend.workers import client
+
+    r = FakeSharedRedis()
+    revoked = []
+    monkeypatch.setattr(cancel, "get_redis_client", lambda: r)
+    monkeypatch.setattr(client, "get_task_status", lambda task_id: {"status": "processing"})
+    monkeypatch.setattr(client, "request_cancel", lambda task_id: True)
+    monkeypatch.setattr(client, "publish_task_event", lambda *a, **k: None)
+    monkeypatch.setattr(client.celery_app.control, "revoke", lambda task_id, **k: revoked.append(task_id))
+    cancel.add_holder("t1")
+    cancel.add_holder("t1")
+    assert client.cancel_task("t1", handed_off=False) == "detached"
+    assert client.cancel_task("t1", handed_off=False) == "detached"
+    assert revoked == []
+    assert client.cancel_task("t1", handed_off=False) == "cancelled" and revoked == ["t1"]
@@ -0,0 +1,26 @@
+from backend.core import clients
+
+
+def test_http_clients_are_pooled_per_origin():
+    a = clients.get_http_client("https://api.example.com/v1/run")
+    b = clients.get_http_client("https://api.example.com/other")
+    c = clients.get_http_client("https://other.example.com/run")
+    assert a is b
+    assert a is not c
+
+    stats = clients.pool_stats()
+    assert "http:https://api.example.com" in stats
+    assert stats["_limits"]["max_connections"] == clients.HTTP_POOL_MAX_CONNECTIONS
+
+    clients.close_all()
+    assert a.is_closed
+    assert clients.get_http_client("https://api.example.com/v1/run") is not a
+    clients.close_all()
+
+
+def test_openai_clients_keyed_by_credential():
+    a = clients.get_openai_client("sk-one")
+    assert clients.get_openai_client("sk-one") is a
+    assert clients.get_openai_client("sk-two") is not a
+    assert not any("sk-one" in label for label in clients.pool_stats())
+    clients.close_all()
@@ -0,0 +1,164 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from backend.core import credits
+from backend.main import app
+from backend.workers import client, ledger, tasks
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes, self.strings, self.outbox = {}, {}, []
+        self.holds, self.expiries = {}, {}
+
+    def hgetall(self, key):
+        return {k: str(v) for k, v in self.hashes.get(key, {}).items()}
+
+    def lrange(self, key, start, end):
+        return self.outbox[start:end + 1]
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = value
+        return True
+
+    def _live_held(self, holds, expiries, now):
+        for task_id, expiry in list(self.expiries.get(expiries, {}).items()):
+            if expiry <= now:
+                self.expiries[expiries].pop(task_id)
+                self.holds.get(holds, {}).pop(task_id, None)
+        return sum(self.holds.get(holds, {}).values())
+
+    def eval(self, script, numkeys, *args):
+        keys, argv = args[:numkeys], args[numkeys:]
+        if script == credits._RESERVE_SCRIPT:
+            acct = self.hashes.get(keys[0])
+            if acct is None:
+                return [-1, 0]
+            acct["held"] = self._live_held(keys[1], keys[2], argv[2])
+            available = acct["balance"] - acct["held"]
+            if available < argv[0]:
+                return [0, available]
+            acct["held"] += argv[0]
+            self.holds.setdefault(keys[1], {})[argv[1]] = argv[0]
+            self.expiries.setdefault(keys[2], {})[argv[1]] = argv[2] + argv[3]
+            return [1, available - argv[0]]
+        if script == credits._SETTLE_SCRIPT:
+            amount = self.holds.get(keys[1], {}).pop(argv[2], None)
+            acct = self.hashes.get(keys[0])
+            if amount is None or acct is None:
+                return -1
+            self.expiries[keys[2]].pop(argv[2], None)
+            charge = amount if argv[0] == "all" else min(amount, argv[0])
+            acct["held"] = self._live_held(keys[1], keys[2], argv[3])
+            if charge > 0:
+                acct["balance"] -= charge
+                acct["unsynced"] = acct.get("unsynced", 0) + charge
+                self.outbox.append(json.dumps({"user_id": argv[1], "task_id": argv[2], "amount": charge, "at": argv[3]}))
+            return charge
+        if script == credits._ACK_SCRIPT:
+            acked, self.outbox = self.outbox[:argv[0]], self.outbox[argv[0]:]
+            for raw in acked:
+                entry = json.loads(raw)
+                self.hashes[argv[1] + entry["user_id"]]["unsynced"] -= entry["amount"]
+            return len(acked)
+        if script == credits._SET_BALANCE_SCRIPT:
+            acct = self.hashes.setdefault(keys[0], {})
+            acct["balance"] = argv[0] - acct.get("unsynced", 0)
+            acct["held"] = self._live_held(keys[1], keys[2], argv[1])
+            return acct["balance"]
+        raise AssertionError("unexpected script")
+
+
+@pytest.fixture
+def ledger_redis(monkeypatch):
+    r = FakeRedis()
+    monkeypatch.setattr(credits, "CREDITS_ENABLED", True)
+    monkeypatch.setattr(credits, "get_redis_client", lambda: r)
+    monkeypatch.setattr(ledger, "CREDIT_SYNC_URL", "")
+    return r
+
+
+def test_holds_are_charged_or_released_once(ledger_redis):
+    credits.set_balance("u1", 10)
+    assert credits.reserve("u1", "t1", 4) == 6
+    assert credits.reserve("u1", "t2", 4) == 2
+    with pytest.raises(credits.InsufficientCredits):
+        credits.reserve("u1", "t3", 4)
+    with pytest.raises(credits.InsufficientCredits):
+        credits.reserve("nobody", "t4", 1)
+
+    assert credits.settle("u1", "t1") == 4
+    assert credits.settle("u1", "t1") == 0  # already settled
+    credits.refund("u1", "t2")
+    assert credits.get_account("u1") == {"balance": 6, "held": 0, "unsynced": 4, "available": 6}
+
+    # The system of record has not seen the charge yet, so its balance still includes it
+    credits.set_balance("u1", 10)
+    assert credits.get_account("u1")["balance"] == 6
+    assert [e["task_id"] for e in credits.outbox_batch(ledger_redis, 10)] == ["t1"]
+    assert credits.ack_outbox(ledger_redis, 10) == 1
+    credits.set_balance("u1", 6)
+    assert credits.get_account("u1") == {"balance": 6, "held": 0, "unsynced": 0, "available": 6}
+
+
+def test_holds_of_jobs_that_never_settle_expire(ledger_redis, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(credits.time, "time", lambda: clock[0])
+    credits.set_balance("u1", 10)
+    credits.reserve("u1", "lost", 8)
+    with pytest.raises(credits.InsufficientCredits):
+        credits.reserve("u1", "t1", 4)
+    clock[0] += credits.CREDIT_HOLD_TTL + 1
+    credits.set_balance("u1", 10)
+    assert credits.get_account("u1")["held"] == 0
+    assert credits.reserve("u1", "t1", 4) == 6
+    assert credits.settle("u1", "lost") == 0
+
+
+def test_multi_output_task_is_charged_per_completed_output(ledger_redis):
+    cost = tasks._spec_for("dalle-3").cost
+    credits.set_balance("u1", 10 * cost)
+    credits.reserve("u1", "multi", 3 * cost)
+    retval = {"status": "failed", "results": [{"status": "completed"}, {"status": "failed"}, {"status": "completed"}]}
+    tasks._settle_credits(sender=tasks.process_ai_multi_task, task_id="multi", args=["dalle-3", "cat", "u1", 3],
+                          kwargs={}, retval=retval, state="SUCCESS")
+    assert credits.get_account("u1") == {"balance": 8 * cost, "held": 0, "unsynced": 2 * cost, "available": 8 * cost}
+
+
+def test_infer_is_refused_without_credits(ledger_redis, monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    monkeypatch.setattr(client, "send_model_task", lambda *a, **k: pytest.fail("enqueued"))
+    credits.set_balance("user_123", 0)
+    with TestClient(app) as c:
+        r = c.post("/api/v1/ai/infer", headers={"x-api-key": "dev-secret", "x-user-id": "user_123"},
+                   json={"model": "flux-pro-1.1", "prompt": "cat"})
+        assert r.status_code == 402
+        assert c.get("/api/v1/ai/credits/user_123", headers={"x-api-key": "dev-secret"}).json()["held"] == 0
+
+
+def test_jobs_that_die_without_postrun_release_their_hold(ledger_redis, monkeypatch):
+    from billiard.exceptions import WorkerLostError
+    from celery.worker import request as worker_request
+
+    monkeypatch.setattr(tasks, "publish_task_event", lambda *a, **k: None)
+    monkeypatch.setattr(tasks.fairshare, "release", lambda user_id, task_id: None)
+    credits.set_balance("u1", 10)
+    credits.reserve("u1", "lost", 4)
+    credits.reserve("u1", "killed", 4)
+
+    # Worker process died: task_failure is sent from the parent, task_postrun never runs
+    tasks._record_failure(sender=tasks.process_ai_task, task_id="lost", exception=WorkerLostError("SIGKILL"),
+                          args=["flux-pro-1.1", "cat", "u1"], kwargs={})
+    assert credits.get_account("u1")["held"] == 4
+
+    # Hard time limit: no task signal at all, only the request's timeout handler
+    monkeypatch.setattr(worker_request.Request, "on_timeout", lambda self, soft, timeout: None)
+    request = object.__new__(tasks.ModelRequest)
+    request.id, request._args, request._kwargs = "killed", ["flux-pro-1.1", "cat", "u1"], {}
+    request.on_timeout(True, 300)
+    assert credits.get_account("u1")["held"] == 4
+    request.on_timeout(False, 360)
+    assert credits.get_account("u1") == {"balance": 10, "held": 0, "unsynced": 0, "available": 10}
@@ -0,0 +1,55 @@
+from backend.core import fairshare
+
+
+class FakeRedis:
+    """Sorted sets only, enough for the reserve script and ZREM."""
+
+    def __init__(self):
+        self.zsets = {}
+
+    def eval(self, script, numkeys, key, now, deadline, ttl, *task_ids):
+        members = {m: s for m, s in self.zsets.get(key, {}).items() if s > now}
+        before = len(members)
+        members.update({task_id: deadline for task_id in task_ids})
+        self.zsets[key] = members
+        return before
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+
+def test_heavy_users_are_demoted_but_newcomers_are_not(monkeypatch):
+    r = FakeRedis()
+    monkeypatch.setattr(fairshare, "get_redis_client", lambda: r)
+    monkeypatch.setattr(fairshare, "FAIR_SHARE_QUOTA", 2)
+    flood = fairshare.reserve("heavy", "interactive", [f"h{i}" for i in range(10)])
+    assert flood[:2] == [0, 0] and flood[2:8] == [3] * 6 and flood[8:] == [6, 6]
+    assert fairshare.reserve("newcomer", "interactive", ["n1"]) == [0]
+    assert fairshare.reserve("newcomer", "batch", ["n2"]) == [3]
+    for i in range(10):
+        fairshare.release("heavy", f"h{i}")
+    fairshare.release("heavy", "h0")
+    assert fairshare.reserve("heavy", "interactive", ["h10"]) == [0]
+
+
+def test_leaked_jobs_stop_counting_at_their_deadline(monkeypatch):
+    r = FakeRedis()
+    clock = [1000.0]
+    monkeypatch.setattr(fairshare, "get_redis_client", lambda: r)
+    monkeypatch.setattr(fairshare.time, "time", lambda: clock[0])
+    monkeypatch.setattr(fairshare, "FAIR_SHARE_QUOTA", 2)
+    fairshare.reserve("heavy", "interactive", ["lost1", "lost2", "lost3"])
+    clock[0] += fairshare.FAIR_SHARE_TTL / 2
+    # Still busy: new jobs keep coming but the lost ones are not extended
+    assert fairshare.reserve("heavy", "interactive", ["a"]) == [3]
+    fairshare.release("heavy", "a")
+    clock[0] += fairshare.FAIR_SHARE_TTL / 2 + 1
+    assert fairshare.reserve("heavy", "interactive", ["b"]) == [0]
+
+
+def test_weights_scale_the_quota(monkeypatch):
+    monkeypatch.setattr(fairshare, "FAIR_SHARE_QUOTA", 2)
+    monkeypatch.setattr(fairshare, "FAIR_SHARE_WEIGHTS", {"team": 3})
+    assert fairshare.priority_for("interactive", 5, fairshare.user_weight("team")) == 0
+    assert fairshare.priority_for("interactive", 5, fairshare.user_weight("solo")) == 3
+    assert fairshare.priority_for("batch", 100) == 9
@@ -0,0 +1,24 @@
+import httpx
+from backend.celery_app import route_task
+from backend.core.limits import is_rate_limited, queue_for_model
+
+
+def test_queue_tiers_follow_model_costs():
+    assert queue_for_model("esrgan") == "fast"
+    assert queue_for_model("flux-pro-1.1") == "standard"
+    assert queue_for_model("veo-3") == "heavy"
+    assert queue_for_model("owner/unknown-slug") == "standard"
+
+
+def test_model_tasks_are_routed_by_tier():
+    assert route_task("backend.workers.tasks.process_ai_task", ["sora-2", "p", "u"], {}, {}) == {"queue": "heavy"}
+    assert route_task("backend.workers.tasks.process_ai_multi_task", ["gpt-image-1", "p", "u", 3], {}, {}) == {"queue": "standard"}
+    assert route_task("backend.workers.workflows.workflow_node_done", [], {}, {}) == {"queue": "fast"}
+
+
+def test_rate_limit_detection():
+    request = httpx.Request("POST", "http://provider.local")
+    err = httpx.HTTPStatusError("slow down", request=request, response=httpx.Response(429, request=request))
+    assert is_rate_limited(err)
+    busy = httpx.HTTPStatusError("boom", request=request, response=httpx.Response(503, request=request))
+    assert not is_rate_limited(busy)
@@ -0,0 +1,50 @@
+import os
+import httpx
+from backend.core import blobs
+from backend.workers import materialize
+
+VIDEO = b"\x00\x00\x00\x18ftypmp42" + os.urandom(3 * 1024 * 1024)
+
+
+def test_outputs_are_streamed_deduped_and_rewritten(monkeypatch, tmp_path):
+    monkeypatch.setattr(blobs, "BLOB_DIR", str(tmp_path))
+    monkeypatch.setattr(materialize, "BLOB_PUBLIC_BASE_URL", "https://api.example.com/api/v1/ai/blobs")
+    client = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=VIDEO)))
+    monkeypatch.setattr(materialize, "get_http_client", lambda url: client)
+    stored, cached, events = {}, {}, []
+    monkeypatch.setattr(materialize.celery_app.backend, "store_result", lambda task_id, result, state: stored.update({task_id: result}))
+    monkeypatch.setattr(materialize, "store_cached_result", lambda key, result: cached.update({key: result}))
+    monkeypatch.setattr(materialize, "publish_task_event", lambda task_id, status, **fields: events.append(fields))
+
+    result = {"status": "completed", "results": [
+        {"output_url": "https://provider.local/a.mp4", "status": "completed"},
+        {"output_url": "https://provider.local/b.mp4", "status": "completed"},
+        {"output_url": None, "status": "failed"},
+    ]}
+    out = materialize.materialize_outputs.run("task-1", result, "cache-1")
+
+    items = stored["task-1"]["results"]
+    assert items[0]["output_url"] == items[1]["output_url"]
+    assert items[0]["output_url"].startswith("https://api.example.com/api/v1/ai/blobs/")
+    assert items[1]["provider_url"] == "https://provider.local/b.mp4"
+    assert items[2]["output_url"] is None
+    assert cached["cache-1"] == stored["task-1"] and events[0]["materialized"]
+    assert len(out["outputs"]) == 2
+    assert [f for _, _, files in os.walk(tmp_path) for f in files] == [items[0]["output_url"].rsplit("/", 1)[1]]
+    assert blobs.sniff_content_type(VIDEO[:16]) == "video/mp4"
+
+
+def test_failed_download_keeps_provider_url(monkeypatch, tmp_path):
+    monkeypatch.setattr(blobs, "BLOB_DIR", str(tmp_path))
+    monkeypatch.setattr(materialize, "BLOB_PUBLIC_BASE_URL", "https://api.example.com/api/v1/ai/blobs")
+    client = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(404)))
+    monkeypatch.setattr(materialize, "get_http_client", lambda url: client)
+    monkeypatch.setattr(materialize.celery_app.backend, "store_result", lambda *a: (_ for _ in ()).throw(AssertionError("stored")))
+    assert materialize.materialize_outputs.run("task-2", {"output_url": "https://provider.local/x.png", "status": "completed"}) is None
+
+
+def test_relative_base_url_is_refused(monkeypatch):
+    monkeypatch.setattr(materialize, "OUTPUT_PUBLIC_BASE_URL", "")
+    monkeypatch.setattr(materialize, "BLOB_PUBLIC_BASE_URL", "/api/v1/ai/blobs")
+    monkeypatch.setattr(materialize, "_download", lambda url: (_ for _ in ()).throw(AssertionError("downloaded")))
+    assert materialize.materialize_outputs.run("task-3", {"output_url": "https://provider.local/x.png", "status": "completed"}) is None
@@ -0,0 +1,37 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from backend.celery_app import ENQUEUED_AT_HEADER, _stamp_enqueue_time
+from backend.core import metrics
+from backend.main import app
+
+pytest.importorskip("prometheus_client")
+
+
+def test_metrics_endpoint_exposes_pipeline_histograms(monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    async def statuses(task_ids):
+        return {task_id: {"status": "processing"} for task_id in task_ids}
+
+    monkeypatch.setattr("backend.api.v1.ai.get_task_statuses", statuses)
+    with TestClient(app) as c:
+        assert c.get("/api/v1/ai/status/abc", headers={"x-api-key": "dev-secret"}).status_code == 200
+        r = c.get("/metrics")
+    assert r.status_code == 200
+    assert 'karate_status_lookup_seconds_count{endpoint="task"}' in r.text
+    assert "karate_provider_latency_seconds" in r.text
+
+
+def test_labels_are_bounded():
+    request = httpx.Request("POST", "http://provider.local")
+    err = httpx.HTTPStatusError("boom", request=request, response=httpx.Response(503, request=request))
+    assert metrics.error_class(err) == "HTTPStatusError:503"
+    assert metrics.error_class(ValueError("x")) == "ValueError"
+    assert metrics.model_label("esrgan") == "esrgan"
+    assert metrics.model_label("someone/private-model") == "other"
+
+
+def test_published_messages_carry_enqueue_time():
+    headers = {}
+    _stamp_enqueue_time(headers=headers)
+    assert headers[ENQUEUED_AT_HEADER] > 0
@@ -0,0 +1,65 @@
+import json
+import os
+
+from fastapi.testclient import TestClient
+from backend.core import models
+from backend.main import app
+
+
+def test_registry_resolves_routes_once(monkeypatch):
+    monkeypatch.setenv("REPLICATE_ESRGAN", "nightmareai/real-esrgan")
+    models.reload()
+    assert models.resolve("esrgan").kind == "replicate"
+    assert models.resolve("esrgan").target == "nightmareai/real-esrgan"
+    assert models.resolve("dalle-3")[1:4] == ("openai", "openai_image", "dall-e-3")
+    assert models.resolve("veo-3").queue == "heavy"
+    assert models.resolve("owner/some-model").provider == "replicate"
+    assert models.resolve("no-such-model") is None
+    monkeypatch.delenv("REPLICATE_ESRGAN")
+    models.reload()
+
+
+def test_registry_file_hot_reload(monkeypatch, tmp_path):
+    path = tmp_path / "models.json"
+    path.write_text(json.dumps({"my-model": {"kind": "replicate", "target": "me/my-model", "cost": 3, "params": ["seed"]}}))
+    monkeypatch.setattr(models, "MODEL_REGISTRY_PATH", str(path))
+    monkeypatch.setattr(models, "MODEL_REGISTRY_CHECK_INTERVAL", 0)
+    spec = models.resolve("my-model")
+    assert (spec.provider, spec.queue, spec.params) == ("replicate", "heavy", frozenset({"seed"}))
+
+    path.write_text(json.dumps({"my-model": {"kind": "replicate", "target": "me/my-model-v2"}}))
+    os.utime(path, (1, 1))
+    assert models.resolve("my-model").target == "me/my-model-v2"
+
+    # A broken file keeps serving the last good table
+    path.write_text("{not json")
+    os.utime(path, (2, 2))
+    assert models.resolve("my-model").target == "me/my-model-v2"
+    monkeypatch.setattr(models, "MODEL_REGISTRY_PATH", "")
+    models.reload()
+
+
+def test_infer_drops_params_the_model_ignores(monkeypatch):
+    from backend.api.v1 import ai
+
+    enqueued = []
+
+    async def enqueue(model, prompt, user_id, cache_key=None, **params):
+        enqueued.append((model, cache_key, params))
+        return "t1"
+
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    monkeypatch.setattr(ai, "run_ai_model_background", enqueue)
+    monkeypatch.setattr(ai, "get_cached_result", lambda key: None)
+    # What frontend/pages/api/run.ts forwards for a node with the canvas defaults
+    payload = {"prompt": "hi", "aspect_ratio": "1:1", "guidance_scale": None, "output_format": "webp",
+               "safety_tolerance": None, "seed": 7, "image": None, "mask": None}
+    with TestClient(app) as c:
+        for model in ("dalle-3", "stable-diffusion-3.5"):
+            r = c.post("/api/v1/ai/infer", headers={"x-api-key": "dev-secret", "x-user-id": "u1"},
+                       json=dict(payload, model=model))
+            assert r.status_code == 200, r.text
+    assert enqueued[0] == ("dalle-3", None, {})
+    # SD 3.5 keeps the params it takes, and only those feed the cache key
+    model, cache_key, params = enqueued[1]
+    assert params == {"aspect_ratio": "1:1", "seed": 7} and cache_key is not None
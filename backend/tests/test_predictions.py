@@ -0,0 +1,149 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+from celery.exceptions import Ignore
+from fastapi.testclient import TestClient
+from backend.core.models import resolve
+from backend.main import app
+from backend.workers import predictions
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes, self.pending = {}, {}
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in (mapping or {field: value}).items()})
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def expire(self, key, ttl):
+        return True
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self.pending.update(mapping)
+
+    def eval(self, script, numkeys, *args):
+        if script == predictions._CLAIM_SCRIPT:
+            record = self.hashes.pop(args[0], None)
+            self.pending.pop(args[2], None)
+            return [x for item in record.items() for x in item] if record else None
+        if script == predictions._SET_PREDICTION_SCRIPT:
+            if args[0] not in self.hashes:
+                return 0
+            self.hset(args[0], "prediction_id", args[1])
+            return 1
+        if script == predictions._SCHEDULE_SCRIPT:
+            self.pending[args[2]] = float(args[3])
+            return 1
+        return 0
+
+
+SECRET = base64.b64encode(b"k" * 24).decode()
+
+
+def signed(body):
+    stamp = str(int(time.time()))
+    sig = base64.b64encode(hmac.new(b"k" * 24, f"msg_1.{stamp}.".encode() + body, hashlib.sha256).digest()).decode()
+    return {"webhook-id": "msg_1", "webhook-timestamp": stamp, "webhook-signature": f"v1,{sig}"}
+
+
+class Prediction:
+    id, status, output, error = "pred-1", "processing", None, None
+
+
+@pytest.fixture
+def handed_off(monkeypatch):
+    r = FakeRedis()
+    done = {"stored": {}, "events": [], "released": []}
+    monkeypatch.setenv("REPLICATE_API_TOKEN", "r8_test")
+    monkeypatch.setattr(predictions, "REPLICATE_COMPLETION", "webhook")
+    monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_BASE_URL", "https://api.example.com")
+    monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_SECRET", "whsec_" + SECRET)
+    monkeypatch.setattr(predictions, "get_redis_client", lambda: r)
+    monkeypatch.setattr(predictions, "get_replicate_client", lambda token, for_async=False: object())
+    monkeypatch.setattr(predictions, "_create_prediction", lambda client, ref, inputs, **params: done.update(params=params) or Prediction())
+    monkeypatch.setattr(predictions.poll_predictions, "apply_async", lambda **options: None)
+    def store(task_id, result, state):
+        done["stored"][task_id] = result
+
+    # The result backend is per thread, and the webhook runs in the threadpool
+    monkeypatch.setattr(predictions.celery_app.backend, "store_result", store)
+    monkeypatch.setattr(type(predictions.celery_app.backend), "store_result", lambda self, *args: store(*args))
+    monkeypatch.setattr(predictions, "publish_task_event", lambda task_id, status, **fields: done["events"].append(status))
+    monkeypatch.setattr(predictions.fairshare, "release", lambda user_id, task_id: done["released"].append(user_id))
+    monkeypatch.setattr(predictions, "release_slot", lambda lease, outcome: done["released"].append(outcome))
+    monkeypatch.setattr(predictions, "store_cached_result", lambda key, result: None)
+    monkeypatch.setattr(predictions, "release_inflight", lambda key, task_id: None)
+    monkeypatch.setattr(predictions, "record_latency", lambda model, elapsed: None)
+    monkeypatch.setattr(predictions, "is_cancelled", lambda task_id: False)
+
+    spec = resolve("owner/model")
+    with pytest.raises(Ignore):
+        predictions.hand_off("t1", spec, "a cat", {}, None, "u1", None)
+    assert done["params"]["webhook"] == "https://api.example.com/api/v1/ai/webhooks/replicate?task_id=t1"
+    assert r.hget(predictions.RECORD_PREFIX + "t1", "prediction_id") == "pred-1" and "t1" in r.pending
+    return r, done
+
+
+def test_webhook_completes_handed_off_task(handed_off, monkeypatch):
+    r, done = handed_off
+    with TestClient(app) as c:
+        body = json.dumps({"id": "pred-1", "status": "succeeded", "output": ["https://replicate.delivery/out.png"]}).encode()
+        url = "/api/v1/ai/webhooks/replicate?task_id=t1"
+        assert c.post(url, content=body).status_code == 401
+        assert c.post(url, content=body, headers=signed(body)).json()["status"] == "completed"
+        # Redelivery (or a poll racing the webhook) finds nothing left to complete
+        assert c.post(url, content=body, headers=signed(body)).json()["status"] == "ignored"
+    assert done["stored"]["t1"]["output_url"] == "https://replicate.delivery/out.png"
+    assert done["events"] == ["completed"] and done["released"] == ["u1"]
+    assert not r.hashes and not r.pending
+
+
+def test_poller_fails_predictions_past_their_deadline(handed_off, monkeypatch):
+    r, done = handed_off
+    cancelled = []
+    r.hashes[predictions.RECORD_PREFIX + "t1"]["deadline"] = str(time.time() - 1)
+    monkeypatch.setattr(predictions, "cancel_pending", cancelled.append)
+    r.zrangebyscore = lambda key, low, high, start, num: list(r.pending)
+    r.pipeline = lambda transaction: type("Pipe", (), {
+        "hmget": lambda self, key, *fields: None,
+        "execute": lambda self: [[r.hget(predictions.RECORD_PREFIX + "t1", f) for f in ("prediction_id", "deadline")]],
+    })()
+    monkeypatch.setattr(predictions.async_engine, "run_coroutine", lambda coro: coro.close() or [Prediction()])
+    predictions.poll_predictions.run()
+    assert cancelled == ["t1"] and done["stored"]["t1"]["status"] == "failed"
+    assert "time limit" in done["stored"]["t1"]["error"]
+
+
+def test_webhook_before_the_prediction_id_is_filed_is_ignored(handed_off):
+    r, done = handed_off
+    r.hashes[predictions.RECORD_PREFIX + "t1"].pop("prediction_id")
+    assert predictions.complete_prediction("t1", {"id": "pred-1", "status": "succeeded", "output": ["https://x/o.png"]}) is None
+    assert "t1" not in done["stored"] and predictions.RECORD_PREFIX + "t1" in r.hashes
+
+
+def test_webhook_signature(monkeypatch):
+    body = b'{"id": "pred-1"}'
+    headers = signed(body)
+    headers["webhook-signature"] = "v1,bogus " + headers["webhook-signature"]
+    assert not predictions.verify_webhook(headers, body)
+    monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_SECRET", "whsec_" + SECRET)
+    assert predictions.verify_webhook(headers, body)
+    assert not predictions.verify_webhook(headers, body + b" ")
+    assert not predictions.verify_webhook({**headers, "webhook-timestamp": str(int(time.time()) - 3600)}, body)
+
+
+def test_webhook_mode_polls_without_a_secret(monkeypatch):
+    monkeypatch.setattr(predictions, "REPLICATE_COMPLETION", "webhook")
+    monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_BASE_URL", "https://api.example.com")
+    monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_SECRET", "")
+    assert predictions._mode() == "poll"
@@ -0,0 +1,81 @@
+import asyncio
+
+import httpx
+from backend.core.retry import RetryPolicy, is_retryable
+from backend.workers import async_engine
+
+
+def _status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://provider.local")
+    return httpx.HTTPStatusError("err", request=request, response=httpx.Response(status, request=request))
+
+
+def test_retryable_classification():
+    assert is_retryable("http", _status_error(503))
+    assert is_retryable("http", _status_error(429))
+    assert not is_retryable("http", _status_error(400))
+    assert is_retryable("http", httpx.ReadTimeout("slow"))
+    assert not is_retryable("http", ValueError("bad input"))
+
+    from replicate.exceptions import ModelError, ReplicateError
+    assert is_retryable("replicate", ReplicateError(status=502))
+    assert not is_retryable("replicate", ReplicateError(status=422))
+    assert not is_retryable("replicate", ModelError("NSFW content detected"))
+
+
+def test_backoff_stays_within_policy_cap():
+    policy = RetryPolicy(max_retries=3, base_delay=1.0, max_delay=5.0)
+    assert all(0 <= policy.delay(attempt) <= 5.0 for attempt in range(10))
+
+
+def test_hedged_request_takes_first_answer_and_cancels_loser():
+    calls = []
+    cancelled = []
+
+    async def attempt():
+        n = len(calls)
+        calls.append(n)
+        try:
+            await asyncio.sleep(1.0 if n == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(n)
+            raise
+        return f"attempt-{n}"
+
+    result = async_engine.run_coroutine(async_engine.hedged(attempt, 0.05))
+    assert result == "attempt-1"
+    assert calls == [0, 1]
+    async_engine.run_coroutine(asyncio.sleep(0.01))
+    assert cancelled == [0]
+
+    calls.clear()
+    assert async_engine.run_coroutine(async_engine.hedged(attempt, None)) == "attempt-0"
+    assert calls == [0]
+    async_engine.shutdown()
+
+
+def test_deferrals_do_not_use_up_transient_retries(monkeypatch):
+    from backend.core.limits import Throttled
+    from backend.workers import tasks
+
+    deferrals, calls = [], []
+
+    def acquire(provider, model):
+        if len(deferrals) < 3:
+            deferrals.append(model)
+            raise Throttled("http", 0)
+        return None
+
+    def provider_call(task_id, spec, prompt, kwargs):
+        calls.append(task_id)
+        raise httpx.ReadTimeout("slow")
+
+    monkeypatch.setattr(tasks, "acquire_slot", acquire)
+    monkeypatch.setattr(tasks, "_call_provider", provider_call)
+    monkeypatch.setattr(tasks, "is_cancelled", lambda task_id: False)
+    monkeypatch.setattr(tasks.process_ai_task, "update_state", lambda *args, **kwargs: None)
+    monkeypatch.setattr(tasks, "policy_for", lambda provider: RetryPolicy(max_retries=2, base_delay=0.0, max_delay=0.0))
+    result = tasks.process_ai_task.apply(("some-http-model", "cat", "u1")).get()
+    assert result["status"] == "failed" and len(deferrals) == 3
+    # Every transient retry is still available after the deferrals
+    assert len(calls) == 1 + 2
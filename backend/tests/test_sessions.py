@@ -0,0 +1,130 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from backend.api.v1 import agents
+from backend.core import sessions
+from backend.main import app
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes, self.lists, self.keys = {}, {}, set()
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.keys:
+            return None
+        self.keys.add(key)
+        return True
+
+    async def delete(self, key):
+        self.keys.discard(key)
+
+
+class FakePipeline:
+    def __init__(self, r):
+        self.r, self.ops = r, []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.ops.append((name, args, kwargs))
+
+    async def execute(self):
+        out = []
+        for name, args, kwargs in self.ops:
+            key = args[0]
+            if name == "hgetall":
+                out.append(dict(self.r.hashes.get(key, {})))
+            elif name == "lrange":
+                out.append(list(self.r.lists.get(key, [])))
+            elif name == "rpush":
+                out.append(await self.r.rpush(*args))
+            elif name == "ltrim":
+                self.r.lists[key] = self.r.lists.get(key, [])[args[1]:]
+                out.append(True)
+            elif name == "hset":
+                self.r.hashes.setdefault(key, {}).update({k: str(v) for k, v in kwargs["mapping"].items()})
+                out.append(True)
+            else:
+                out.append(True)
+        return out
+
+
+def test_old_turns_are_folded_into_a_stable_summary(monkeypatch):
+    r = FakeRedis()
+    monkeypatch.setattr(sessions, "get_async_redis_client", lambda: r)
+    summarized = []
+
+    async def summarize(summary, turns):
+        summarized.append(len(turns))
+        return "User is building a cyberpunk city workflow."
+
+    async def scenario():
+        session = await sessions.open_session("u1", None, seed=[{"role": "user", "content": "hello " * 40}])
+        for i in range(6):
+            await sessions.record_turns(session, [{"role": "user", "content": f"question {i} " * 20},
+                                                  {"role": "assistant", "content": f"answer {i} " * 20}])
+        assert await sessions.compact("u1", session.id, summarize, budget=400)
+        # Back under budget: the prompt prefix stays put until it grows again
+        assert not await sessions.compact("u1", session.id, summarize, budget=400)
+        return await sessions.open_session("u1", session.id)
+
+    session = asyncio.run(scenario())
+    assert len(summarized) == 1
+    assert sum(t["tokens"] for t in session.turns) <= 200 and len(session.turns) >= sessions.MIN_KEPT_TURNS
+    assert session.tokens_saved > 0
+    messages = session.messages("SYSTEM", "next")
+    assert messages[0]["content"] == "SYSTEM" and "cyberpunk" in messages[1]["content"]
+    assert messages[2]["content"] == session.turns[0]["content"] and messages[-1] == {"role": "user", "content": "next"}
+
+
+def test_chat_keeps_history_server_side(monkeypatch):
+    r = FakeRedis()
+    monkeypatch.setattr(sessions, "get_async_redis_client", lambda: r)
+    sent = []
+
+    async def create(**params):
+        sent.append(params["messages"])
+        reply = json.dumps({"message": f"reply {len(sent)}", "workflow": None})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=None)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(agents, "get_async_openai_client", lambda api_key: client)
+    user = {"x-user-id": "u1"}
+    with TestClient(app) as c:
+        first = c.post("/api/v1/agents/chat", json={"prompt": "hi", "new_session": True}, headers=user).json()
+        second = c.post("/api/v1/agents/chat", json={"prompt": "and then?", "session_id": first["session_id"]}, headers=user).json()
+        # Another user cannot read it: the id starts an empty session of their own
+        c.post("/api/v1/agents/chat", json={"prompt": "what did they say?", "session_id": first["session_id"]},
+               headers={"x-user-id": "u2"})
+    assert first["message"] == "reply 1" and second["session_id"] == first["session_id"]
+    assert [m["role"] for m in sent[1]] == ["system", "user", "assistant", "user"]
+    assert sent[1][:2] == sent[0]  # the second prompt extends the first one
+    assert [m["role"] for m in sent[2]] == ["system", "user"]
+
+
+def test_chat_without_a_session_stays_stateless(monkeypatch):
+    r = FakeRedis()
+    monkeypatch.setattr(sessions, "get_async_redis_client", lambda: r)
+    sent = []
+
+    async def create(**params):
+        sent.append(params["messages"])
+        reply = json.dumps({"message": "ok", "workflow": None})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=None)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(agents, "get_async_openai_client", lambda api_key: client)
+    # What the editor's agent panel (frontend/pages/api/agent.ts) sends
+    body = {"prompt": "and now upscale it", "history": [{"role": "user", "content": "make a city"},
+                                                        {"role": "assistant", "content": "done"}]}
+    with TestClient(app) as c:
+        reply = c.post("/api/v1/agents/chat", json=body, headers={"x-user-id": "u1"}).json()
+    assert reply["session_id"] is None and not r.lists and not r.hashes
+    assert [m["content"] for m in sent[0][1:]] == ["make a city", "done", "and now upscale it"]
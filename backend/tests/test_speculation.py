@@ -0,0 +1,163 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from backend.core import speculation, status
+from backend.main import app
+from backend.workers import client
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes, self.keys = {}, {}
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def hlen(self, key):
+        return len(self.hashes.get(key, {}))
+
+    def hdel(self, key, field):
+        return int(self.hashes.get(key, {}).pop(field, None) is not None)
+
+    def exists(self, key):
+        return int(key in self.keys)
+
+    def delete(self, key):
+        return int(self.keys.pop(key, None) is not None)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, r):
+        self.r = r
+
+    def hset(self, key, field, value):
+        self.r.hashes.setdefault(key, {})[field] = value
+
+    def set(self, key, value, ex=None):
+        self.r.keys[key] = value
+
+    def expire(self, key, ttl):
+        pass
+
+    def execute(self):
+        return []
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    r = FakeRedis()
+    sent, cancelled = [], []
+    monkeypatch.setattr(speculation, "get_redis_client", lambda: r)
+    monkeypatch.setattr(client, "get_cached_result", lambda key: None)
+    monkeypatch.setattr(client, "claim_inflight", lambda key, task_id: None)
+    monkeypatch.setattr(client, "release_inflight", lambda key, task_id: None)
+    monkeypatch.setattr(client.fairshare, "queue_depths", lambda: {})
+    monkeypatch.setattr(client, "send_model_task", lambda name, args, kwargs, task_id, **options:
+                        sent.append((task_id, kwargs, options)) or SimpleNamespace(id=task_id))
+    monkeypatch.setattr(client, "cancel_task", lambda task_id, handed_off=True: cancelled.append(task_id) or "cancelled")
+    return r, sent, cancelled
+
+
+def test_changed_inputs_cancel_the_slots_previous_job(jobs, monkeypatch):
+    r, sent, cancelled = jobs
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    headers = {"x-api-key": "dev-secret", "x-user-id": "u1"}
+    upscale = {"model": "esrgan", "prompt": "", "image": "https://cdn/a.png", "seed": 1}
+    with TestClient(app) as c:
+        first = c.post("/api/v1/ai/speculate", headers=headers, json={"slots": {"node-2": upscale}}).json()["slots"]["node-2"]
+        again = c.post("/api/v1/ai/speculate", headers=headers, json={"slots": {"node-2": upscale}}).json()["slots"]["node-2"]
+        changed = c.post("/api/v1/ai/speculate", headers=headers,
+                         json={"slots": {"node-2": dict(upscale, image="https://cdn/b.png")}}).json()["slots"]["node-2"]
+        withdrawn = c.post("/api/v1/ai/speculate", headers=headers, json={"slots": {"node-2": None}}).json()["slots"]["node-2"]
+        unseeded = c.post("/api/v1/ai/speculate", headers=headers, json={"slots": {"node-3": dict(upscale, seed=None)}})
+
+    assert first["status"] == "queued" and again == {"status": "unchanged", "task_id": first["task_id"]}
+    assert changed["status"] == "queued" and withdrawn["status"] == "withdrawn"
+    assert cancelled == [first["task_id"], changed["task_id"]]
+    assert [task_id for task_id, _, _ in sent] == [first["task_id"], changed["task_id"]]
+    _, kwargs, options = sent[0]
+    assert kwargs["speculative"] and options["priority"] == 9
+    assert unseeded.status_code == 400 and speculation.slot_count("u1") == 0
+
+
+class FakeStatusRedis:
+    """Status hashes as filed by record_queued."""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def expire(self, key, ttl):
+        pass
+
+    def execute(self):
+        return []
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+
+def test_real_request_takes_over_a_queued_speculative_job(jobs, monkeypatch):
+    r, sent, cancelled = jobs
+    statuses = FakeStatusRedis()
+    monkeypatch.setattr(status, "get_redis_client", lambda: statuses)
+    status.record_queued([("spec-1", "esrgan")])
+    speculation.set_slot("u1", "node-2", "spec-1", "k", "esrgan")
+    owners = ["spec-1", None]
+    monkeypatch.setattr(client, "claim_inflight", lambda key, task_id: owners.pop(0))
+    monkeypatch.setattr(client, "AsyncResult", lambda task_id, app=None: SimpleNamespace(state="PENDING"))
+
+    task_id = asyncio.run(client.run_ai_model_background("esrgan", "", "u1", cache_key="k", seed=1))
+    assert task_id != "spec-1" and cancelled == ["spec-1"]
+    assert sent[0][0] == task_id and sent[0][2]["priority"] == 0 and "speculative" not in sent[0][1]
+    # Adopted jobs are no longer cancelled when the slot changes
+    assert not speculation.is_speculative("spec-1")
+    assert not client.withdraw_speculation("u1", "node-2") and cancelled == ["spec-1"]
+    assert json.loads(r.hashes[speculation.SLOTS_PREFIX + "u1"].get("node-2", "null")) is None
+
+
+def test_speculative_jobs_hold_the_users_credits(jobs, monkeypatch):
+    r, sent, cancelled = jobs
+    held, refunded = [], []
+
+    def reserve(user_id, task_id, amount):
+        if user_id == "broke":
+            raise client.credits.InsufficientCredits(user_id, amount, 0)
+        held.append((user_id, task_id, amount))
+
+    monkeypatch.setattr(client.credits, "reserve", reserve)
+    monkeypatch.setattr(client.credits, "refund", lambda user_id, task_id: refunded.append(task_id))
+    queued = client.speculate("u1", "node-2", "esrgan", "", {"image": "https://cdn/a.png"}, "k1")
+    assert held == [("u1", queued["task_id"], client._spec_for("esrgan").cost)]
+    assert client.speculate("broke", "node-2", "esrgan", "", {}, "k2") == {"status": "skipped", "task_id": None}
+    assert len(sent) == 1
+
+    monkeypatch.setattr(client, "send_model_task", lambda *a, **k: (_ for _ in ()).throw(ConnectionError("broker down")))
+    with pytest.raises(ConnectionError):
+        client.speculate("u1", "node-3", "esrgan", "", {}, "k3")
+    assert refunded == [held[-1][1]]
+
+
+def test_real_request_joins_a_started_speculative_job(jobs, monkeypatch):
+    r, sent, cancelled = jobs
+    statuses = FakeStatusRedis()
+    monkeypatch.setattr(status, "get_redis_client", lambda: statuses)
+    status.record_queued([("spec-1", "esrgan")])
+    speculation.set_slot("u1", "node-2", "spec-1", "k", "esrgan")
+    monkeypatch.setattr(client, "claim_inflight", lambda key, task_id: "spec-1")
+    monkeypatch.setattr(client, "add_holder", lambda task_id: None)
+    monkeypatch.setattr(client, "AsyncResult", lambda task_id, app=None: SimpleNamespace(state="STARTED"))
+
+    assert asyncio.run(client.run_ai_model_background("esrgan", "", "u2", cache_key="k", seed=1)) == "spec-1"
+    assert sent == [] and cancelled == [] and not speculation.is_speculative("spec-1")
@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+from backend.core import status
+from backend.workers import client
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes, self.ttls = {}, {}
+
+    def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+
+def test_status_record_is_compact_with_per_state_ttl():
+    r = FakeRedis()
+    status.write_status(r, "t1", "processing", {"model": "esrgan", "stage": "started"})
+    assert r.ttls["karate:status:t1"] == status.STATUS_TTLS["processing"]
+    status.write_status(r, "t1", "failed", {"model": "esrgan", "error": "x" * 5000})
+    assert r.ttls["karate:status:t1"] == status.STATUS_TTLS["failed"]
+    record = status.read_status("t1", r)
+    assert record["status"] == "failed" and len(record["error"]) == status.ERROR_MAX_CHARS
+    assert set(r.hashes["karate:status:t1"]) == {"s", "m", "e"}
+
+
+def test_status_lookup_skips_the_result_backend(monkeypatch):
+    r = FakeRedis()
+    status.write_status(r, "t2", "completed", {"model": "esrgan", "output_url": "https://cdn/x.png"})
+    status.write_status(r, "t3", "completed", {"model": "gpt-image-1", "outputs": 3})
+    monkeypatch.setattr(status, "get_redis_client", lambda: r)
+    monkeypatch.setattr(client, "AsyncResult", lambda *a, **k: (_ for _ in ()).throw(AssertionError("backend read")))
+    assert client.get_task_status("t2")["output_url"] == "https://cdn/x.png"
+    # Multi-output tasks need their per-item results from the full payload
+    assert status.read_status("t3") is None
+
+
+class FakeAsyncRedis:
+    def __init__(self, hashes, values):
+        self.hashes, self.values, self.round_trips = hashes, values, 0
+
+    def pipeline(self, transaction=True):
+        r, keys = self, []
+
+        class Pipe:
+            def hgetall(self, key):
+                keys.append(key)
+
+            async def execute(self):
+                r.round_trips += 1
+                return [dict(r.hashes.get(key, {})) for key in keys]
+        return Pipe()
+
+    async def mget(self, keys):
+        self.round_trips += 1
+        return [self.values.get(key) for key in keys]
+
+
+def test_bulk_status_pipelines_reads_and_caches_finished_tasks(monkeypatch):
+    r = FakeAsyncRedis(
+        {"karate:status:b1": {"s": "completed", "m": "esrgan", "u": "https://cdn/b1.png"},
+         "karate:status:b2": {"s": "processing", "m": "esrgan"},
+         "karate:status:b3": {"s": "completed", "n": "2"}},
+        {"celery-task-meta-b3": json.dumps({"status": "SUCCESS", "result": {"status": "completed", "results": []}})},
+    )
+    monkeypatch.setattr(client, "get_async_redis_client", lambda: r)
+    statuses = asyncio.run(client.get_task_statuses(["b1", "b2", "b3", "b4", "b1"]))
+    assert list(statuses) == ["b1", "b2", "b3", "b4"] and r.round_trips == 2
+    assert statuses["b1"]["output_url"] == "https://cdn/b1.png" and statuses["b2"]["status"] == "processing"
+    # b4 has neither a record nor a result: never enqueued
+    assert statuses["b3"]["results"] == [] and statuses["b4"] is None
+
+    r.hashes.clear()
+    again = asyncio.run(client.get_task_statuses(["b1", "b3"]))
+    assert again == {"b1": statuses["b1"], "b3": statuses["b3"]} and r.round_trips == 2
+
+
+def test_processing_record_of_a_dead_task_reads_as_failed(monkeypatch):
+    r = FakeRedis()
+    status.write_status(r, "t4", "processing", {"model": "esrgan"})
+    monkeypatch.setattr(status, "get_redis_client", lambda: r)
+    killed = type("Result", (), {"state": "FAILURE", "result": RuntimeError("Hard time limit (360s) exceeded")})()
+    monkeypatch.setattr(client, "AsyncResult", lambda *a, **k: killed)
+    assert client.get_task_status("t4") == {
+        "model": "unknown", "prompt": "", "user_id": "", "output_url": None,
+        "status": "failed", "error": "Hard time limit (360s) exceeded",
+    }
+
+    events = []
+    from backend.workers import tasks
+    monkeypatch.setattr(tasks, "publish_task_event", lambda task_id, state, **fields: events.append((task_id, state, fields)))
+    tasks._record_failure(sender=tasks.process_ai_task, task_id="t5", exception=ValueError("boom"), args=("esrgan", "", "u1"))
+    assert events == [("t5", "failed", {"model": "esrgan", "error": "boom"})]
+
+
+def test_queued_tasks_read_as_processing_and_unknown_ids_as_none(monkeypatch):
+    r = FakeRedis()
+    r.pipeline = lambda transaction=True: r
+    r.execute = lambda: None
+    r.exists = lambda key: key in r.hashes
+    monkeypatch.setattr(status, "get_redis_client", lambda: r)
+    monkeypatch.setattr(client, "get_redis_client", lambda: r)
+    queued = type("Result", (), {"state": "PENDING", "result": None, "ready": lambda self: False})()
+    monkeypatch.setattr(client, "AsyncResult", lambda *a, **k: queued)
+    status.record_queued([("q1", "esrgan")])
+    assert client.get_task_status("q1")["status"] == "processing"
+    assert client.get_task_status("q1", full=True)["status"] == "processing"
+    assert client.get_task_status("nope") is None
+
+
+def test_status_falls_back_to_the_result_backend_when_redis_is_down(monkeypatch):
+    class DownRedis:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise ConnectionError("Redis is not running")
+            return fail
+
+    class DownAsyncRedis:
+        def pipeline(self, transaction=True):
+            class Pipe:
+                def hgetall(self, key):
+                    pass
+
+                async def execute(self):
+                    raise ConnectionError("Redis is not running")
+            return Pipe()
+
+    # Eager mode (bench --eager): results live in the in-memory backend, Redis is absent
+    monkeypatch.setattr(status, "get_redis_client", lambda: DownRedis())
+    monkeypatch.setattr(client, "get_redis_client", lambda: DownRedis())
+    monkeypatch.setattr(client, "get_async_redis_client", lambda: DownAsyncRedis())
+    results = {"e1": type("Result", (), {"state": "SUCCESS", "ready": lambda self: True,
+                                         "result": {"status": "completed", "output_url": "https://cdn/e1.png"}})(),
+               "e2": type("Result", (), {"state": "PENDING", "ready": lambda self: False, "result": None})()}
+    monkeypatch.setattr(client, "AsyncResult", lambda task_id, app=None: results[task_id])
+    statuses = asyncio.run(client.get_task_statuses(["e1", "e2"]))
+    assert statuses["e1"]["output_url"] == "https://cdn/e1.png" and statuses["e2"]["status"] == "processing"
@@ -0,0 +1,61 @@
+from fastapi.testclient import TestClient
+from backend.main import app
+from backend.api.v1 import ai
+
+
+def _fake_subscription(events):
+    async def subscribe(task_ids, initial_state=None, heartbeat=15.0):
+        for event in events:
+            yield event
+    return subscribe
+
+
+def test_stream_pushes_until_terminal(monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    monkeypatch.setattr(ai, "subscribe_task_events", _fake_subscription([
+        {"task_id": "t1", "status": "processing"},
+        None,
+        {"task_id": "t1", "status": "completed", "output_url": "https://cdn.local/a.png"},
+        {"task_id": "t1", "status": "should-not-be-sent"},
+    ]))
+    with TestClient(app) as c:
+        r = c.get("/api/v1/ai/stream/t1", headers={"x-api-key": "dev-secret"})
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("text/event-stream")
+        body = r.text
+        assert "event: processing" in body
+        assert ": keep-alive" in body
+        assert "event: completed" in body
+        assert "should-not-be-sent" not in body
+
+
+def test_multi_stream_waits_for_all_tasks(monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    monkeypatch.setattr(ai, "subscribe_task_events", _fake_subscription([
+        {"task_id": "a", "status": "failed", "error": "boom"},
+        {"task_id": "b", "status": "completed"},
+    ]))
+    with TestClient(app) as c:
+        r = c.get("/api/v1/ai/stream", params={"task_ids": "a,b,a"}, headers={"x-api-key": "dev-secret"})
+        assert r.status_code == 200
+        assert r.text.count("event: ") == 2
+
+
+def test_stream_of_an_unknown_task_ends(monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    monkeypatch.setattr(ai, "get_task_status", lambda task_id: {"status": "processing"} if task_id == "known" else None)
+
+    async def subscribe(task_ids, initial_state=None, heartbeat=15.0):
+        for task_id in task_ids:
+            yield await initial_state(task_id)
+        yield {"task_id": "known", "status": "completed"}
+        for _ in range(3):
+            yield None
+        yield {"task_id": "known", "status": "should-not-be-sent"}
+
+    monkeypatch.setattr(ai, "subscribe_task_events", subscribe)
+    with TestClient(app) as c:
+        body = c.get("/api/v1/ai/stream/nope", headers={"x-api-key": "dev-secret"}).text
+        assert body.count("event: ") == 1 and "event: not_found" in body and "keep-alive" not in body
+        body = c.get("/api/v1/ai/stream", params={"task_ids": "nope,known"}, headers={"x-api-key": "dev-secret"}).text
+        assert "event: not_found" in body and "event: completed" in body and "should-not-be-sent" not in body
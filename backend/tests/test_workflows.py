@@ -0,0 +1,66 @@
+import pytest
+from fastapi.testclient import TestClient
+from backend.main import app
+from backend.workers.workflows import WorkflowError, plan_workflow, node_inputs
+
+NODES = [
+    {"id": "p", "type": "prompt", "data": {"prompt": "neon city"}},
+    {"id": "1", "type": "stableDiffusion", "data": {"label": "Stable Diffusion 3.5"}},
+    {"id": "2", "type": "upscale", "data": {"label": "Upscale", "scale": "2x"}},
+    {"id": "3", "type": "stableDiffusion", "data": {"model": "flux-pro-1.1", "seed": 4}},
+]
+EDGES = [
+    {"id": "e1", "source": "p", "target": "1"},
+    {"id": "e2", "source": "1", "target": "2"},
+    {"id": "e3", "source": "p", "target": "3"},
+]
+
+
+def test_plan_resolves_models_and_branches():
+    plan = plan_workflow(NODES, EDGES)
+    assert plan["nodes"]["1"]["model"] == "stable-diffusion-3.5"
+    assert plan["nodes"]["2"]["model"] == "esrgan"
+    assert plan["nodes"]["2"]["params"] == {"scale": 2}
+    assert plan["downstream"]["p"] == ["1", "3"]
+    assert plan["order"].index("1") < plan["order"].index("2")
+
+
+def test_plan_rejects_cycles_and_dangling_edges():
+    with pytest.raises(WorkflowError):
+        plan_workflow(NODES, EDGES + [{"id": "loop", "source": "2", "target": "1"}])
+    with pytest.raises(WorkflowError):
+        plan_workflow(NODES, [{"id": "x", "source": "1", "target": "missing"}])
+
+
+def test_upstream_outputs_feed_prompt_and_image():
+    spec = plan_workflow(NODES, EDGES)["nodes"]["2"]
+    prompt, params = node_inputs(spec, ["https://cdn.local/1.png"])
+    assert params == {"scale": 2, "image": "https://cdn.local/1.png"}
+    prompt, _ = node_inputs(plan_workflow(NODES, EDGES)["nodes"]["1"], ["neon city"])
+    assert prompt == "neon city"
+
+
+def test_run_workflow_rejects_invalid_graph(monkeypatch):
+    monkeypatch.setenv("INTERNAL_API_KEY", "dev-secret")
+    with TestClient(app) as c:
+        r = c.post(
+            "/api/v1/workflows/run",
+            headers={"x-api-key": "dev-secret", "x-user-id": "user_123"},
+            json={"type": "create_workflow", "nodes": [{"id": "1", "type": "mystery", "data": {}}], "edges": []},
+        )
+        assert r.status_code == 400
+
+
+def test_crashed_node_task_fails_the_node(monkeypatch):
+    from backend.workers import workflows
+
+    stored = {"n1": '{"status": "processing", "task_id": "t1"}'}
+    finished = []
+    monkeypatch.setattr(workflows, "get_redis_client", lambda: type("R", (), {"hget": lambda self, key, f: stored.get(f)})())
+    monkeypatch.setattr(workflows, "_load", lambda r, workflow_id: {"plan": {}})
+    monkeypatch.setattr(workflows, "_node_finished", lambda r, wid, state, node_id, record: finished.append((node_id, record)))
+    monkeypatch.setattr(workflows.celery_app, "AsyncResult", lambda task_id: type("A", (), {"result": TimeoutError("hard limit")})())
+
+    workflows.workflow_node_failed("stale", "wf", "n1")
+    workflows.workflow_node_failed("t1", "wf", "n1")
+    assert finished == [("n1", {"status": "failed", "output": None, "error": "hard limit"})]
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from backend.core import clients
+from backend.core.cancel import TaskCancelled
+
+logger = logging.getLogger(__name__)
+
+# Event-loop execution mode (WORKER_EXECUTION_MODE=async).
+#
+# The worker runs Celery's thread pool and each task hands its provider call to
+# a single per-process event loop. A waiting task costs one parked thread rather
+# than one prefork process, and all in-flight calls share the loop's pooled
+# clients from backend.core.clients.
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid: Optional[int] = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide provider loop, starting it on first use (and again after fork)."""
+    global _loop, _loop_pid
+    with _lock:
+        if _loop is None or _loop_pid != os.getpid() or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="provider-loop", daemon=True)
+            thread.start()
+            _loop, _loop_pid = loop, os.getpid()
+        return _loop
+
+
+def run_coroutine(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """Run a coroutine on the provider loop from a worker thread and wait for its result."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())  # type: ignore[arg-type]
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+async def hedged(attempt: Callable[[], Awaitable[Optional[T]]], delay: Optional[float]) -> Optional[T]:
+    """Run ``attempt``; if it has not finished after ``delay`` seconds, race a second copy.
+
+    The first non-empty result wins and the other attempt is cancelled. Errors
+    only propagate once no attempt is left that could still succeed.
+    """
+    if delay is None:
+        return await attempt()
+    tasks = [asyncio.ensure_future(attempt())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            logger.info(f"No response after {delay:.1f}s; sending hedged request")
+            tasks.append(asyncio.ensure_future(attempt()))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif task.result() is not None:
+                    return task.result()
+        if error is not None:
+            raise error
+        return None
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def cancellable(coro: Awaitable[T], should_cancel: Callable[[], bool], interval: float) -> T:
+    """Await ``coro``, cancelling it once ``should_cancel`` (a blocking check, run in a thread) is true."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=interval)
+            if done:
+                return task.result()
+            if await asyncio.to_thread(should_cancel):
+                task.cancel()
+                # Let the call clean up (e.g. cancel its Replicate prediction) before reporting
+                await asyncio.wait({task})
+                raise TaskCancelled("Task was cancelled")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+REPLICATE_FINAL = ("succeeded", "failed", "canceled")
+
+
+async def replicate_run(ref: str, inputs: Dict[str, Any]) -> Any:
+    """Like client.async_run, but an interrupted wait cancels the prediction upstream."""
+    api_token = os.getenv("REPLICATE_API_TOKEN")
+    if not api_token or clients.sdk("replicate") is None:
+        raise RuntimeError("Missing Replicate config")
+    client = clients.get_replicate_client(api_token, for_async=True)
+    model, _, version = ref.partition(":")
+    if version:
+        prediction = await client.predictions.async_create(version=version, input=inputs)
+    else:
+        prediction = await client.models.predictions.async_create(model=model, input=inputs)
+    try:
+        while prediction.status not in REPLICATE_FINAL:
+            await asyncio.sleep(client.poll_interval)
+            await prediction.async_reload()
+    except BaseException:
+        try:
+            await asyncio.shield(prediction.async_cancel())
+        except Exception as e:
+            logger.warning(f"Could not cancel Replicate prediction {prediction.id}: {e}")
+        raise
+    if prediction.status == "failed":
+        raise clients.sdk("replicate").exceptions.ModelError(prediction.error)
+    if prediction.status == "canceled":
+        raise TaskCancelled(f"Replicate prediction {prediction.id} was cancelled")
+    return prediction.output
+
+
+async def openai_images(model_name: str, prompt: str, n: int = 1) -> List[Any]:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key or clients.sdk("openai") is None:
+        raise RuntimeError("OpenAI API key missing or library not installed")
+    client = clients.get_async_openai_client(api_key)
+    resp = await client.images.generate(model=model_name, prompt=prompt, n=n, size="1024x1024")
+    return list(getattr(resp, "data", None) or [])
+
+
+async def openai_image(model_name: str, prompt: str) -> Any:
+    data = await openai_images(model_name, prompt, 1)
+    return data[0] if data else None
+
+
+async def http_post_json(url: str, payload: Dict[str, Any], headers: Dict[str, str]) -> Any:
+    resp = await clients.get_async_http_client(url).post(url, json=payload, headers=headers)
+    resp.raise_for_status()
+    if resp.headers.get("content-type", "").startswith("application/json"):
+        return resp.json()
+    return None
+
+
+def shutdown() -> None:
+    """Close shared clients and stop the loop; safe to call when the loop never started."""
+    global _loop
+    with _lock:
+        loop = _loop
+        if loop is None or _loop_pid != os.getpid() or loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(clients.aclose_all(), loop).result(5)
+        except Exception as e:
+            logger.warning(f"Error closing provider clients: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        _loop = None
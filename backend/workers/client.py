@@ -0,0 +1,425 @@
+import asyncio
+import importlib
+import json
+import logging
+import uuid
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+
+from celery import group, states
+from celery.result import AsyncResult
+from backend.celery_app import MODEL_TASKS, celery_app
+from backend.core import credits, fairshare, metrics, speculation
+from backend.core.cache import claim_inflight, get_cached_result, release_inflight
+from backend.core.cancel import add_holder, detach, request_cancel
+from backend.core.config import (
+    BATCH_TTL, SINGLE_FLIGHT_ENABLED, SPECULATION_ENABLED, SPECULATION_MAX_QUEUE_DEPTH, SPECULATION_MAX_SLOTS,
+    TASK_HARD_TIME_LIMIT_GRACE,
+)
+from backend.core.events import publish_task_event
+from backend.core.limits import queue_for_model
+from backend.core.models import ModelSpec, default_spec, resolve
+from backend.core.redis import get_async_redis_client, get_redis_client
+from backend.core.status import (
+    STATUS_PREFIX, TERMINAL_STATUSES, cached_status, decode_status, read_status, record_queued, remember_status,
+)
+
+logger = logging.getLogger(__name__)
+
+# Enqueue-only client for model jobs: what the API needs to publish tasks and
+# read their status, without importing the task implementations (and with
+# them the provider SDKs). Tasks are published by name; the worker side lives
+# in workers/tasks.py.
+
+PROCESS_AI_TASK, PROCESS_AI_MULTI_TASK = MODEL_TASKS
+
+class RunResult(TypedDict):
+    model: str
+    prompt: str
+    user_id: str
+    output_url: Optional[str]
+    status: str # "processing", "completed" or "failed"
+    error: Optional[str]
+
+def _spec_for(model: str) -> ModelSpec:
+    # The API validates models before enqueueing; anything else (e.g. a model
+    # removed by a registry reload while queued) is tried over plain HTTP
+    return resolve(model) or default_spec(model, 2)
+
+def _local_tasks() -> bool:
+    # send_task always goes through the broker; eager mode (bench --eager) has to
+    # run the registered task in-process instead
+    if not celery_app.conf.task_always_eager:
+        return False
+    importlib.import_module("backend.workers.tasks")
+    return True
+
+def send_model_task(name: str, args: Tuple, kwargs: Dict[str, Any], **options: Any) -> AsyncResult:
+    """Publish a model task by name; ``options`` are the usual apply_async options."""
+    if _local_tasks():
+        return celery_app.tasks[name].apply_async(args, kwargs, **options)
+    return celery_app.send_task(name, args, kwargs, **options)
+
+def enqueue_options(model: str, user_id: Optional[str], job_class: str, task_id: str) -> Dict[str, Any]:
+    """Publish options for one model job: fair-share priority and the model's soft/hard time limits.
+
+    Counts ``task_id`` against ``user_id``'s fair share; the worker releases it when the job ends.
+    """
+    spec = _spec_for(model)
+    priority = fairshare.reserve(user_id, job_class, [task_id])[0]
+    metrics.ENQUEUED_JOBS.labels(job_class, str(priority)).inc()
+    return {"priority": priority, "soft_time_limit": spec.timeout, "time_limit": spec.timeout + TASK_HARD_TIME_LIMIT_GRACE}
+
+def cancel_task(task_id: str, handed_off: bool = True) -> str:
+    """Cancel a model task wherever it is; returns its status afterwards.
+
+    Queued copies are revoked, a running prefork task is interrupted with SIGUSR1
+    and event-loop calls see the cancel flag. Finished tasks are left alone, and a
+    task other identical requests joined keeps running ("detached") until the last
+    of them cancels. ``handed_off=False`` skips the upstream prediction lookup for
+    tasks that never hand off (speculative jobs).
+    """
+    current = get_task_status(task_id)
+    if current and current.get("status") in TERMINAL_STATUSES:
+        return current["status"]
+    if detach(task_id):
+        return "detached"
+    request_cancel(task_id)
+    celery_app.control.revoke(task_id, terminate=True, signal="SIGUSR1")
+    if handed_off:
+        from backend.workers.predictions import cancel_pending
+        cancel_pending(task_id)
+    publish_task_event(task_id, "cancelled")
+    return "cancelled"
+
+async def run_ai_model_background(model: str, prompt: str, user_id: str, cache_key: Optional[str] = None, **kwargs) -> str:
+    """Enqueue a model job; an identical cacheable job already in flight is joined instead.
+
+    Joined requests get the running task's id, so every caller polls the same
+    task and sees its result when it lands.
+    """
+    task_id = str(uuid.uuid4())
+    if cache_key and SINGLE_FLIGHT_ENABLED:
+        owner = claim_inflight(cache_key, task_id)
+        record = read_status(owner) if owner else None
+        if record is not None and record["status"] == "processing":
+            # A task killed without an event still reads processing; the result backend knows better
+            record = _settled(owner) or record
+        if record is not None and record["status"] in ("failed", "cancelled"):
+            # Stale marker from a task that ended without releasing it
+            release_inflight(cache_key, owner)
+            owner = claim_inflight(cache_key, task_id)
+        elif owner and speculation.adopt(owner):
+            outcome = "adopted"
+            if _queued(owner):
+                # Still queued at the speculative priority: run it at ours instead
+                cancel_task(owner, handed_off=False)
+                release_inflight(cache_key, owner)
+                owner = claim_inflight(cache_key, task_id)
+                outcome = "promoted"
+            metrics.SPECULATIVE_JOBS.labels(metrics.model_label(model), outcome).inc()
+        if owner:
+            logger.info(f"Joining in-flight task {owner} for identical {model} request")
+            add_holder(owner)
+            metrics.COALESCED_REQUESTS.labels(metrics.model_label(model)).inc()
+            return owner
+    try:
+        credits.reserve(user_id, task_id, _spec_for(model).cost)
+    except credits.InsufficientCredits:
+        if cache_key and SINGLE_FLIGHT_ENABLED:
+            release_inflight(cache_key, task_id)
+        raise
+    options = enqueue_options(model, user_id, "interactive", task_id)
+    record_queued([(task_id, model)])
+    try:
+        task = send_model_task(PROCESS_AI_TASK, (model, prompt, user_id), dict(kwargs, cache_key=cache_key), task_id=task_id, **options)
+    except Exception:
+        credits.refund(user_id, task_id)
+        if cache_key and SINGLE_FLIGHT_ENABLED:
+            # Nothing was enqueued; identical requests must not join it
+            release_inflight(cache_key, task_id)
+        raise
+    return task.id
+
+def enqueue_batch(jobs: List[Dict[str, Any]]) -> List[str]:
+    """Publish all jobs as one Celery group (a single producer connection); returns task ids in order.
+
+    Each job is {"model", "prompt", "user_id", "params", "n", "cache_key"}; n > 1 selects
+    process_ai_multi_task. Credits for every job are held up front; if any job cannot be
+    covered nothing is enqueued and InsufficientCredits is raised.
+    """
+    task_ids = [str(uuid.uuid4()) for _ in jobs]
+    held: List[Tuple[str, str]] = []
+    try:
+        for job, task_id in zip(jobs, task_ids):
+            credits.reserve(job["user_id"], task_id, _spec_for(job["model"]).cost * job.get("n", 1))
+            held.append((job["user_id"], task_id))
+        signatures = []
+        for job, task_id in zip(jobs, task_ids):
+            if job.get("n", 1) > 1:
+                sig = celery_app.signature(PROCESS_AI_MULTI_TASK, (job["model"], job["prompt"], job["user_id"], job["n"]), job["params"])
+            else:
+                sig = celery_app.signature(PROCESS_AI_TASK, (job["model"], job["prompt"], job["user_id"]),
+                                           dict(job["params"], cache_key=job.get("cache_key")))
+            signatures.append(sig.set(task_id=task_id, **enqueue_options(job["model"], job["user_id"], "batch", task_id)))
+        record_queued((task_id, job["model"]) for job, task_id in zip(jobs, task_ids))
+        _local_tasks()
+        result = group(signatures).apply_async()
+    except Exception:
+        for user_id, task_id in held:
+            credits.refund(user_id, task_id)
+        raise
+    return [r.id for r in result.results]
+
+def _queue_idle(model: str) -> bool:
+    queue = queue_for_model(model)
+    return sum(n for (q, _), n in fairshare.queue_depths().items() if q == queue) <= SPECULATION_MAX_QUEUE_DEPTH
+
+def speculate(user_id: str, slot: str, model: str, prompt: str, params: Dict[str, Any], cache_key: str) -> Dict[str, Any]:
+    """Register the job likely to be requested next for ``slot``; returns {"status", "task_id"}.
+
+    The job runs at the lowest priority and only lands in the result cache, so the
+    real request later hits the cache or joins the task. Its cost is held like any
+    job's and charged to the user when it completes; a job cancelled before that
+    (slot changed or withdrawn, or taken over by a real request) is refunded. A
+    different job registered earlier for the slot is cancelled first. Status is
+    "unchanged", "cached", "joined" (an identical job is already in flight),
+    "queued", or "skipped" when speculation is off, the user holds
+    SPECULATION_MAX_SLOTS slots, cannot cover the job or the model's queue has
+    work waiting.
+    """
+    current = speculation.get_slot(user_id, slot)
+    if current and current["cache_key"] == cache_key:
+        return {"status": "unchanged", "task_id": current["task_id"]}
+    if current:
+        withdraw_speculation(user_id, slot, current)
+    if get_cached_result(cache_key):
+        return {"status": "cached", "task_id": None}
+    if not SPECULATION_ENABLED or speculation.slot_count(user_id) >= SPECULATION_MAX_SLOTS or not _queue_idle(model):
+        metrics.SPECULATIVE_JOBS.labels(metrics.model_label(model), "skipped").inc()
+        return {"status": "skipped", "task_id": None}
+    task_id = str(uuid.uuid4())
+    owner = claim_inflight(cache_key, task_id) if SINGLE_FLIGHT_ENABLED else None
+    if owner:
+        return {"status": "joined", "task_id": owner}
+    try:
+        credits.reserve(user_id, task_id, _spec_for(model).cost)
+    except credits.InsufficientCredits:
+        release_inflight(cache_key, task_id)
+        metrics.SPECULATIVE_JOBS.labels(metrics.model_label(model), "skipped").inc()
+        return {"status": "skipped", "task_id": None}
+    speculation.set_slot(user_id, slot, task_id, cache_key, model)
+    record_queued([(task_id, model)])
+    try:
+        send_model_task(PROCESS_AI_TASK, (model, prompt, user_id), dict(params, cache_key=cache_key, speculative=True),
+                        task_id=task_id, **enqueue_options(model, user_id, "speculative", task_id))
+    except Exception:
+        credits.refund(user_id, task_id)
+        speculation.clear_slot(user_id, slot)
+        release_inflight(cache_key, task_id)
+        raise
+    metrics.SPECULATIVE_JOBS.labels(metrics.model_label(model), "queued").inc()
+    return {"status": "queued", "task_id": task_id}
+
+def withdraw_speculation(user_id: str, slot: str, current: Optional[Dict[str, Any]] = None) -> bool:
+    """Drop the slot's speculative job, cancelling it unless a real request adopted it; True if cancelled."""
+    current = current or speculation.get_slot(user_id, slot)
+    if current is None:
+        return False
+    speculation.clear_slot(user_id, slot)
+    # Whoever takes the marker first wins: a request that already adopted the job keeps it
+    if not speculation.adopt(current["task_id"]):
+        return False
+    release_inflight(current["cache_key"], current["task_id"])
+    cancel_task(current["task_id"], handed_off=False)
+    metrics.SPECULATIVE_JOBS.labels(metrics.model_label(current["model"]), "cancelled").inc()
+    return True
+
+BATCH_PREFIX = "karate:batch:"
+
+def save_batch(batch_id: str, entries: List[Dict[str, Any]]) -> None:
+    """Store the item -> (task_id, slot) manifest; slot indexes into a multi-output task's results."""
+    r = get_redis_client()
+    if r is None:
+        raise RuntimeError("Redis unavailable")
+    r.set(BATCH_PREFIX + batch_id, json.dumps(entries, separators=(",", ":")), ex=BATCH_TTL)
+
+def get_batch_status(batch_id: str) -> Optional[Dict[str, Any]]:
+    r = get_redis_client()
+    raw = r.get(BATCH_PREFIX + batch_id) if r is not None else None
+    if not raw:
+        return None
+    entries = json.loads(raw)
+    statuses = {tid: get_task_status(tid) for tid in dict.fromkeys(e["task_id"] for e in entries)}
+
+    items: List[Any] = []
+    for e in entries:
+        res: Any = statuses.get(e["task_id"])
+        slot = e.get("slot")
+        if slot is not None and isinstance(res, dict) and "results" in res:
+            res = res["results"][slot]
+        elif slot is not None and isinstance(res, dict):
+            res = {k: v for k, v in res.items() if k != "results"}
+        items.append(res or {"output_url": None, "status": "processing", "error": None})
+
+    counts = {"completed": 0, "failed": 0, "processing": 0}
+    for item in items:
+        key = item.get("status") if item.get("status") in counts else "processing"
+        counts[key] += 1
+    if counts["processing"]:
+        status = "processing"
+    elif not counts["failed"]:
+        status = "completed"
+    elif not counts["completed"]:
+        status = "failed"
+    else:
+        status = "partial"
+    return {"batch_id": batch_id, "status": status, "total": len(items), **counts, "items": items}
+
+def complete_from_cache(cached: RunResult, user_id: str) -> str:
+    """Record a cache hit as an already-finished task so /status resolves it like any other."""
+    task_id = str(uuid.uuid4())
+    result = dict(cached, user_id=user_id)
+    celery_app.backend.store_result(task_id, result, states.SUCCESS)
+    publish_task_event(task_id, "completed", model=result.get("model"), output_url=result.get("output_url"), cached=True)
+    return task_id
+
+def _processing_result() -> RunResult:
+    return {"model": "unknown", "prompt": "", "user_id": "", "output_url": None, "status": "processing", "error": None}
+
+def _result_from(ready: bool, data: Any) -> Optional[RunResult]:
+    if not ready:
+        return _processing_result()
+    # If it returned a dict (success or handled failure)
+    if isinstance(data, dict):
+        return data  # type: ignore[return-value]
+    # If it raised an exception unhandled
+    if isinstance(data, Exception):
+        return {"model": "unknown", "prompt": "", "user_id": "", "output_url": None, "status": "failed", "error": str(data)}
+    return None
+
+def _settled(task_id: str) -> Optional[RunResult]:
+    """Celery's outcome for a task whose record still says processing; None until it is finished.
+
+    A task can end without its failed event (e.g. Redis was unreachable when
+    it was published), in which case only the result backend knows it failed.
+    """
+    try:
+        result = AsyncResult(task_id, app=celery_app)
+        return _result_from(True, result.result) if result.state in states.READY_STATES else None
+    except Exception as e:
+        logger.warning(f"Error fetching status: {e}")
+        return None
+
+def _has_record(task_id: str) -> bool:
+    r = get_redis_client()
+    if r is None:
+        return False
+    try:
+        return bool(r.exists(STATUS_PREFIX + task_id))
+    except Exception as e:
+        # Cannot tell it from an unknown id; report it as the backend sees it
+        logger.warning(f"Status record check failed for {task_id}: {e}")
+        return True
+
+def _queued(task_id: str) -> bool:
+    """True while no worker has started the task (task_track_started reports STARTED)."""
+    try:
+        return AsyncResult(task_id, app=celery_app).state == states.PENDING
+    except Exception as e:
+        logger.warning(f"Error fetching status: {e}")
+        return False
+
+def get_task_status(task_id: str, full: bool = False) -> Optional[RunResult]:
+    """Compact status record when available; ``full`` reads the whole Celery result payload.
+
+    None for an id with neither a record nor a result (never enqueued, or expired).
+    """
+    if not full:
+        cached = cached_status(task_id)
+        if cached is not None:
+            return cached  # type: ignore[return-value]
+        compact = read_status(task_id)
+        if compact is not None:
+            if compact["status"] == "processing":
+                compact = _settled(task_id) or compact
+            remember_status(task_id, compact)
+            return compact  # type: ignore[return-value]
+    try:
+        result = AsyncResult(task_id, app=celery_app)
+        ready = result.ready()
+        status = _result_from(ready, result.result if ready else None)
+        if result.state == states.PENDING and not _has_record(task_id):
+            return None  # no record and no result: never enqueued, or long expired
+    except Exception as e:
+        logger.error(f"Error fetching status: {e}")
+        return None
+    remember_status(task_id, status)
+    return status
+
+async def get_task_statuses(task_ids: List[str]) -> Dict[str, Optional[RunResult]]:
+    """Statuses of many tasks without blocking the event loop (None for unknown or unreadable ones).
+
+    Finished tasks come from the process-local cache; the rest cost one pipelined
+    read of their compact records, plus one MGET of the full Celery results for
+    tasks without a record (queued, or multi-output) or still processing by it
+    (the result backend has the failure of a task that died without an event).
+    """
+    ids = list(dict.fromkeys(task_ids))
+    found: Dict[str, Optional[RunResult]] = {}
+    pending = []
+    for task_id in ids:
+        cached = cached_status(task_id)
+        if cached is not None:
+            found[task_id] = cached  # type: ignore[assignment]
+        else:
+            pending.append(task_id)
+    r = get_async_redis_client() if pending else None
+    try:
+        if r is None:
+            for task_id in pending:
+                found[task_id] = await asyncio.to_thread(get_task_status, task_id)
+            return {task_id: found.get(task_id) for task_id in ids}
+        pipe = r.pipeline(transaction=False)
+        for task_id in pending:
+            pipe.hgetall(STATUS_PREFIX + task_id)
+        missing, unsettled = [], []
+        for task_id, raw in zip(pending, await pipe.execute()):
+            compact = decode_status(raw)
+            if compact is None:
+                missing.append(task_id)
+            else:
+                found[task_id] = compact  # type: ignore[assignment]
+                if compact["status"] == "processing":
+                    unsettled.append(task_id)
+        if (missing or unsettled) and celery_app.conf.result_serializer == "json":
+            backend = celery_app.backend
+            values = await r.mget([backend.get_key_for_task(task_id).decode() for task_id in missing + unsettled])
+            for i, (task_id, value) in enumerate(zip(missing + unsettled, values)):
+                if not value:
+                    # Neither a record nor a result: an unknown id (unsettled ones keep their record)
+                    continue
+                meta = backend.decode_result(value)
+                ready = meta["status"] in states.READY_STATES
+                if i < len(missing) or ready:
+                    found[task_id] = _result_from(ready, meta.get("result"))
+        elif missing or unsettled:
+            # Binary result payloads cannot go through the text-decoding async client
+            for task_id, status in zip(missing, await asyncio.gather(
+                *(asyncio.to_thread(get_task_status, task_id, True) for task_id in missing)
+            )):
+                found[task_id] = status
+            for task_id, status in zip(unsettled, await asyncio.gather(
+                *(asyncio.to_thread(_settled, task_id) for task_id in unsettled)
+            )):
+                found[task_id] = status or found[task_id]
+    except Exception as e:
+        # Redis down (or absent, as in eager mode): read the rest one by one, like without a client
+        logger.error(f"Error fetching statuses: {e}")
+        rest = [task_id for task_id in pending if task_id not in found]
+        for task_id, status in zip(rest, await asyncio.gather(
+            *(asyncio.to_thread(get_task_status, task_id) for task_id in rest)
+        )):
+            found[task_id] = status
+    for task_id in pending:
+        remember_status(task_id, found.get(task_id))
+    return {task_id: found.get(task_id) for task_id in ids}
@@ -0,0 +1,73 @@
+import logging
+from typing import Any, Optional
+
+from backend.celery_app import celery_app
+from backend.core import credits
+from backend.core.clients import get_http_client
+from backend.core.config import CREDIT_SYNC_BATCH, CREDIT_SYNC_INTERVAL, CREDIT_SYNC_TOKEN, CREDIT_SYNC_URL
+from backend.core.redis import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Write-back of committed credit charges to the system of record.
+#
+# Settling a job appends to the ledger outbox (core/credits.py); the first
+# charge after a quiet period takes the sync lock and schedules one
+# sync_credit_ledger task, which POSTs up to CREDIT_SYNC_BATCH entries per
+# request and keeps rescheduling itself while entries remain. Entries are only
+# dropped after a 2xx, so a failed write-back is retried on the next round;
+# the receiver dedupes on task_id.
+
+SYNC_LOCK = "karate:credits:sync"
+
+# KEYS: outbox, lock | ARGV: lock_ttl. Returns 1 while entries remain (sync keeps going).
+_CONTINUE_SCRIPT = """
+if redis.call('LLEN', KEYS[1]) == 0 then
+  redis.call('DEL', KEYS[2])
+  return 0
+end
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+def _lock_ttl() -> int:
+    return int(CREDIT_SYNC_INTERVAL * 10) + 30
+
+
+def settle_job(user_id: Optional[str], task_id: str, charge: Optional[int] = None) -> int:
+    """Settle a finished job's hold (see credits.settle) and make sure the charge gets written back."""
+    charged = credits.settle(user_id, task_id, charge)
+    if charged and CREDIT_SYNC_URL:
+        r = get_redis_client()
+        try:
+            if r is not None and r.set(SYNC_LOCK, "1", nx=True, ex=_lock_ttl()):
+                sync_credit_ledger.apply_async(countdown=CREDIT_SYNC_INTERVAL)
+        except Exception as e:
+            logger.warning(f"Could not schedule credit write-back: {e}")
+    return charged
+
+
+def _push_batch(r: Any) -> int:
+    batch = credits.outbox_batch(r, CREDIT_SYNC_BATCH)
+    if not batch:
+        return 0
+    headers = {"Authorization": f"Bearer {CREDIT_SYNC_TOKEN}"} if CREDIT_SYNC_TOKEN else {}
+    response = get_http_client(CREDIT_SYNC_URL).post(CREDIT_SYNC_URL, json={"entries": batch}, headers=headers)
+    response.raise_for_status()
+    return credits.ack_outbox(r, len(batch))
+
+
+@celery_app.task(name="backend.workers.ledger.sync_credit_ledger", ignore_result=True)
+def sync_credit_ledger():
+    r = get_redis_client()
+    if r is None or not CREDIT_SYNC_URL:
+        return
+    try:
+        synced = _push_batch(r)
+        if synced:
+            logger.info(f"Wrote back {synced} credit charges")
+    except Exception as e:
+        logger.warning(f"Credit write-back failed, retrying in {CREDIT_SYNC_INTERVAL:.0f}s: {e}")
+    if r.eval(_CONTINUE_SCRIPT, 2, credits.OUTBOX_KEY, SYNC_LOCK, _lock_ttl()):
+        sync_credit_ledger.apply_async(countdown=CREDIT_SYNC_INTERVAL)
@@ -0,0 +1,144 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from celery import states
+from celery.signals import task_success
+
+from backend.celery_app import celery_app
+from backend.core.blobs import blob_path, save_blob_chunks, sniff_content_type
+from backend.core.cache import store_cached_result
+from backend.core.clients import get_http_client
+from backend.core.config import (
+    BLOB_PUBLIC_BASE_URL,
+    MATERIALIZE_OUTPUTS,
+    OUTPUT_MAX_BYTES,
+    OUTPUT_PUBLIC_BASE_URL,
+    OUTPUT_S3_BUCKET,
+    OUTPUT_S3_ENDPOINT,
+    OUTPUT_S3_PREFIX,
+)
+from backend.core.events import publish_task_event
+from backend.core.retry import is_retryable, policy_for
+
+logger = logging.getLogger(__name__)
+
+try:
+    import boto3  # type: ignore
+except Exception:
+    boto3 = None  # type: ignore
+
+# Copies provider outputs into storage we control.
+#
+# Provider URLs expire, and a revisited result would otherwise have to be
+# generated (and paid for) again. Once a model task has succeeded and its result
+# is stored, materialize_outputs streams each output to disk in chunks, files it
+# in the content-addressed blob store (so identical outputs are kept once),
+# optionally pushes it to an S3-compatible bucket, and rewrites the stored
+# result and cache entry to the stable URL. The task itself is reported
+# complete with the provider URL first; nothing here is on its critical path.
+
+MATERIALIZED_TASKS = ("backend.workers.tasks.process_ai_task", "backend.workers.tasks.process_ai_multi_task")
+CHUNK_SIZE = 1024 * 1024
+
+_s3_client: Any = None
+
+
+def _output_urls(result: Dict[str, Any]) -> List[str]:
+    items = result.get("results") if isinstance(result.get("results"), list) else [result]
+    return [item["output_url"] for item in items if isinstance(item, dict) and str(item.get("output_url") or "").startswith("http")]
+
+
+def _download(url: str) -> Dict[str, Any]:
+    with get_http_client(url).stream("GET", url, follow_redirects=True) as resp:
+        resp.raise_for_status()
+        return save_blob_chunks(resp.iter_bytes(CHUNK_SIZE), OUTPUT_MAX_BYTES)
+
+
+def _s3() -> Any:
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client("s3", endpoint_url=OUTPUT_S3_ENDPOINT or None)  # type: ignore
+    return _s3_client
+
+
+def _public_base() -> Optional[str]:
+    """Absolute base of the stable URLs, or None if none is configured.
+
+    Results are read by the frontend on another origin, so a bare
+    /api/v1/ai/blobs path would not resolve there.
+    """
+    if OUTPUT_S3_BUCKET and boto3 is not None:
+        return OUTPUT_PUBLIC_BASE_URL or f"{OUTPUT_S3_ENDPOINT or 'https://s3.amazonaws.com'}/{OUTPUT_S3_BUCKET}"
+    base = OUTPUT_PUBLIC_BASE_URL or BLOB_PUBLIC_BASE_URL
+    return base if base.startswith(("http://", "https://")) else None
+
+
+def _publish(blob: Dict[str, Any], base: str) -> str:
+    """Return the stable URL for a stored output, uploading it to the bucket when one is configured.
+
+    The local copy is kept: the blob store is shared with uploaded inputs, and
+    another task may be materializing the same digest.
+    """
+    digest = blob["sha256"]
+    if OUTPUT_S3_BUCKET and boto3 is not None:
+        key = OUTPUT_S3_PREFIX + digest
+        path = blob_path(digest)
+        try:
+            _s3().head_object(Bucket=OUTPUT_S3_BUCKET, Key=key)
+        except Exception:
+            with open(path, "rb") as f:
+                content_type = sniff_content_type(f.read(16))
+            # upload_file streams from disk in multipart chunks
+            _s3().upload_file(path, OUTPUT_S3_BUCKET, key, ExtraArgs={"ContentType": content_type})
+        return f"{base}/{key}"
+    return f"{base}/{digest}"
+
+
+def _rewrite(result: Dict[str, Any], stable: Dict[str, str]) -> Dict[str, Any]:
+    def swap(item: Dict[str, Any]) -> Dict[str, Any]:
+        url = item.get("output_url")
+        if url in stable:
+            return dict(item, output_url=stable[url], provider_url=url)
+        return item
+
+    if isinstance(result.get("results"), list):
+        return dict(result, results=[swap(item) for item in result["results"]])
+    return swap(result)
+
+
+@celery_app.task(bind=True, name="backend.workers.materialize.materialize_outputs")
+def materialize_outputs(self, task_id: str, result: Dict[str, Any], cache_key: Optional[str] = None):
+    base = _public_base()
+    if base is None:
+        logger.error("MATERIALIZE_OUTPUTS needs an absolute OUTPUT_PUBLIC_BASE_URL or BLOB_PUBLIC_BASE_URL; keeping provider URLs")
+        return None
+    stable: Dict[str, str] = {}
+    for url in dict.fromkeys(_output_urls(result)):
+        try:
+            stable[url] = _publish(_download(url), base)
+        except Exception as e:
+            policy = policy_for("http")
+            if is_retryable("http", e) and self.request.retries < policy.max_retries:
+                raise self.retry(countdown=policy.delay(self.request.retries), max_retries=policy.max_retries)
+            # Keep the provider URL; the result stays usable until it expires
+            logger.warning(f"Could not materialize output of task {task_id}: {e}")
+    if not stable:
+        return None
+
+    updated = _rewrite(result, stable)
+    celery_app.backend.store_result(task_id, updated, states.SUCCESS)
+    if cache_key:
+        store_cached_result(cache_key, updated)
+    publish_task_event(task_id, updated.get("status", "completed"), output_url=updated.get("output_url"), materialized=True)
+    return {"task_id": task_id, "outputs": stable}
+
+
+@task_success.connect
+def _schedule_materialization(sender=None, result=None, **_):
+    # task_success fires after the result is stored, so the rewrite cannot be overwritten
+    if not MATERIALIZE_OUTPUTS or sender is None or sender.name not in MATERIALIZED_TASKS:
+        return
+    if not isinstance(result, dict) or not _output_urls(result) or _public_base() is None:
+        return
+    cache_key = (sender.request.kwargs or {}).get("cache_key")
+    materialize_outputs.delay(sender.request.id, result, cache_key)
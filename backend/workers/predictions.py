@@ -0,0 +1,343 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from celery import states
+from celery.exceptions import Ignore
+
+from backend.celery_app import celery_app
+from backend.core import fairshare, metrics
+from backend.core.cache import release_inflight, store_cached_result
+from backend.core.cancel import TaskCancelled, is_cancelled
+from backend.core.clients import get_replicate_client
+from backend.core.config import (
+    MATERIALIZE_OUTPUTS,
+    PREDICTION_POLL_INTERVAL,
+    PREDICTION_WEBHOOK_GRACE,
+    REPLICATE_COMPLETION,
+    REPLICATE_WEBHOOK_BASE_URL,
+    REPLICATE_WEBHOOK_SECRET,
+)
+from backend.core.events import publish_task_event
+from backend.core.limits import Lease, release_slot
+from backend.core.models import ModelSpec
+from backend.core.redis import get_redis_client
+from backend.core.retry import hedge_delay, record_latency
+from backend.core.status import status_ttl
+from backend.workers import async_engine
+from backend.workers.ledger import settle_job
+from backend.workers.tasks import (
+    RunResult,
+    _create_prediction,
+    _first_url_from,
+    _observe_result_size,
+    _replicate_error_message,
+    _replicate_input,
+    _replicate_predict,
+    _sdxl_input,
+)
+
+logger = logging.getLogger(__name__)
+
+# Replicate predictions completed off the worker (REPLICATE_COMPLETION=webhook|poll).
+#
+# process_ai_task creates the prediction, files a pending record under the
+# task id and raises Ignore: the worker slot is free again within
+# milliseconds, while the Celery state stays PROCESSING. The task is completed
+# later, exactly once, by whichever of these claims the record first:
+#   - Replicate's "completed" webhook (POST /api/v1/ai/webhooks/replicate);
+#   - poll_predictions, one self-rescheduling task per deployment that fetches
+#     every due prediction concurrently. In webhook mode it only looks at
+#     predictions whose webhook is PREDICTION_WEBHOOK_GRACE seconds late, and it
+#     enforces the model timeout and cancellations in both modes.
+# Completion stores the same result, cache entry and events process_ai_task
+# would have produced, and returns the provider lease and fair-share slot.
+# Webhook mode needs REPLICATE_WEBHOOK_SECRET (without it tasks are polled), and
+# a delivery is only accepted for the prediction id filed on the record.
+
+PENDING_KEY = "karate:predictions:pending"  # zset: task_id -> next check time
+RECORD_PREFIX = "karate:predictions:task:"
+POLLER_LOCK = "karate:predictions:poller"
+POLL_BATCH = 200
+RECORD_TTL = 2 * 24 * 3600
+WEBHOOK_PATH = "/api/v1/ai/webhooks/replicate"
+WEBHOOK_TOLERANCE = 300
+
+# KEYS: record, pending | ARGV: task_id
+_CLAIM_SCRIPT = """
+local record = redis.call('HGETALL', KEYS[1])
+if #record == 0 then
+  return false
+end
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return record
+"""
+
+# KEYS: record | ARGV: prediction_id. Returns 0 if the record was claimed (or expired) meanwhile.
+_SET_PREDICTION_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'prediction_id', ARGV[1])
+return 1
+"""
+
+# KEYS: pending, lock | ARGV: task_id, due, lock_ttl. Returns 1 if the caller must start a poller.
+_SCHEDULE_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+if redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[3]) then
+  return 1
+end
+return 0
+"""
+
+# KEYS: pending, lock | ARGV: lock_ttl. Returns 1 while predictions remain (poller keeps going).
+_CONTINUE_SCRIPT = """
+if redis.call('ZCARD', KEYS[1]) == 0 then
+  redis.call('DEL', KEYS[2])
+  return 0
+end
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+def _mode() -> str:
+    # Unsigned deliveries could complete anybody's task, so webhooks need the secret
+    if REPLICATE_COMPLETION == "webhook" and not (REPLICATE_WEBHOOK_BASE_URL and REPLICATE_WEBHOOK_SECRET):
+        return "poll"
+    return REPLICATE_COMPLETION
+
+
+def can_hand_off(spec: ModelSpec, request: Any) -> bool:
+    """Whether this task may return its worker slot while the prediction runs.
+
+    Tasks with link callbacks (workflow nodes) must finish inside the worker for
+    the callback to fire, and hedged models race two predictions, so both keep waiting.
+    """
+    return (spec.provider == "replicate" and _mode() in ("webhook", "poll")
+            and not request.callbacks and hedge_delay(spec.id) is None)
+
+
+def _lock_ttl() -> int:
+    return int(PREDICTION_POLL_INTERVAL * 10) + 30
+
+
+def _schedule(r: Any, task_id: str, due: float) -> None:
+    if r.eval(_SCHEDULE_SCRIPT, 2, PENDING_KEY, POLLER_LOCK, task_id, due, _lock_ttl()):
+        poll_predictions.apply_async(countdown=PREDICTION_POLL_INTERVAL)
+
+
+def hand_off(task_id: str, spec: ModelSpec, prompt: str, kwargs: Dict[str, Any], lease: Optional[Lease],
+             user_id: str, cache_key: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Create the prediction and release the worker by raising Ignore.
+
+    Returns (output_url, error) only when the prediction finished immediately.
+    Without Redis the prediction is awaited in the worker as usual.
+    """
+    api_token = os.getenv("REPLICATE_API_TOKEN")
+    if not api_token:
+        return None, "Missing Replicate config"
+    client = get_replicate_client(api_token)
+    inputs = _sdxl_input(prompt, kwargs) if spec.kind == "replicate_sdxl" else _replicate_input(prompt, kwargs)
+    r = get_redis_client()
+    key = RECORD_PREFIX + task_id
+    now = time.time()
+    if r is not None:
+        try:
+            # Filed before the prediction exists so an instant webhook still finds it
+            r.hset(key, mapping={
+                "model": spec.id, "prompt": prompt, "user_id": user_id, "cache_key": cache_key or "",
+                "provider": spec.provider, "lease": lease.token if lease else "", "started": now,
+                "deadline": now + spec.timeout,
+            })
+            r.expire(key, RECORD_TTL)
+        except Exception as e:
+            logger.warning(f"Could not file pending prediction for {task_id}, waiting in the worker: {e}")
+            r = None
+    if r is None:
+        return _first_url_from(_replicate_predict(client, spec.target, inputs)), None
+    params: Dict[str, Any] = {}
+    if _mode() == "webhook":
+        params = {"webhook": f"{REPLICATE_WEBHOOK_BASE_URL}{WEBHOOK_PATH}?task_id={task_id}",
+                  "webhook_events_filter": ["completed"]}
+    try:
+        prediction = _create_prediction(client, spec.target, inputs, **params)
+    except BaseException:
+        r.delete(key)
+        raise
+    if prediction.status in async_engine.REPLICATE_FINAL:
+        r.delete(key)
+        if prediction.status == "failed":
+            return None, _replicate_error_message(Exception(prediction.error), spec.target)
+        if prediction.status == "canceled":
+            raise TaskCancelled(f"Replicate prediction {prediction.id} was cancelled")
+        return _first_url_from(prediction.output), None
+
+    if not r.eval(_SET_PREDICTION_SCRIPT, 1, key, prediction.id):
+        # Claimed or expired meanwhile: don't re-create it without a TTL
+        raise Ignore()
+    grace = PREDICTION_WEBHOOK_GRACE if _mode() == "webhook" else PREDICTION_POLL_INTERVAL
+    _schedule(r, task_id, now + grace)
+    logger.info(f"Task {task_id} handed off Replicate prediction {prediction.id} ({_mode()})")
+    raise Ignore()
+
+
+def _claim(task_id: str) -> Optional[Dict[str, str]]:
+    r = get_redis_client()
+    if r is None:
+        return None
+    raw = r.eval(_CLAIM_SCRIPT, 2, RECORD_PREFIX + task_id, PENDING_KEY, task_id)
+    if not raw:
+        return None
+    return dict(zip(raw[::2], raw[1::2]))
+
+
+def _finish(task_id: str, record: Dict[str, str], status: str, output: Any, error: Optional[str]) -> RunResult:
+    model, user_id, cache_key = record["model"], record["user_id"], record.get("cache_key") or None
+    elapsed = time.time() - float(record["started"])
+    url = _first_url_from(output) if status == "succeeded" else None
+    if status == "canceled" or (status != "succeeded" and is_cancelled(task_id)):
+        final, error = "cancelled", "Cancelled"
+    elif url:
+        final, error = "completed", None
+    else:
+        final, error = "failed", error or "No output URL generated"
+    result: RunResult = {
+        "model": model, "prompt": record["prompt"], "user_id": user_id,
+        "output_url": url, "status": final, "error": error,
+    }
+    outcome = {"completed": "ok", "failed": "error"}.get(final, final)
+    metrics.PROVIDER_LATENCY_SECONDS.labels(record["provider"], metrics.model_label(model), "ok" if url else "error").observe(elapsed)
+    if url:
+        record_latency(model, elapsed)
+
+    celery_app.backend.store_result(task_id, result, states.SUCCESS)
+    if final != "completed":
+        r = get_redis_client()
+        if r is not None:
+            r.expire(celery_app.backend.get_key_for_task(task_id), status_ttl(final))
+    if cache_key:
+        if url:
+            store_cached_result(cache_key, dict(result))
+        release_inflight(cache_key, task_id)
+    publish_task_event(task_id, final, model=model, output_url=url, error=error)
+    if record.get("lease"):
+        release_slot(Lease(record["provider"], model, record["lease"], time.monotonic() - elapsed), outcome)
+    fairshare.release(user_id, task_id)
+    settle_job(user_id, task_id, None if url else 0)
+    _observe_result_size(model, dict(result))
+    if url and MATERIALIZE_OUTPUTS:
+        from backend.workers.materialize import materialize_outputs
+        materialize_outputs.delay(task_id, result, cache_key)
+    return result
+
+
+def complete_prediction(task_id: str, prediction: Mapping[str, Any]) -> Optional[RunResult]:
+    """Finish the task for a terminal prediction; None if it is still running or already finished."""
+    status = prediction.get("status")
+    if status not in async_engine.REPLICATE_FINAL:
+        return None
+    r = get_redis_client()
+    if r is None:
+        return None
+    # Until hand_off files the prediction id nothing can be matched; the poller completes it later
+    expected = r.hget(RECORD_PREFIX + task_id, "prediction_id")
+    if not expected or prediction.get("id") != expected:
+        logger.warning(f"Prediction {prediction.get('id')} does not belong to task {task_id}")
+        return None
+    record = _claim(task_id)
+    if record is None:
+        return None
+    error = prediction.get("error")
+    if status == "failed" and error:
+        error = _replicate_error_message(Exception(str(error)), record["model"])
+    return _finish(task_id, record, status, prediction.get("output"), error)
+
+
+def cancel_pending(task_id: str) -> bool:
+    """Cancel the upstream prediction of a handed-off task; the completion reports it cancelled."""
+    r = get_redis_client()
+    api_token = os.getenv("REPLICATE_API_TOKEN")
+    if r is None or not api_token:
+        return False
+    try:
+        prediction_id = r.hget(RECORD_PREFIX + task_id, "prediction_id")
+        if not prediction_id:
+            return False
+        get_replicate_client(api_token).predictions.cancel(prediction_id)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not cancel the Replicate prediction of task {task_id}: {e}")
+        return False
+
+
+def verify_webhook(headers: Mapping[str, str], body: bytes) -> bool:
+    """Check Replicate's webhook signature; always false when no secret is configured."""
+    if not REPLICATE_WEBHOOK_SECRET:
+        return False
+    msg_id, stamp, signatures = (headers.get(h, "") for h in ("webhook-id", "webhook-timestamp", "webhook-signature"))
+    if not (msg_id and stamp.isdigit() and signatures) or abs(time.time() - int(stamp)) > WEBHOOK_TOLERANCE:
+        return False
+    secret = base64.b64decode(REPLICATE_WEBHOOK_SECRET.split("_", 1)[-1])
+    expected = base64.b64encode(hmac.new(secret, f"{msg_id}.{stamp}.".encode() + body, hashlib.sha256).digest()).decode()
+    return any(hmac.compare_digest(expected, sig.split(",", 1)[-1]) for sig in signatures.split())
+
+
+async def _fetch(prediction_ids: List[str]) -> List[Any]:
+    client = get_replicate_client(os.environ["REPLICATE_API_TOKEN"], for_async=True)
+    return await asyncio.gather(*(client.predictions.async_get(pid) for pid in prediction_ids), return_exceptions=True)
+
+
+def _poll_due(r: Any) -> None:
+    now = time.time()
+    due = r.zrangebyscore(PENDING_KEY, "-inf", now, start=0, num=POLL_BATCH)
+    if not due:
+        return
+    pipe = r.pipeline(transaction=False)
+    for task_id in due:
+        pipe.hmget(RECORD_PREFIX + task_id, "prediction_id", "deadline")
+    # Records claimed or expired meanwhile just drop out of the schedule
+    live = [(task_id, pid, float(deadline)) for task_id, (pid, deadline) in zip(due, pipe.execute()) if pid and deadline]
+    gone = set(due) - {task_id for task_id, _, _ in live}
+    if gone:
+        r.zrem(PENDING_KEY, *gone)
+    if not live:
+        return
+
+    fetched = async_engine.run_coroutine(_fetch([pid for _, pid, _ in live]))
+    for (task_id, pid, deadline), prediction in zip(live, fetched):
+        if isinstance(prediction, Exception):
+            logger.warning(f"Polling prediction {pid} of task {task_id} failed: {prediction}")
+        elif complete_prediction(task_id, {"id": prediction.id, "status": prediction.status,
+                                           "output": prediction.output, "error": prediction.error}):
+            continue
+        if now > deadline:
+            cancel_pending(task_id)
+            record = _claim(task_id)
+            if record:
+                _finish(task_id, record, "failed", None, f"{record['model']} did not finish within its time limit")
+            continue
+        if is_cancelled(task_id):
+            # The next poll (or the webhook) sees the prediction canceled and finishes the task
+            cancel_pending(task_id)
+        r.zadd(PENDING_KEY, {task_id: now + PREDICTION_POLL_INTERVAL})
+
+
+@celery_app.task(name="backend.workers.predictions.poll_predictions", ignore_result=True)
+def poll_predictions():
+    r = get_redis_client()
+    if r is None or not os.getenv("REPLICATE_API_TOKEN"):
+        return
+    try:
+        _poll_due(r)
+    except Exception as e:
+        logger.warning(f"Prediction poll failed: {e}")
+    if r.eval(_CONTINUE_SCRIPT, 2, PENDING_KEY, POLLER_LOCK, _lock_ttl()):
+        poll_predictions.apply_async(countdown=PREDICTION_POLL_INTERVAL)
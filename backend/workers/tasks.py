@@ -1,33 +1,34 @@
 import os
 import logging
-import uuid
-from typing import Optional, Any, List, TypedDict
-import httpx
-from celery.result import AsyncResult
+import concurrent.futures
+import json
+import time
+from typing import Optional, Any, Awaitable, Callable, Dict, List, Tuple
+from celery import states
+from celery.exceptions import Ignore, SoftTimeLimitExceeded
+from celery.signals import task_failure, task_postrun, task_revoked, task_success, worker_process_shutdown
+from celery.worker.request import Request
 from backend.celery_app import celery_app
+from backend.core.blobs import resolve_blob_inputs
+from backend.core.cancel import TaskCancelled, TaskTimedOut, is_cancelled
+from backend.core.cache import release_inflight, store_cached_result
+from backend.core.events import publish_task_event
+from backend.core.clients import get_http_client, get_openai_client, get_replicate_client, close_all, sdk
+from backend.core.config import CANCEL_POLL_INTERVAL, LIMIT_MAX_DEFERRALS, WORKER_EXECUTION_MODE
+from backend.core import credits, fairshare, metrics
+from backend.core.models import ModelSpec
+from backend.core.limits import Throttled, acquire_slot, is_rate_limited, release_slot
+from backend.core.retry import hedge_delay, is_retryable, policy_for, record_latency
+from backend.core.redis import get_redis_client
+from backend.core.status import status_ttl
+from backend.workers import async_engine
+from backend.workers.client import RunResult, _spec_for
+from backend.workers.ledger import settle_job
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-try:
-    import replicate  # type: ignore
-except Exception:
-    replicate = None  # type: ignore
-
-try:
-    from openai import OpenAI  # type: ignore
-except Exception:
-    OpenAI = None  # type: ignore
-
-class RunResult(TypedDict):
-    model: str
-    prompt: str
-    user_id: str
-    output_url: Optional[str]
-    status: str # "processing", "completed" or "failed"
-    error: Optional[str]
-
 def _first_url_from(obj: Any) -> Optional[str]:
     """Extract the first plausible URL from various SDK responses."""
     if obj is None:
@@ -50,70 +51,278 @@ def _first_url_from(obj: Any) -> Optional[str]:
                 if u:
                     return u
         return None
+    # SDK response objects, e.g. openai.types.Image
+    url = getattr(obj, "url", None)
+    if isinstance(url, str) and url.startswith("http"):
+        return url
     return None
 
-def _run_replicate_sdxl_sync(prompt: str, **kwargs) -> Optional[str]:
-    api_token = os.getenv("REPLICATE_API_TOKEN")
-    if not api_token or replicate is None:
-        logger.error("Replicate API token missing or library not installed")
-        return None
-    model_version = "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c71dcde277882d13b833d5c75deae501615"
-    
+def _sdxl_input(prompt: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
     input_payload = {"prompt": prompt}
-    
-    if "aspect_ratio" in kwargs: input_payload["aspect_ratio"] = kwargs["aspect_ratio"]
-    if "guidance_scale" in kwargs: input_payload["guidance_scale"] = kwargs["guidance_scale"]
-    if "seed" in kwargs: input_payload["seed"] = kwargs["seed"]
-    if "safety_tolerance" in kwargs: input_payload["safety_tolerance"] = kwargs["safety_tolerance"]
+    for k in ("aspect_ratio", "guidance_scale", "seed", "safety_tolerance"):
+        if k in kwargs:
+            input_payload[k] = kwargs[k]
+    return input_payload
+
+def _replicate_input(prompt: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    inputs = {"prompt": prompt}
+    inputs.update(kwargs)
+    if "prompt" not in inputs or not inputs["prompt"]:
+        inputs["prompt"] = prompt
+    return inputs
+
+def _replicate_error_message(e: Exception, slug: str) -> str:
+    # If we get a specific "Failed to authenticate user DB record" error from Replicate
+    # it usually means the model is private or doesn't exist, or the token is invalid.
+    # However, for "Nano Banana Pro", if it's a private model, we need to ensure the token has access.
+    # It could also be a confusing error message from Replicate for "Model not found".
+    error_msg = str(e)
+    if "Failed to authenticate user DB record" in error_msg:
+        error_msg = f"Authentication failed for model {slug}. Please check if the model exists and your Replicate token has access."
+    return error_msg
+
+def _http_endpoint(spec: ModelSpec) -> Optional[Tuple[str, Dict[str, str]]]:
+    if not spec.target:
+        key = spec.id.upper().replace("-", "_")
+        logger.warning(f"No HTTP URL configured for model {spec.id} (HTTP_MODEL_{key}_URL)")
+        return None
+    headers = {"Content-Type": "application/json"}
+    if spec.auth:
+        headers["Authorization"] = spec.auth
+    return spec.target, headers
+
+def _create_prediction(client: Any, ref: str, inputs: Dict[str, Any], **params: Any) -> Any:
+    model, _, version = ref.partition(":")
+    if version:
+        return client.predictions.create(version=version, input=inputs, **params)
+    return client.models.predictions.create(model=model, input=inputs, **params)
+
+def _replicate_predict(client: Any, ref: str, inputs: Dict[str, Any]) -> Any:
+    """Like client.run, but an interrupted wait (soft time limit, revoke) cancels the prediction upstream."""
+    prediction = _create_prediction(client, ref, inputs)
+    try:
+        while prediction.status not in async_engine.REPLICATE_FINAL:
+            time.sleep(client.poll_interval)
+            prediction.reload()
+    except BaseException:
+        try:
+            prediction.cancel()
+        except Exception as e:
+            logger.warning(f"Could not cancel Replicate prediction {prediction.id}: {e}")
+        raise
+    if prediction.status == "failed":
+        raise sdk("replicate").exceptions.ModelError(prediction.error)
+    if prediction.status == "canceled":
+        raise TaskCancelled(f"Replicate prediction {prediction.id} was cancelled")
+    return prediction.output
 
+# Sync runners: (spec, prompt, params) -> (output_url, error message).
+# They swallow provider errors but must let interrupts through.
+INTERRUPTS = (SoftTimeLimitExceeded, TaskCancelled)
+
+
+def _run_replicate_sdxl_sync(spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    api_token = os.getenv("REPLICATE_API_TOKEN")
+    if not api_token or sdk("replicate") is None:
+        logger.error("Replicate API token missing or library not installed")
+        return None, None
     try:
-        output: Any = replicate.run(model_version, input=input_payload)  # type: ignore
-        return _first_url_from(output)
+        output: Any = _replicate_predict(get_replicate_client(api_token), spec.target, _sdxl_input(prompt, kwargs))
+        return _first_url_from(output), None
+    except INTERRUPTS:
+        raise
     except Exception as e:
+        if is_retryable("replicate", e):
+            raise
         logger.exception(f"Replicate SDXL error: {e}")
-        return None
+        return None, None
 
-def _run_openai_image_sync(model_name: str, prompt: str) -> Optional[str]:
+def _run_openai_images_sync(model_name: str, prompt: str, n: int = 1) -> List[Optional[str]]:
     api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key or OpenAI is None:
+    if not api_key or sdk("openai") is None:
         logger.error("OpenAI API key missing or library not installed")
-        return None
+        return []
     try:
-        client = OpenAI(api_key=api_key)  # type: ignore
-        resp = client.images.generate(model=model_name, prompt=prompt, n=1, size="1024x1024")  # type: ignore
+        client = get_openai_client(api_key)
+        resp = client.images.generate(model=model_name, prompt=prompt, n=n, size="1024x1024")  # type: ignore
         data: List[Any] = getattr(resp, "data", [])
         if data and isinstance(data, list):
-            return _first_url_from(data[0])
-        return None
+            return [_first_url_from(d) for d in data]
+        return []
+    except INTERRUPTS:
+        raise
     except Exception as e:
+        if is_retryable("openai", e):
+            raise
         logger.exception(f"OpenAI Image error ({model_name}): {e}")
-        return None
+        return []
 
-def _run_generic_http_sync(model_key: str, prompt: str) -> Optional[str]:
-    key = model_key.upper().replace("-", "_")
-    url = os.getenv(f"HTTP_MODEL_{key}_URL")
-    if not url:
-        logger.warning(f"No HTTP URL configured for model {model_key} (HTTP_MODEL_{key}_URL)")
-        return None
-    headers = {"Content-Type": "application/json"}
-    auth = os.getenv(f"HTTP_MODEL_{key}_AUTH")
-    if auth:
-        headers["Authorization"] = auth
+def _run_openai_image_sync(spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    urls = _run_openai_images_sync(spec.target, prompt, 1)
+    return (urls[0] if urls else None), None
+
+def _run_replicate_sync(spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    api_token = os.getenv("REPLICATE_API_TOKEN")
+    if sdk("replicate") is None or not api_token:
+        return None, "Missing Replicate config"
+    inputs = _replicate_input(prompt, kwargs)
+    logger.info(f"Running Replicate model {spec.target} with keys: {list(inputs.keys())}")
+    try:
+        output: Any = _replicate_predict(get_replicate_client(api_token), spec.target, inputs)
+        return _first_url_from(output), None
+    except INTERRUPTS:
+        raise
+    except Exception as e:
+        if is_retryable("replicate", e):
+            raise
+        logger.exception(f"Replicate error: {e}")
+        return None, _replicate_error_message(e, spec.target)
+
+def _run_generic_http_sync(spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    endpoint = _http_endpoint(spec)
+    if not endpoint:
+        return None, None
+    url, headers = endpoint
     try:
-        with httpx.Client(timeout=60) as client:
-            resp = client.post(url, json={"prompt": prompt}, headers=headers)
-            resp.raise_for_status()
-            data = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else None
-            return _first_url_from(data)
+        resp = get_http_client(url).post(url, json={"prompt": prompt}, headers=headers)
+        resp.raise_for_status()
+        data = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else None
+        return _first_url_from(data), None
+    except INTERRUPTS:
+        raise
     except Exception as e:
-        logger.exception(f"Generic HTTP error for {model_key}: {e}")
+        if is_retryable("http", e):
+            raise
+        logger.exception(f"Generic HTTP error for {spec.id}: {e}")
+        return None, None
+
+# Async runners: event-loop counterparts that raise instead of returning an error message
+
+async def _run_replicate_sdxl_async(spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Any:
+    return await async_engine.replicate_run(spec.target, _sdxl_input(prompt, kwargs))
+
+async def _run_openai_image_async(spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Any:
+    return await async_engine.openai_image(spec.target, prompt)
+
+async def _run_replicate_async(spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Any:
+    inputs = _replicate_input(prompt, kwargs)
+    logger.info(f"Running Replicate model {spec.target} with keys: {list(inputs.keys())}")
+    try:
+        return await async_engine.replicate_run(spec.target, inputs)
+    except INTERRUPTS:
+        raise
+    except Exception as e:
+        if is_retryable("replicate", e):
+            raise
+        raise Exception(_replicate_error_message(e, spec.target)) from e
+
+async def _run_generic_http_async(spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Any:
+    endpoint = _http_endpoint(spec)
+    if not endpoint:
         return None
+    url, headers = endpoint
+    return await async_engine.http_post_json(url, {"prompt": prompt}, headers)
+
+# Dispatch tables keyed by ModelSpec.kind (see core/models.py)
+SYNC_RUNNERS: Dict[str, Callable[[ModelSpec, str, Dict[str, Any]], Tuple[Optional[str], Optional[str]]]] = {
+    "replicate_sdxl": _run_replicate_sdxl_sync,
+    "openai_image": _run_openai_image_sync,
+    "replicate": _run_replicate_sync,
+    "http": _run_generic_http_sync,
+}
+ASYNC_RUNNERS: Dict[str, Callable[[ModelSpec, str, Dict[str, Any]], Awaitable[Any]]] = {
+    "replicate_sdxl": _run_replicate_sdxl_async,
+    "openai_image": _run_openai_image_async,
+    "replicate": _run_replicate_async,
+    "http": _run_generic_http_async,
+}
+
+async def _run_model_async(spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Optional[str]:
+    return _first_url_from(await ASYNC_RUNNERS[spec.kind](spec, prompt, kwargs))
+
+def _call_provider(task_id: str, spec: ModelSpec, prompt: str, kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Run the model once; returns (output_url, error message).
+
+    Hedged models always go through the event loop, whatever the execution mode,
+    so the losing attempt can be cancelled. Calls on the loop are not reached
+    by revoke's signal, so they poll the task's cancel flag instead.
+    """
+    delay = hedge_delay(spec.id)
+    if WORKER_EXECUTION_MODE == "async" or delay is not None:
+        attempt = async_engine.hedged(lambda: _run_model_async(spec, prompt, kwargs), delay)
+        started = time.monotonic()
+        try:
+            output_url = async_engine.run_coroutine(
+                async_engine.cancellable(attempt, lambda: is_cancelled(task_id), CANCEL_POLL_INTERVAL), timeout=spec.timeout
+            )
+        except (TimeoutError, concurrent.futures.TimeoutError):
+            # Distinct classes before Python 3.11, where future.result() raises the latter
+            if time.monotonic() - started < spec.timeout:
+                raise
+            raise TaskTimedOut(f"{spec.id} did not finish within {spec.timeout:.0f}s") from None
+        return output_url, None
+    return SYNC_RUNNERS[spec.kind](spec, prompt, kwargs)
+
+def _was_cancelled(task_id: str, e: BaseException) -> bool:
+    # revoke(terminate) interrupts prefork workers with SIGUSR1, which Celery
+    # reports as SoftTimeLimitExceeded; the cancel flag tells it from a real timeout
+    return isinstance(e, TaskCancelled) or (isinstance(e, SoftTimeLimitExceeded) and is_cancelled(task_id))
+
+def _cancelled_result(task_id: str, model: str, prompt: str, user_id: str, cache_key: Optional[str]) -> RunResult:
+    if cache_key:
+        release_inflight(cache_key, task_id)
+    publish_task_event(task_id, "cancelled", model=model)
+    return {"model": model, "prompt": prompt, "user_id": user_id, "output_url": None, "status": "cancelled", "error": "Cancelled"}
+
+# Admission deferrals, provider 429s and transient errors each have their own
+# retry budget. Celery's request.retries counts every re-publish, so the
+# per-kind counts travel in a message header instead.
+RETRY_COUNTS_HEADER = "karate_retry_counts"
+
+def _retry_counts(request: Any) -> Dict[str, int]:
+    # Custom headers surface as request attributes on workers, under .headers when eager
+    counts = getattr(request, RETRY_COUNTS_HEADER, None) or (request.headers or {}).get(RETRY_COUNTS_HEADER)
+    return dict(counts or {})
+
+def _retries(request: Any, kind: str) -> int:
+    return int(_retry_counts(request).get(kind, 0))
+
+def _retry(task: Any, kind: str, countdown: float) -> Exception:
+    counts = _retry_counts(task.request)
+    counts[kind] = counts.get(kind, 0) + 1
+    return task.retry(countdown=countdown, headers={RETRY_COUNTS_HEADER: counts})
+
+def _observe_result_size(model: str, result: Dict[str, Any]) -> None:
+    metrics.RESULT_SIZE_BYTES.labels(metrics.model_label(model)).observe(len(json.dumps(result, separators=(",", ":"))))
+
+class ModelRequest(Request):
+    """Worker-side request of model tasks.
+
+    A hard time limit kills the job with no task_failure or task_postrun signal,
+    so its cleanup runs from the timeout handler in the main worker process.
+    """
+
+    def on_timeout(self, soft, timeout):
+        super().on_timeout(soft, timeout)
+        if not soft:
+            _abandon(self.id, self.args, self.kwargs, f"Hard time limit ({timeout}s) exceeded")
+
+@celery_app.task(bind=True, name="backend.workers.tasks.process_ai_task", max_retries=None, Request=ModelRequest)
+def process_ai_task(self, model: str, prompt: str, user_id: str, cache_key: Optional[str] = None, speculative: bool = False, **kwargs):
+    if is_cancelled(self.request.id):
+        # Cancelled while queued, on a worker that missed the revoke broadcast
+        return _cancelled_result(self.request.id, model, prompt, user_id, cache_key)
+    spec = _spec_for(model)
+    provider = spec.provider
+    try:
+        lease = acquire_slot(provider, model)
+    except Throttled as t:
+        # Provider is saturated: put the job back on its queue instead of failing it
+        if _retries(self.request, "deferred") < LIMIT_MAX_DEFERRALS:
+            metrics.TASK_RETRIES.labels(provider, "deferred").inc()
+            raise _retry(self, "deferred", t.retry_after)
+        lease = None
 
-@celery_app.task(bind=True, name="backend.workers.tasks.process_ai_task")
-def process_ai_task(self, model: str, prompt: str, user_id: str, **kwargs):
-    output_url: Optional[str] = None
-    error_msg: Optional[str] = None
-    
     # Store initial state in task meta
     self.update_state(state='PROCESSING', meta={
         "model": model, 
@@ -121,46 +330,27 @@ def process_ai_task(self, model: str, prompt: str, user_id: str, **kwargs):
         "user_id": user_id,
         "status": "processing"
     })
+    publish_task_event(self.request.id, "processing", model=model, stage="started")
 
+    outcome = "ok"
+    started = time.monotonic()
     try:
-        if model == "stable-diffusion-3.5":
-             output_url = _run_replicate_sdxl_sync(prompt, **kwargs)
-        elif model == "dalle-3":
-             output_url = _run_openai_image_sync("dall-e-3", prompt)
-        elif model == "gpt-image-1":
-             output_url = _run_openai_image_sync("gpt-image-1", prompt)
+        if provider == "replicate":
+            # Blob handles become URLs or data URIs only now, never in the broker message
+            kwargs = resolve_blob_inputs(kwargs)
+        from backend.workers import predictions
+        # Speculative jobs are not counted in fair share, which a hand-off would release
+        if not speculative and predictions.can_hand_off(spec, self.request):
+            # Frees the worker (raises Ignore) unless the prediction is already done
+            output_url, error_msg = predictions.hand_off(self.request.id, spec, prompt, kwargs, lease, user_id, cache_key)
         else:
-            # Slug logic
-            env_key = f"REPLICATE_{model.upper().replace('-', '_').replace('/', '_')}"
-            slug = os.getenv(env_key, model)
-
-            if "/" in slug:
-                if replicate is not None and os.getenv("REPLICATE_API_TOKEN"):
-                    inputs = {"prompt": prompt}
-                    inputs.update(kwargs)
-                    if "prompt" not in inputs or not inputs["prompt"]:
-                        inputs["prompt"] = prompt
-
-                    logger.info(f"Running Replicate model {slug} with keys: {list(inputs.keys())}")
-                    try:
-                        output: Any = replicate.run(slug, input=inputs)
-                        output_url = _first_url_from(output)
-                    except Exception as e:
-                        # If we get a specific "Failed to authenticate user DB record" error from Replicate
-                        # it usually means the model is private or doesn't exist, or the token is invalid.
-                        # However, for "Nano Banana Pro", if it's a private model, we need to ensure the token has access.
-                        # It could also be a confusing error message from Replicate for "Model not found".
-                        logger.exception(f"Replicate error: {e}")
-                        error_msg = str(e)
-                        if "Failed to authenticate user DB record" in error_msg:
-                             error_msg = f"Authentication failed for model {slug}. Please check if the model exists and your Replicate token has access."
-                else:
-                    error_msg = "Missing Replicate config"
-            else:
-                output_url = _run_generic_http_sync(model, prompt)
+            output_url, error_msg = _call_provider(self.request.id, spec, prompt, kwargs)
 
         if output_url:
-            return {
+            elapsed = time.monotonic() - started
+            record_latency(model, elapsed)
+            metrics.PROVIDER_LATENCY_SECONDS.labels(provider, metrics.model_label(model), "ok").observe(elapsed)
+            result = {
                 "model": model,
                 "prompt": prompt,
                 "user_id": user_id,
@@ -168,17 +358,53 @@ def process_ai_task(self, model: str, prompt: str, user_id: str, **kwargs):
                 "status": "completed",
                 "error": None
             }
+            if cache_key:
+                store_cached_result(cache_key, result)
+                release_inflight(cache_key, self.request.id)
+            publish_task_event(self.request.id, "completed", model=model, output_url=output_url)
+            _observe_result_size(model, result)
+            return result
         else:
             # Fail implicitly if no URL but no exception
             raise Exception(error_msg or "No output URL generated")
 
+    except Ignore:
+        # Handed off: the lease and fair-share slot now belong to the pending prediction
+        lease = None
+        raise
     except Exception as e:
+        if _was_cancelled(self.request.id, e):
+            outcome = "cancelled"
+            logger.info(f"Task {self.request.id} ({model}) cancelled")
+            return _cancelled_result(self.request.id, model, prompt, user_id, cache_key)
+        if isinstance(e, SoftTimeLimitExceeded):
+            e = TaskTimedOut(f"{model} did not finish within {spec.timeout:.0f}s")
+        metrics.PROVIDER_LATENCY_SECONDS.labels(provider, metrics.model_label(model), "error").observe(time.monotonic() - started)
+        metrics.PROVIDER_FAILURES.labels(provider, metrics.error_class(e)).inc()
+        policy = policy_for(provider)
+        throttled = _retries(self.request, "rate_limited")
+        if is_rate_limited(e) and throttled < LIMIT_MAX_DEFERRALS:
+            outcome = "throttled"
+            logger.warning(f"Provider rate limited {model}; deferring")
+            metrics.TASK_RETRIES.labels(provider, "rate_limited").inc()
+            raise _retry(self, "rate_limited", policy.delay(throttled))
+        outcome = "error"
+        attempt = _retries(self.request, "transient")
+        if is_retryable(provider, e) and not is_rate_limited(e) and attempt < policy.max_retries:
+            metrics.TASK_RETRIES.labels(provider, "transient").inc()
+            logger.warning(f"Transient error from {model} (attempt {attempt + 1}): {e}; retrying")
+            publish_task_event(self.request.id, "processing", model=model, stage="retrying", attempt=attempt + 1)
+            raise _retry(self, "transient", policy.delay(attempt))
         logger.exception(f"Task failed: {e}")
         # Celery handles exception state automatically if we raise, 
         # but we want to return a structured error result often.
         # However, raising lets Celery retry if configured. 
         # For now, let's return a failed structure.
-        return {
+        publish_task_event(self.request.id, "failed", model=model, error=str(e))
+        if cache_key:
+            # Let the next identical request run afresh instead of attaching to this failure
+            release_inflight(cache_key, self.request.id)
+        failed = {
             "model": model,
             "prompt": prompt,
             "user_id": user_id,
@@ -186,35 +412,169 @@ def process_ai_task(self, model: str, prompt: str, user_id: str, **kwargs):
             "status": "failed",
             "error": str(e)
         }
+        _observe_result_size(model, failed)
+        return failed
+    finally:
+        release_slot(lease, outcome)
 
-# Compatibility layer for API
-async def run_ai_model_background(model: str, prompt: str, user_id: str, **kwargs) -> str:
-    # .delay() is the standard way to call Celery tasks
-    task = process_ai_task.delay(model, prompt, user_id, **kwargs)
-    return task.id
+@celery_app.task(bind=True, name="backend.workers.tasks.process_ai_multi_task", max_retries=None, Request=ModelRequest)
+def process_ai_multi_task(self, model: str, prompt: str, user_id: str, n: int, **kwargs):
+    """Serve ``n`` coalesced batch items with one upstream call; returns one RunResult per item."""
+    error_msg: Optional[str] = None
+    urls: List[Optional[str]] = []
+    status: Optional[str] = None
+    if is_cancelled(self.request.id):
+        return _multi_result(self.request.id, model, prompt, user_id, n, [], "Cancelled", "cancelled")
+    spec = _spec_for(model)
+    provider = spec.provider
+    try:
+        lease = acquire_slot(provider, model)
+    except Throttled as t:
+        if _retries(self.request, "deferred") < LIMIT_MAX_DEFERRALS:
+            metrics.TASK_RETRIES.labels(provider, "deferred").inc()
+            raise _retry(self, "deferred", t.retry_after)
+        lease = None
+    self.update_state(state='PROCESSING', meta={"model": model, "user_id": user_id, "status": "processing"})
+    publish_task_event(self.request.id, "processing", model=model, stage="started", outputs=n)
 
-def get_task_status(task_id: str) -> Optional[RunResult]:
+    outcome = "ok"
+    started = time.monotonic()
     try:
-        result = AsyncResult(task_id, app=celery_app)
-        if result.ready():
-            # If it returned a dict (success or handled failure)
-            data = result.result
-            if isinstance(data, dict):
-                return data
-            # If it raised an exception unhandled
-            elif isinstance(data, Exception):
-                 return {
-                    "model": "unknown", "prompt": "", "user_id": "", 
-                    "output_url": None, "status": "failed", "error": str(data)
-                }
+        if spec.kind != "openai_image" or n > spec.max_outputs:
+            raise ValueError(f"Model {model} does not support {n} outputs per call")
+        if WORKER_EXECUTION_MODE == "async":
+            coro = async_engine.openai_images(spec.target, prompt, n)
+            data = async_engine.run_coroutine(
+                async_engine.cancellable(coro, lambda: is_cancelled(self.request.id), CANCEL_POLL_INTERVAL), timeout=spec.timeout
+            )
+            urls = [_first_url_from(d) for d in data]
         else:
-            # Processing
-            # Try to get meta info if available?
-            return {
-                "model": "unknown", "prompt": "", "user_id": "",
-                "output_url": None, "status": "processing", "error": None
-            }
+            urls = _run_openai_images_sync(spec.target, prompt, n)
+        metrics.PROVIDER_LATENCY_SECONDS.labels(provider, metrics.model_label(model), "ok").observe(time.monotonic() - started)
     except Exception as e:
-        logger.error(f"Error fetching status: {e}")
-        return None
-    return None
+        if _was_cancelled(self.request.id, e):
+            outcome, status, error_msg = "cancelled", "cancelled", "Cancelled"
+        else:
+            if isinstance(e, SoftTimeLimitExceeded):
+                e = TaskTimedOut(f"{model} did not finish within {spec.timeout:.0f}s")
+            metrics.PROVIDER_LATENCY_SECONDS.labels(provider, metrics.model_label(model), "error").observe(time.monotonic() - started)
+            metrics.PROVIDER_FAILURES.labels(provider, metrics.error_class(e)).inc()
+            policy = policy_for(provider)
+            throttled = _retries(self.request, "rate_limited")
+            if is_rate_limited(e) and throttled < LIMIT_MAX_DEFERRALS:
+                outcome = "throttled"
+                metrics.TASK_RETRIES.labels(provider, "rate_limited").inc()
+                raise _retry(self, "rate_limited", policy.delay(throttled))
+            outcome = "error"
+            attempt = _retries(self.request, "transient")
+            if is_retryable(provider, e) and not is_rate_limited(e) and attempt < policy.max_retries:
+                metrics.TASK_RETRIES.labels(provider, "transient").inc()
+                raise _retry(self, "transient", policy.delay(attempt))
+            logger.exception(f"Multi-output task failed: {e}")
+            error_msg = str(e)
+    finally:
+        release_slot(lease, outcome)
+    return _multi_result(self.request.id, model, prompt, user_id, n, urls, error_msg, status)
+
+def _multi_result(task_id: str, model: str, prompt: str, user_id: str, n: int, urls: List[Optional[str]],
+                  error_msg: Optional[str], status: Optional[str] = None) -> Dict[str, Any]:
+    results: List[RunResult] = []
+    for i in range(n):
+        url = urls[i] if i < len(urls) else None
+        results.append({
+            "model": model,
+            "prompt": prompt,
+            "user_id": user_id,
+            "output_url": url,
+            "status": status or ("completed" if url else "failed"),
+            "error": None if url else (error_msg or "No output URL generated"),
+        })
+    status = status or ("completed" if all(r["status"] == "completed" for r in results) else "failed")
+    publish_task_event(task_id, status, model=model, outputs=n)
+    output = {"status": status, "results": results}
+    _observe_result_size(model, output)
+    return output
+
+@task_success.connect
+def _expire_failed_results(sender=None, result=None, **_):
+    # Handled failures and cancellations are returned, not raised, so Celery
+    # stores them like successes; give them their state's shorter TTL
+    if sender is None or sender.name not in (process_ai_task.name, process_ai_multi_task.name):
+        return
+    if not isinstance(result, dict) or result.get("status") not in ("failed", "cancelled"):
+        return
+    r = get_redis_client()
+    if r is None:
+        return
+    try:
+        r.expire(celery_app.backend.get_key_for_task(sender.request.id), status_ttl(result["status"]))
+    except Exception as e:
+        logger.debug(f"Could not shorten TTL of failed result {sender.request.id}: {e}")
+
+@task_postrun.connect
+def _release_fair_share(sender=None, task_id=None, args=None, kwargs=None, state=None, **_):
+    # A retried or handed-off job is still outstanding; it is released when it finally ends
+    if sender is None or sender.name not in (process_ai_task.name, process_ai_multi_task.name) or state in (states.RETRY, states.IGNORED):
+        return
+    if (kwargs or {}).get("speculative"):
+        return
+    user_id = args[2] if args and len(args) > 2 else (kwargs or {}).get("user_id")
+    fairshare.release(user_id, task_id)
+
+@task_postrun.connect
+def _settle_credits(sender=None, task_id=None, args=None, kwargs=None, retval=None, state=None, **_):
+    # Completed outputs are charged, everything else held for the job is released
+    if sender is None or sender.name not in (process_ai_task.name, process_ai_multi_task.name) or state in (states.RETRY, states.IGNORED):
+        return
+    args, kwargs = args or [], kwargs or {}
+    user_id = args[2] if len(args) > 2 else kwargs.get("user_id")
+    charge = 0
+    if state == states.SUCCESS and isinstance(retval, dict):
+        if sender.name == process_ai_multi_task.name:
+            model = args[0] if args else kwargs.get("model", "")
+            done = sum(1 for r in retval.get("results", []) if r.get("status") == "completed")
+            charge = done * _spec_for(model).cost
+        elif retval.get("status") == "completed":
+            charge = None  # the whole hold
+    settle_job(user_id, task_id, charge)
+
+@task_revoked.connect
+def _release_revoked(sender=None, request=None, terminated=False, **_):
+    # Jobs revoked before they started never reach task_postrun; terminated
+    # ones finish through it (as cancelled) and are released there
+    if terminated or sender is None or sender.name not in (process_ai_task.name, process_ai_multi_task.name):
+        return
+    args, kwargs = request.args or [], request.kwargs or {}
+    user_id = args[2] if len(args) > 2 else kwargs.get("user_id")
+    if not kwargs.get("speculative"):
+        fairshare.release(user_id, request.id)
+    credits.refund(user_id, request.id)
+    if kwargs.get("cache_key"):
+        release_inflight(kwargs["cache_key"], request.id)
+
+def _abandon(task_id: str, args: Any, kwargs: Any, error: str) -> None:
+    # Cleanup for a job that failed outside the task's own handling. Its
+    # task_postrun may never run (worker process died, hard time limit), so
+    # everything it would have released is released here; each step is idempotent
+    args, kwargs = args or [], kwargs or {}
+    user_id = args[2] if len(args) > 2 else kwargs.get("user_id")
+    publish_task_event(task_id, "failed", model=args[0] if args else None, error=error)
+    fairshare.release(user_id, task_id)
+    settle_job(user_id, task_id, 0)
+    if kwargs.get("cache_key"):
+        # Let the next identical request run afresh instead of joining the dead task
+        release_inflight(kwargs["cache_key"], task_id)
+
+@task_failure.connect
+def _record_failure(sender=None, task_id=None, exception=None, args=None, kwargs=None, **_):
+    # Handled failures are returned and published by the task itself; this
+    # covers tasks that raised or whose worker died, which would otherwise keep
+    # a "processing" status record (and stream) until it expires
+    if sender is None or sender.name not in (process_ai_task.name, process_ai_multi_task.name):
+        return
+    _abandon(task_id, args, kwargs, str(exception) or type(exception).__name__)
+
+@worker_process_shutdown.connect
+def _close_provider_clients(**_):
+    close_all()
+    async_engine.shutdown()
@@ -0,0 +1,301 @@
+import json
+import logging
+import uuid
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backend.celery_app import celery_app
+from backend.core import credits
+from backend.core.blobs import BLOB_SCHEME
+from backend.core.cache import get_cached_result, is_cacheable, make_cache_key
+from backend.core.config import WORKFLOW_TTL
+from backend.core.events import publish_task_event
+from backend.core.models import get_registry, resolve
+from backend.core.redis import get_redis_client
+from backend.core.status import record_queued
+from backend.workers.client import PROCESS_AI_TASK, _spec_for, enqueue_options, send_model_task
+
+logger = logging.getLogger(__name__)
+
+# Server-side execution of create_workflow graphs (see SYSTEM_PROMPT in api/v1/agents.py).
+#
+# Nothing waits on a worker: every model node is an ordinary process_ai_task
+# whose link callback (workflow_node_done) records the output and, through an
+# atomic per-node counter of unfinished upstream nodes, dispatches each
+# successor the moment its last input lands. Independent branches therefore run
+# concurrently and end-to-end latency follows the critical path. A task that
+# raises or dies instead (hard time limit, lost worker) triggers its link_error
+# callback (workflow_node_failed), which fails the node the same way.
+
+# Nodes that only carry data; mirrors runNode in the editor canvas
+SOURCE_NODE_TYPES = {"prompt", "text", "image", "imageUpload"}
+NODE_TYPE_MODELS = {
+    "stableDiffusion": "stable-diffusion-3.5",
+    "upscale": "esrgan",
+    "inpaint": "google/nano-banana-inpaint",
+}
+NODE_PARAMS = ("image", "mask", "aspect_ratio", "guidance_scale", "output_format", "safety_tolerance", "seed", "scale")
+TERMINAL_NODE_STATUSES = ("completed", "failed", "skipped")
+
+WORKFLOW_PREFIX = "karate:workflow:"
+
+
+class WorkflowError(ValueError):
+    pass
+
+
+def _is_url(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(("http", "/", "data:", BLOB_SCHEME))
+
+
+def _node_model(node: Dict[str, Any]) -> Optional[str]:
+    data = node.get("data") or {}
+    for candidate in (data.get("model"), data.get("slug"), NODE_TYPE_MODELS.get(node.get("type", ""))):
+        if candidate:
+            return candidate
+    label = str(data.get("label") or "").lower().replace(" ", "-")
+    return label if label in get_registry() else None
+
+
+def _node_params(data: Dict[str, Any]) -> Dict[str, Any]:
+    params = {k: data[k] for k in NODE_PARAMS if data.get(k) is not None}
+    if not params.get("image") and data.get("imageSrc"):
+        params["image"] = data["imageSrc"]
+    scale = params.get("scale")
+    if isinstance(scale, str):
+        digits = scale.lower().rstrip("x")
+        params["scale"] = int(digits) if digits.isdigit() else scale
+    return params
+
+
+def plan_workflow(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Normalize a create_workflow graph and check that it is a DAG.
+
+    Returns {"nodes": {id: spec}, "upstream": {id: [ids]}, "downstream": {id: [ids]}, "order": [ids]}.
+    """
+    specs: Dict[str, Dict[str, Any]] = {}
+    unresolved = []
+    for node in nodes:
+        node_id = str(node.get("id", ""))
+        if not node_id or node_id in specs:
+            raise WorkflowError(f"Missing or duplicate node id: {node_id!r}")
+        data = node.get("data") or {}
+        node_type = node.get("type", "")
+        if node_type in SOURCE_NODE_TYPES:
+            value = data.get("prompt") if node_type == "prompt" else data.get("text") if node_type == "text" else (data.get("imageSrc") or data.get("output"))
+            specs[node_id] = {"type": node_type, "source": True, "value": value}
+            continue
+        model = _node_model(node)
+        if not model or resolve(model) is None:
+            unresolved.append(node_id)
+            continue
+        specs[node_id] = {
+            "type": node_type,
+            "source": False,
+            "model": model,
+            "prompt": data.get("prompt") or "",
+            "params": _node_params(data),
+            "output": data.get("output") if _is_url(data.get("output")) else None,
+        }
+    if unresolved:
+        raise WorkflowError(f"Cannot resolve a model for nodes {unresolved}")
+
+    upstream: Dict[str, List[str]] = {n: [] for n in specs}
+    downstream: Dict[str, List[str]] = {n: [] for n in specs}
+    for edge in edges:
+        src, dst = str(edge.get("source", "")), str(edge.get("target", ""))
+        if src not in specs or dst not in specs:
+            raise WorkflowError(f"Edge {edge.get('id', '')!r} references an unknown node")
+        # Data nodes are leaves: the editor ignores their inputs, so do we
+        if specs[dst]["source"] or src in upstream[dst]:
+            continue
+        upstream[dst].append(src)
+        downstream[src].append(dst)
+
+    indegree = {n: len(ups) for n, ups in upstream.items()}
+    queue = deque(n for n, d in indegree.items() if d == 0)
+    order: List[str] = []
+    while queue:
+        n = queue.popleft()
+        order.append(n)
+        for m in downstream[n]:
+            indegree[m] -= 1
+            if indegree[m] == 0:
+                queue.append(m)
+    if len(order) != len(specs):
+        raise WorkflowError("Workflow graph contains a cycle")
+    return {"nodes": specs, "upstream": upstream, "downstream": downstream, "order": order}
+
+
+def node_inputs(spec: Dict[str, Any], upstream_outputs: Iterable[Any]) -> Tuple[str, Dict[str, Any]]:
+    """Fold upstream outputs into (prompt, params): URLs become the image, text becomes the prompt."""
+    params = dict(spec["params"])
+    texts = []
+    for output in upstream_outputs:
+        if _is_url(output):
+            params["image"] = output
+        elif output:
+            texts.append(str(output))
+    prompt = " ".join(texts) if texts else spec["prompt"]
+    return prompt, params
+
+
+def _keys(workflow_id: str) -> Tuple[str, str, str]:
+    base = WORKFLOW_PREFIX + workflow_id
+    return base, base + ":pending", base + ":nodes"
+
+
+def _load(r: Any, workflow_id: str) -> Optional[Dict[str, Any]]:
+    meta = r.hgetall(_keys(workflow_id)[0])
+    if not meta:
+        return None
+    return {"plan": json.loads(meta["plan"]), "user_id": meta["user_id"], "rerun": json.loads(meta.get("rerun", "[]")),
+            "reuse_outputs": meta.get("reuse_outputs") == "1"}
+
+
+def start_workflow(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]], user_id: str,
+                   reuse_outputs: bool = True, rerun: Iterable[str] = ()) -> str:
+    plan = plan_workflow(nodes, edges)
+    r = get_redis_client()
+    if r is None:
+        raise RuntimeError("Redis unavailable")
+    workflow_id = str(uuid.uuid4())
+    meta_key, pending_key, nodes_key = _keys(workflow_id)
+    pipe = r.pipeline()
+    pipe.hset(meta_key, mapping={
+        "plan": json.dumps(plan, separators=(",", ":")),
+        "user_id": user_id,
+        "rerun": json.dumps(list(rerun)),
+        "reuse_outputs": "1" if reuse_outputs else "0",
+    })
+    pipe.hset(nodes_key, mapping={n: json.dumps({"status": "pending"}) for n in plan["order"]})
+    pending = {n: len(ups) for n, ups in plan["upstream"].items() if ups}
+    if pending:
+        pipe.hset(pending_key, mapping=pending)
+    for key in (meta_key, pending_key, nodes_key):
+        pipe.expire(key, WORKFLOW_TTL)
+    pipe.execute()
+
+    state = {"plan": plan, "user_id": user_id, "rerun": list(rerun), "reuse_outputs": reuse_outputs}
+    for node_id in plan["order"]:
+        if not plan["upstream"][node_id]:
+            _run_node(r, workflow_id, state, node_id)
+    return workflow_id
+
+
+def _run_node(r: Any, workflow_id: str, state: Dict[str, Any], node_id: str) -> None:
+    plan = state["plan"]
+    spec = plan["nodes"][node_id]
+    if spec["source"]:
+        _node_finished(r, workflow_id, state, node_id, {"status": "completed", "output": spec["value"]})
+        return
+    if state["reuse_outputs"] and spec.get("output") and node_id not in state["rerun"]:
+        _node_finished(r, workflow_id, state, node_id, {"status": "completed", "output": spec["output"], "cached": True})
+        return
+
+    ups = plan["upstream"][node_id]
+    records = [json.loads(v) if v else None for v in r.hmget(_keys(workflow_id)[2], ups)] if ups else []
+    if any(rec is None or rec.get("status") != "completed" for rec in records):
+        _node_finished(r, workflow_id, state, node_id, {"status": "skipped", "error": "Upstream node did not complete"})
+        return
+
+    prompt, params = node_inputs(spec, [rec.get("output") for rec in records])
+    cache_key = None
+    if is_cacheable(params):
+        cache_key = make_cache_key(spec["model"], prompt, params)
+        cached = get_cached_result(cache_key)
+        if cached and cached.get("output_url"):
+            _node_finished(r, workflow_id, state, node_id, {"status": "completed", "output": cached["output_url"], "cached": True})
+            return
+
+    task_id = str(uuid.uuid4())
+    try:
+        credits.reserve(state["user_id"], task_id, _spec_for(spec["model"]).cost)
+    except credits.InsufficientCredits as e:
+        _node_finished(r, workflow_id, state, node_id, {"status": "failed", "error": str(e)})
+        return
+    # Record the node before enqueueing so a fast callback cannot be overwritten
+    r.hset(_keys(workflow_id)[2], node_id, json.dumps({"status": "processing", "task_id": task_id}))
+    record_queued([(task_id, spec["model"])])
+    send_model_task(
+        PROCESS_AI_TASK,
+        [spec["model"], prompt, state["user_id"]],
+        dict(params, cache_key=cache_key),
+        link=workflow_node_done.s(workflow_id, node_id),
+        link_error=workflow_node_failed.s(workflow_id, node_id),
+        task_id=task_id,
+        **enqueue_options(spec["model"], state["user_id"], "interactive", task_id),
+    )
+    publish_task_event(workflow_id, "progress", node_id=node_id, node_status="processing", node_task_id=task_id)
+
+
+def _node_finished(r: Any, workflow_id: str, state: Dict[str, Any], node_id: str, record: Dict[str, Any]) -> None:
+    meta_key, pending_key, nodes_key = _keys(workflow_id)
+    r.hset(nodes_key, node_id, json.dumps(record))
+    publish_task_event(workflow_id, "progress", node_id=node_id, node_status=record["status"],
+                       output_url=record.get("output") if _is_url(record.get("output")) else None, error=record.get("error"))
+
+    for successor in state["plan"]["downstream"][node_id]:
+        # Exactly one finishing parent sees the counter reach zero
+        if r.hincrby(pending_key, successor, -1) == 0:
+            _run_node(r, workflow_id, state, successor)
+
+    status = get_workflow_status(workflow_id, r)
+    if status and status["status"] != "processing" and r.hsetnx(meta_key, "finished", status["status"]):
+        publish_task_event(workflow_id, status["status"])
+
+
+@celery_app.task(name="backend.workers.workflows.workflow_node_done")
+def workflow_node_done(result: Dict[str, Any], workflow_id: str, node_id: str):
+    r = get_redis_client()
+    state = _load(r, workflow_id) if r is not None else None
+    if state is None:
+        logger.warning(f"Workflow {workflow_id} expired before node {node_id} finished")
+        return
+    result = result or {}
+    record = {"status": "completed" if result.get("status") == "completed" else "failed",
+              "output": result.get("output_url"), "error": result.get("error")}
+    _node_finished(r, workflow_id, state, node_id, record)
+
+
+@celery_app.task(name="backend.workers.workflows.workflow_node_failed")
+def workflow_node_failed(task_id: str, workflow_id: str, node_id: str):
+    """Errback of a node's task: it raised or was killed, so workflow_node_done never runs."""
+    r = get_redis_client()
+    state = _load(r, workflow_id) if r is not None else None
+    if state is None:
+        logger.warning(f"Workflow {workflow_id} expired before node {node_id} failed")
+        return
+    raw = r.hget(_keys(workflow_id)[2], node_id)
+    current = json.loads(raw) if raw else {}
+    # Only the attempt the node is waiting on may finish it, and only once
+    if current.get("status") != "processing" or current.get("task_id") != task_id:
+        return
+    try:
+        error = str(celery_app.AsyncResult(task_id).result or "")
+    except Exception:
+        error = ""
+    _node_finished(r, workflow_id, state, node_id, {"status": "failed", "output": None,
+                                                      "error": error or f"Task {task_id} failed"})
+
+
+def get_workflow_status(workflow_id: str, r: Any = None) -> Optional[Dict[str, Any]]:
+    r = r or get_redis_client()
+    if r is None:
+        return None
+    meta_key, _, nodes_key = _keys(workflow_id)
+    pipe = r.pipeline()
+    pipe.hget(meta_key, "plan")
+    pipe.hgetall(nodes_key)
+    plan_raw, raw_nodes = pipe.execute()
+    if not plan_raw:
+        return None
+    plan = json.loads(plan_raw)
+    records = {n: json.loads(v) for n, v in (raw_nodes or {}).items()}
+    nodes = {n: records.get(n, {"status": "pending"}) for n in plan["order"]}
+
+    if all(rec["status"] in TERMINAL_NODE_STATUSES for rec in nodes.values()):
+        status = "completed" if all(rec["status"] == "completed" for rec in nodes.values()) else "failed"
+    else:
+        status = "processing"
+    return {"workflow_id": workflow_id, "status": status, "nodes": nodes}
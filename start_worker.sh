@@ -35,5 +35,7 @@ fi
 # PYTHONPATH must include project root so "backend" module is found
 export PYTHONPATH=$PYTHONPATH:$(pwd)
 
-celery -A backend.celery_app worker --loglevel=info
+# Queues are cost tiers (fast, standard, heavy); run dedicated workers per tier
+# in production, e.g. CELERY_QUEUES=heavy ./start_worker.sh
+celery -A backend.celery_app worker --loglevel=info -Q "${CELERY_QUEUES:-fast,standard,heavy}"
 